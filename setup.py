@@ -38,7 +38,8 @@ setup(
     package_data={"upgrade_testing": ["data/*"]},
     entry_points={
         "console_scripts": [
-            "auto-upgrade-testing = upgrade_testing.command_line:main"
+            "auto-upgrade-testing = upgrade_testing.command_line:main",
+            "auto-upgrade-results = upgrade_testing.results_command_line:main",
         ]
     },
 )
@@ -18,21 +18,63 @@
 #
 
 import datetime
+import itertools
 import logging
 import os
+import re
+import sqlite3
 import subprocess
 import sys
 import tempfile
+import time
 from argparse import ArgumentParser
+from contextlib import ExitStack, contextmanager
+from functools import partial
 
 import junitparser
 import yaml
 
-from upgrade_testing.configspec import definition_reader
+from upgrade_testing.configspec import (
+    definition_reader,
+    format_schedule,
+    plan_schedule,
+    plan_shared_upgrades,
+)
 from upgrade_testing.preparation import (
+    get_testbed_meta_release_location,
     get_testbed_storage_location,
     prepare_test_environment,
 )
+from upgrade_testing.provisioning import (
+    CHECKPOINT_PHASES,
+    DEFAULT_BUILD_JOBS,
+    parallel_builds,
+    wait_for_build,
+)
+from upgrade_testing.results import (
+    EVENTS_FILE_NAME,
+    TRANSIENT,
+    ArtifactStore,
+    BatchReport,
+    LogIndex,
+    PackageTimings,
+    PhaseTracker,
+    RunHistory,
+    Watchdog,
+    classify_failure,
+    format_package_timings,
+    format_upgrader_profile,
+    phases_from_events,
+    profile_upgrader_logs,
+    read_abort_reason,
+    read_classification,
+    read_events,
+    run_and_track_events,
+    run_events,
+    throughput,
+    write_abort_reason,
+    write_classification,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -76,10 +118,38 @@ def parse_args():
         action="store_true",
         help="Provision a new image regardless of cache.",
     )
+    parser.add_argument(
+        "--build-jobs",
+        "-j",
+        type=int,
+        default=DEFAULT_BUILD_JOBS,
+        help="Maximum number of images to provision in parallel.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the order images would be built and suites run in, "
+        "with estimated times, without running anything.",
+    )
     parser.add_argument(
         "--results-dir",
         help="Directory to store results generated during the run.",
     )
+    parser.add_argument(
+        "--report-dir",
+        help="Write a combined JUnit, Markdown and HTML report of all the "
+        "suites to this directory, updated as each suite finishes.",
+    )
+    parser.add_argument(
+        "--log-index",
+        help="Add the logs of each run to the full-text index in this "
+        "database.",
+    )
+    parser.add_argument(
+        "--artifact-store",
+        help="Move the artifacts of each run into the deduplicated store "
+        "in this directory.",
+    )
     parser.add_argument(
         "--adt-args",
         "-a",
@@ -93,10 +163,27 @@ def parse_args():
         action="store_true",
         help="Whether to keep the resulting overlay image",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--resume-from",
+        choices=CHECKPOINT_PHASES + ("latest",),
+        help="Resume from the latest checkpoint taken after this phase in "
+        "the kept overlay (requires --keep-overlay).",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="How many times to retry a suite failing for reasons outside "
+        "the upgrade (e.g. a mirror or network error or a testbed that "
+        "didn't boot), from its latest checkpoint when it took any.",
+    )
+    args = parser.parse_args()
+    if args.resume_from and not args.keep_overlay:
+        parser.error("--resume-from requires --keep-overlay")
+    return args
 
 
-def get_output_dir(args):
+def get_output_dir(args, suite_name=None):
     # This will be updated to take in the directory in which to create it in
     # and will be renamed create_... as all it will do is create the ts dir.
     """Return directory path that the results should be put into.
@@ -106,7 +193,9 @@ def get_output_dir(args):
     dir.
 
     Within this base dir a timestamped directory will be created in which the
-    output will reside.
+    output will reside. It is named after `suite_name` too, and is always a
+    new directory, so suites started in the same second (e.g. in parallel)
+    never share one.
 
     """
     if args.results_dir is not None:
@@ -116,11 +205,19 @@ def get_output_dir(args):
         logger.info("Creating folder for results.")
 
     ts_dir = datetime.datetime.now().strftime("%Y%m%d.%H%M%S")
-    full_path = os.path.join(os.path.abspath(base_dir), ts_dir)
-
-    logger.info("Creating results dir: {}".format(full_path))
-    os.makedirs(full_path, exist_ok=True)
-
+    if suite_name:
+        ts_dir = "{}.{}".format(ts_dir, re.sub(r"[^\w.-]", "_", suite_name))
+    base_path = os.path.join(os.path.abspath(base_dir), ts_dir)
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    full_path = base_path
+    for count in itertools.count(2):
+        try:
+            os.mkdir(full_path)
+            break
+        except FileExistsError:
+            full_path = "{}.{}".format(base_path, count)
+
+    logger.info("Created results dir: {}".format(full_path))
     return full_path
 
 
@@ -128,46 +225,213 @@ def display_results(output_dir, exit_status):
     artifacts_directory = os.path.join(output_dir, "artifacts", "upgrade_run")
     logger.info("Results can be found here: {}".format(artifacts_directory))
 
-    results_yaml = os.path.join(artifacts_directory, "runner_results.yaml")
-    with open(results_yaml, "r") as f:
-        results = yaml.safe_load(f)
+    results = _read_runner_results(artifacts_directory)
+    upgrader_profiles = _read_upgrader_profiles(artifacts_directory)
 
     # this can be html/xml/whatver
     test_suite = junitparser.TestSuite("Auto Upgrade Testing")
     output = []
     output.append("Pre script results:")
-    for test, result in results.get("pre_script_output", {}).items():
-        output.append("\t{test}: {result}".format(test=test, result=result))
-        test_case = junitparser.TestCase(test)
-        if result == "FAIL":
-            test_case.result = [junitparser.Failure("Test Failed")]
+    for test_case in _script_test_cases(
+        results, "pre_script_output", "pre_script_usage", output
+    ):
         test_suite.add_testcase(test_case)
 
     output.append("Upgrade result: ")
+    properties = _upgrader_properties(upgrader_profiles)
+    properties.update(_failure_properties(output_dir, output))
+    test_suite.add_testcase(
+        _upgrade_test_case(
+            exit_status, read_abort_reason(output_dir), properties, output
+        )
+    )
+
+    output.append("Post upgrade test results:")
+    for test_case in _script_test_cases(
+        results, "post_test_output", "post_test_usage", output
+    ):
+        test_suite.add_testcase(test_case)
+
+    output.extend(_format_phase_timings(artifacts_directory))
+    for profile in upgrader_profiles:
+        output.append("Upgrader phases ({}):".format(profile.log))
+        output.extend(format_upgrader_profile(profile))
+    output.extend(_format_package_timings(artifacts_directory))
+
+    xml = junitparser.JUnitXml()
+    xml.add_testsuite(test_suite)
+    # An aborted run may not have got as far as copying the artifacts.
+    os.makedirs(artifacts_directory, exist_ok=True)
+    xml.write(os.path.join(artifacts_directory, "junit.xml"))
+    print("\n".join(output))
+
+
+def _read_runner_results(artifacts_directory):
+    results_yaml = os.path.join(artifacts_directory, "runner_results.yaml")
+    try:
+        with open(results_yaml, "r") as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        logger.error("No test results found in {}".format(results_yaml))
+        return {}
+
+
+def _read_upgrader_profiles(artifacts_directory):
+    try:
+        return profile_upgrader_logs(artifacts_directory)
+    except (OSError, RuntimeError) as e:
+        logger.warning("Unable to read the upgrader logs: {}".format(e))
+        return []
+
+
+def _upgrader_properties(profiles):
+    """Return the upgrader phase durations as JUnit properties."""
+    properties = {}
+    for number, profile in enumerate(profiles, 1):
+        for phase in profile.phases:
+            name = "upgrader{}_{}_seconds".format(number, phase.name)
+            properties[name] = round(phase.end - phase.start, 1)
+        rate = throughput(profile)
+        if rate is not None:
+            name = "upgrader{}_download_bytes_per_second".format(number)
+            properties[name] = int(rate)
+    return properties
+
+
+def _failure_properties(output_dir, output):
+    """Return how a failure was classified as JUnit properties."""
+    classification = read_classification(output_dir)
+    if classification is None:
+        return {}
+    output.append(
+        "\t{} failure in {} (attempt {}): {}".format(
+            classification["label"],
+            classification["phase"] or "an unknown phase",
+            classification["attempt"],
+            classification["reason"],
+        )
+    )
+    if classification["retry"]:
+        output.append(
+            "\tRetrying from {}".format(
+                "the latest checkpoint"
+                if classification["retry"] == "checkpoint"
+                else "a fresh testbed"
+            )
+        )
+    properties = {
+        "failure_class": classification["label"],
+        "failure_reason": classification["reason"],
+        "attempt": classification["attempt"],
+    }
+    if classification["phase"]:
+        properties["failed_phase"] = classification["phase"]
+    return properties
+
+
+def _upgrade_test_case(exit_status, abort_reason, properties, output):
     autopkgtest_upgrade = junitparser.TestCase("upgrade")
-    if exit_status.returncode == 0:
+    if properties:
+        junit_properties = junitparser.Properties()
+        for name, value in properties.items():
+            junit_properties.add_property(
+                junitparser.Property(name, str(value))
+            )
+        autopkgtest_upgrade.append(junit_properties)
+    if abort_reason:
+        output.append("\tABORTED: {}".format(abort_reason))
+        autopkgtest_upgrade.result = [
+            junitparser.Failure("Aborted by watchdog: {}".format(abort_reason))
+        ]
+    elif exit_status.returncode == 0:
         output.append("\tPASS")
     else:
         output.append(f"\tFAIL: {exit_status}")
         autopkgtest_upgrade.result = [junitparser.Failure(f"{exit_status}")]
-    test_suite.add_testcase(autopkgtest_upgrade)
+    return autopkgtest_upgrade
 
-    output.append("Post upgrade test results:")
-    for test, result in results.get("post_test_output", {}).items():
-        output.append("\t{test}: {result}".format(test=test, result=result))
+
+def _script_test_cases(results, section, usage_section, output):
+    """Return the JUnit test cases for a results section.
+
+    The script's duration becomes the case time and the rest of its
+    resource usage (when recorded) case properties.
+
+    """
+    test_cases = []
+    all_usage = results.get(usage_section) or {}
+    for test, result in (results.get(section) or {}).items():
+        usage = dict(all_usage.get(test) or {})
+        duration = usage.pop("duration", None)
         test_case = junitparser.TestCase(test)
+        if duration is None:
+            output.append(
+                "\t{test}: {result}".format(test=test, result=result)
+            )
+        else:
+            output.append("\t{}: {} ({:.1f}s)".format(test, result, duration))
+            test_case.time = duration
+        if usage:
+            properties = junitparser.Properties()
+            for name, value in sorted(usage.items()):
+                properties.add_property(junitparser.Property(name, str(value)))
+            test_case.append(properties)
         if result == "FAIL":
             test_case.result = [junitparser.Failure("Test Failed")]
-        test_suite.add_testcase(test_case)
+        test_cases.append(test_case)
+    return test_cases
 
-    xml = junitparser.JUnitXml()
-    xml.add_testsuite(test_suite)
-    xml.write(os.path.join(artifacts_directory, "junit.xml"))
-    print("\n".join(output))
+
+def _format_phase_timings(artifacts_directory):
+    phases = phases_from_events(
+        read_events(os.path.join(artifacts_directory, EVENTS_FILE_NAME))
+    )
+    if not phases:
+        return []
+    return ["Phase timings:"] + [
+        "\t{}: {:.1f}s ({})".format(phase.name, phase.duration, phase.status)
+        for phase in phases
+    ]
+
+
+def _format_package_timings(artifacts_directory):
+    timings = PackageTimings()
+    timings.add_run(artifacts_directory)
+    return format_package_timings(timings, count=5)
+
+
+def index_logs(db_path, output_dir, suite=None, releases=None):
+    """Add a run's logs to the index, returning whether that worked."""
+    try:
+        with LogIndex(db_path) as index:
+            index.add_run(output_dir, suite, releases)
+    except (OSError, RuntimeError, sqlite3.Error) as e:
+        logger.error(
+            "Unable to index the logs of {}: {}".format(output_dir, e)
+        )
+        return False
+    return True
+
+
+def store_artifacts(store_dir, output_dir):
+    """Move a run's artifacts into the store, keeping them if that fails."""
+    try:
+        ArtifactStore(store_dir).ingest(output_dir)
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.error(
+            "Unable to store the artifacts of {}: {}".format(output_dir, e)
+        )
+        return False
+    return True
 
 
 def execute_adt_run(
-    testsuite, testrun_files, output_dir, adt_args="", keep_overlay=False
+    testsuite,
+    testrun_files,
+    output_dir,
+    adt_args="",
+    keep_overlay=False,
+    resume_from=None,
 ):
     """Prepare the autopkgtest to execute.
 
@@ -178,15 +442,38 @@ def execute_adt_run(
     """
     # we can change 'test_source_retriever' so that it uses the testurn_files
     # and doesn't need to worry about cleanup.
-    adt_run_command = get_adt_run_command(
-        testsuite.provisioning,
-        testrun_files,
-        output_dir,
-        testsuite.backend_args,
-        adt_args,
-        keep_overlay,
+    try:
+        adt_run_command = get_adt_run_command(
+            testsuite.provisioning,
+            testrun_files,
+            output_dir,
+            testsuite.backend_args,
+            adt_args,
+            keep_overlay,
+            resume_from,
+        )
+    except (RuntimeError, TimeoutError) as e:
+        logger.error("Unable to start {}: {}".format(testsuite.name, e))
+        return subprocess.CompletedProcess([], 1, stderr=str(e))
+    watchdog = None
+    if testsuite.watchdog.enabled:
+        watchdog = Watchdog(testsuite.watchdog)
+    tracker = PhaseTracker()
+
+    def on_event(event):
+        tracker(event)
+        testsuite.provisioning.on_testbed_event(event)
+
+    # Follow the upgrade script's progress events as autopkgtest runs.
+    exit_status = run_and_track_events(
+        adt_run_command,
+        on_event,
+        watchdog,
+        testbed_pid=testsuite.provisioning.testbed_pid(),
     )
-    return subprocess.run(adt_run_command)
+    if watchdog is not None and watchdog.abort_reason:
+        write_abort_reason(output_dir, watchdog.abort_reason)
+    return exit_status
 
 
 def get_adt_run_command(
@@ -196,6 +483,7 @@ def get_adt_run_command(
     backend_args=[],
     adt_args="",
     keep_overlay=False,
+    resume_from=None,
 ):
     """Construct the adt command to run.
 
@@ -227,6 +515,15 @@ def get_adt_run_command(
     )
     adt_cmd.append(copy_cmd)
 
+    # Copy across the meta-release files and upgrader the host prepared.
+    if testrun_files.meta_release_mirror is not None:
+        adt_cmd.append(
+            "--copy={src}:{dest}/".format(
+                src=testrun_files.meta_release_mirror,
+                dest=get_testbed_meta_release_location(),
+            )
+        )
+
     # Need to get some env vars across to the testbed. Namely tests to run and
     # test locations.
     adt_cmd.append(
@@ -238,7 +535,9 @@ def get_adt_run_command(
 
     backend_args = (
         provisioning.get_adt_run_args(
-            tmp_dir=testrun_files.testrun_tmp_dir, keep_overlay=keep_overlay
+            tmp_dir=testrun_files.testrun_tmp_dir,
+            keep_overlay=keep_overlay,
+            resume_from=resume_from,
         )
         + backend_args
     )
@@ -250,64 +549,292 @@ def main():
     setup_logging()
     args = parse_args()
 
+    history = RunHistory()
+    test_def_details, build_order = plan_run(
+        read_config(args.config), args, history
+    )
+
+    returncode = 0
+    report = BatchReport(args.report_dir) if args.report_dir else None
+    with ExitStack() as stack:
+        environments = [
+            (
+                testsuite,
+                stack.enter_context(prepare_test_environment(testsuite)),
+            )
+            for testsuite in test_def_details
+        ]
+        backend_ready = stack.enter_context(
+            provision_backends(environments, args, history, build_order)
+        )
+
+        for testsuite, created_files in environments:
+            if not backend_ready(testsuite):
+                returncode = returncode or 1
+                if report is not None:
+                    report.add_suite(testsuite.name, "NOT-RUN", 0)
+                continue
+
+            exit_status = run_testsuite(
+                testsuite, created_files, args, report, history
+            )
+            returncode = returncode or exit_status.returncode
+
+    sys.exit(returncode)
+
+
+def read_config(config):
+    """Return the testsuites of a config file, exiting if it is invalid."""
     try:
-        test_def_details = definition_reader(args.config)
+        return definition_reader(config)
     except KeyError as e:
         logger.error(
             "Unable to parse configuration file ({}): key {} not found".format(
-                args.config, e
+                config, e
             )
         )
         sys.exit(1)
     except ValueError as e:
         logger.error(
             "Unable to parse configuration file details from config {}.\n"
-            "ERROR: {}".format(args.config, e)
+            "ERROR: {}".format(config, e)
         )
         sys.exit(1)
 
-    # For each test definition ensure that the required backend is available,
-    # if not either error or create it (depending on args.)
-    for testsuite in test_def_details:
-        # TODO: This could be improved to look something like:
-        # testuite.provisioning.prepare(provision=create)
-        # Note this could raise an exception.
-
-        with prepare_test_environment(testsuite) as created_files:
-            if (
-                args.force_provision
-                or not testsuite.provisioning.backend_available()
+
+def plan_run(test_def_details, args, history):
+    """Order the testsuites and image builds of a run.
+
+    With args.plan the schedule is printed and the command exits.
+
+    :returns: The testsuites in the order to run them and the build keys
+      of the images in the order to build them.
+
+    """
+    _configure_checkpoints(test_def_details, args)
+    if args.keep_overlay and not args.resume_from:
+        test_def_details = plan_shared_upgrades(test_def_details)
+    schedule = plan_schedule(
+        test_def_details,
+        history,
+        lambda t: not args.force_provision
+        and t.provisioning.backend_available(),
+        args.build_jobs,
+    )
+    if args.plan:
+        print("\n".join(format_schedule(schedule, args.build_jobs)))
+        if schedule.builds and not args.provision:
+            print("Suites needing a build only run with --provision.")
+        sys.exit(0)
+    return (
+        [run.testsuite for run in schedule.runs],
+        [build.build_key for build in schedule.builds],
+    )
+
+
+def run_testsuite(testsuite, created_files, args, report=None, history=None):
+    """Run a testsuite and report its results, returning the exit status.
+
+    A failure classified as transient is retried, up to args.retries times,
+    each attempt with its own output directory.
+
+    :param report: Optional BatchReport to add the suite's results to.
+    :param history: Optional RunHistory to record how long it took in.
+
+    """
+    # Setup output dir
+    first_output_dir = output_dir = get_output_dir(args, testsuite.name)
+    resume_from = args.resume_from
+    for attempt in range(1, args.retries + 2):
+        if attempt > 1:
+            output_dir = "{}.attempt{}".format(first_output_dir, attempt)
+            os.makedirs(output_dir, exist_ok=True)
+        started = time.monotonic()
+        exit_status = _run_attempt(
+            testsuite, created_files, output_dir, args, resume_from, history
+        )
+        retry = _classify_attempt(
+            testsuite, output_dir, exit_status, args, attempt, resume_from
+        )
+        name = testsuite.name
+        if attempt > 1:
+            name = "{} (attempt {})".format(name, attempt)
+        _report_attempt(
+            testsuite, name, output_dir, exit_status, args, report, started
+        )
+        if retry is None:
+            return exit_status
+        resume_from = "latest" if retry == "checkpoint" else None
+        logger.warning(
+            "Retrying {} from {}".format(
+                testsuite.name, resume_from or "a fresh testbed"
+            )
+        )
+    return exit_status
+
+
+def _run_attempt(
+    testsuite, created_files, output_dir, args, resume_from, history
+):
+    started = time.monotonic()
+    # Closing releases what the run was given (e.g. the vm we launched), also
+    # when the run is interrupted.
+    try:
+        exit_status = execute_adt_run(
+            testsuite,
+            created_files,
+            output_dir,
+            args.adt_args,
+            args.keep_overlay,
+            resume_from,
+        )
+    finally:
+        testsuite.provisioning.close()
+    # Only complete runs tell how long a suite takes.
+    if history is not None and exit_status.returncode == 0:
+        history.record_run(testsuite, time.monotonic() - started)
+    return exit_status
+
+
+def _classify_attempt(
+    testsuite, output_dir, exit_status, args, attempt, resume_from
+):
+    """Classify a failed attempt, returning how to retry it or None.
+
+    Transient failures are retried from the latest checkpoint when the
+    attempt had one to start from or took one, on a fresh testbed otherwise.
+
+    """
+    classification = classify_failure(output_dir, exit_status)
+    if classification is None:
+        return None
+    retry = None
+    if classification.label == TRANSIENT and attempt <= args.retries:
+        retry = "fresh"
+        if args.keep_overlay and testsuite.provisioning.checkpoints:
+            if resume_from or any(
+                event["event"] == "checkpoint"
+                for event in run_events(output_dir)
             ):
-                if args.provision:
-                    logger.debug("Provising backend.")
-                    testsuite.provisioning.set_verbose(args.verbose_provision)
-                    testsuite.provisioning.create(created_files.adt_base_path)
-                else:
-                    logger.error(
-                        "No available backend for test: {}".format(
-                            testsuite.name
-                        )
-                    )
-                    continue
-            else:
-                logger.info("Backend is available.")
-
-            # Setup output dir
-            output_dir = get_output_dir(args)
-
-            exit_status = execute_adt_run(
-                testsuite,
-                created_files,
-                output_dir,
-                args.adt_args,
-                args.keep_overlay,
+                retry = "checkpoint"
+    write_classification(output_dir, classification, attempt, retry)
+    return retry
+
+
+def _report_attempt(
+    testsuite, name, output_dir, exit_status, args, report, started
+):
+    display_results(output_dir, exit_status)
+    if report is not None:
+        report.add_suite(
+            name,
+            _suite_status(output_dir, exit_status),
+            time.monotonic() - started,
+            output_dir,
+        )
+    if args.log_index:
+        index_logs(
+            args.log_index,
+            output_dir,
+            testsuite.name,
+            testsuite.provisioning.releases,
+        )
+    if args.artifact_store:
+        store_artifacts(args.artifact_store, output_dir)
+
+
+def _suite_status(output_dir, exit_status):
+    if read_abort_reason(output_dir):
+        return "ABORTED"
+    return "PASS" if exit_status.returncode == 0 else "FAIL"
+
+
+def _configure_checkpoints(test_def_details, args):
+    """Only take checkpoints where we launch the vm, on a kept overlay."""
+    if args.keep_overlay:
+        return
+    for testsuite in test_def_details:
+        if testsuite.provisioning.checkpoints:
+            logger.warning(
+                "Not taking checkpoints for {} without --keep-overlay".format(
+                    testsuite.name
+                )
             )
+            testsuite.provisioning.checkpoints = False
+
+
+@contextmanager
+def provision_backends(environments, args, history=None, build_order=()):
+    """Ensure the backends for the testsuites are available.
+
+    Missing images are provisioned (if requested) in the background, one
+    build per distinct image, up to args.build_jobs at a time and in
+    `build_order`, so suites whose backend is available can run meanwhile.
+
+    :param environments: list of (testsuite, TestrunTempFiles) tuples.
+    :param history: Optional RunHistory to record build durations in.
+    :param build_order: The build keys in the order to build them.
+    :returns: A function returning whether a testsuite's backend is ready,
+      waiting for its build first if need be.
+
+    """
+    builds, suite_keys = _collect_builds(
+        environments, args, history, build_order
+    )
+    results = {None: None}
+    with parallel_builds(builds, args.build_jobs) as futures:
+
+        def backend_ready(testsuite):
+            if testsuite not in suite_keys:
+                return False
+            key = suite_keys[testsuite]
+            if key not in results:
+                results[key] = wait_for_build(key, futures[key])
+            return results[key] is None
 
-            testsuite.provisioning.close()
+        yield backend_ready
 
-        display_results(output_dir, exit_status)
 
-        sys.exit(exit_status.returncode)
+def _collect_builds(environments, args, history, build_order):
+    """Return the builds needed, in order, and each suite's build key.
+
+    The build key is None for suites that are ready to run, suites that
+    can't run are left out.
+
+    """
+    builds = {key: None for key in build_order}
+    suite_keys = {}
+    for testsuite, created_files in environments:
+        provisioning = testsuite.provisioning
+        if not args.force_provision and provisioning.backend_available():
+            logger.info("Backend is available.")
+            suite_keys[testsuite] = None
+            continue
+        if not args.provision:
+            logger.error(
+                "No available backend for test: {}".format(testsuite.name)
+            )
+            continue
+        logger.debug("Provising backend.")
+        provisioning.set_verbose(args.verbose_provision)
+        suite_keys[testsuite] = provisioning.build_key
+        if builds.get(provisioning.build_key) is None:
+            builds[provisioning.build_key] = partial(
+                _build_backend, provisioning, created_files, args, history
+            )
+    builds = {key: build for key, build in builds.items() if build}
+    return builds, suite_keys
+
+
+def _build_backend(provisioning, created_files, args, history):
+    started = time.monotonic()
+    built = provisioning.create(
+        created_files.adt_base_path, force=args.force_provision
+    )
+    if built and history is not None:
+        history.record_build(
+            provisioning.build_key, time.monotonic() - started
+        )
 
 
 if __name__ == "__main__":
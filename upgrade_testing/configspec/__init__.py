@@ -19,10 +19,15 @@
 
 from upgrade_testing.configspec._config import definition_reader
 from upgrade_testing.configspec._filecopy import test_source_retriever
+from upgrade_testing.configspec._schedule import format_schedule, plan_schedule
+from upgrade_testing.configspec._upgradetree import plan_shared_upgrades
 from upgrade_testing.configspec._utils import get_file_data_location
 
 __all__ = [
     "definition_reader",
+    "format_schedule",
     "get_file_data_location",
+    "plan_schedule",
+    "plan_shared_upgrades",
     "test_source_retriever",
 ]
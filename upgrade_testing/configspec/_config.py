@@ -22,12 +22,37 @@ from collections import namedtuple
 
 import yaml
 
-from upgrade_testing.provisioning import ProvisionSpecification
+from upgrade_testing.provisioning import ProvisionSpecification, parse_size
 
 logger = logging.getLogger(__name__)
 
 
-ScriptStore = namedtuple("ScriptStore", ["executables", "location"])
+ScriptStore = namedtuple("ScriptStore", ["executables", "location", "options"])
+# How a pre/post script may be run, see README.rst.
+ScriptOptions = namedtuple("ScriptOptions", ["parallel", "depends", "timeout"])
+DEFAULT_SCRIPT_OPTIONS = ScriptOptions(
+    parallel=False, depends=[], timeout=None
+)
+# Which files are archived from the testbed into the results, in addition to
+# the defaults (dist-upgrade logs, dpkg.log and the apt/update-manager config).
+# A size of 0 means no cap.
+CollectSettings = namedtuple(
+    "CollectSettings",
+    ["exclude", "extra_paths", "max_file_size", "max_total_size"],
+)
+WatchdogSettings = namedtuple(
+    "WatchdogSettings",
+    ["enabled", "fatal_patterns", "stall_timeout", "min_cpu_load"],
+)
+# Output that means the run can no longer pass. Only what the testbed prints
+# reaches autopkgtest, the guest's console (e.g. a kernel panic) doesn't.
+DEFAULT_FATAL_PATTERNS = [
+    r"dpkg was interrupted, you must manually run",
+    r"E: Sub-process /usr/bin/dpkg returned an error code",
+    r"Could not calculate the upgrade",
+]
+# Seconds without output or CPU progress before a run counts as stalled.
+DEFAULT_STALL_TIMEOUT = 1800
 
 
 class TestSpecification:
@@ -55,19 +80,29 @@ class TestSpecification:
             details, self.provisioning._provisionconfig_path
         )
 
-        self.pre_upgrade_scripts = ScriptStore(
-            *_generate_script_list(
-                details["pre_upgrade_scripts"], self.scripts_location
-            )
+        self.pre_upgrade_scripts = _get_script_store(
+            details["pre_upgrade_scripts"], self.scripts_location
         )
-        self.post_upgrade_tests = ScriptStore(
-            *_generate_script_list(
-                details["post_upgrade_tests"], self.scripts_location
-            )
+        self.post_upgrade_tests = _get_script_store(
+            details["post_upgrade_tests"], self.scripts_location
         )
+        # The most scripts marked parallel that may run at once.
+        self.script_jobs = int(details.get("script_jobs", 1))
+        # Account each script's resource usage in its own cgroup as well.
+        self.script_cgroups = details.get("script_cgroups", False)
 
         self.scripts_data = details.get("scripts_data", None)
 
+        # Serve the meta-release files and upgrader tarballs to the testbed
+        # from the host instead of each testbed fetching them.
+        self.cache_upgrader = details.get("cache_upgrader", True)
+
+        self.collect_results = _get_collect_settings(
+            details.get("collect_results", {})
+        )
+
+        self.watchdog = _get_watchdog_settings(details.get("watchdog", {}))
+
         backend_args = details.get("backend_args", [])
         self.backend_args = [
             arg.format(scripts_location=self.scripts_location)
@@ -106,6 +141,67 @@ def _get_script_location_path(provision_details, provisionfile_path):
     return location
 
 
+def _get_collect_settings(collect_details):
+    """Return CollectSettings from the testdef 'collect_results' details."""
+    return CollectSettings(
+        exclude=list(collect_details.get("exclude", [])),
+        extra_paths=list(collect_details.get("extra_paths", [])),
+        max_file_size=parse_size(collect_details.get("max_file_size", 0)),
+        max_total_size=parse_size(collect_details.get("max_total_size", 0)),
+    )
+
+
+def _get_watchdog_settings(watchdog_details):
+    """Return WatchdogSettings from the testdef 'watchdog' details."""
+    return WatchdogSettings(
+        enabled=watchdog_details.get("enabled", True),
+        fatal_patterns=DEFAULT_FATAL_PATTERNS
+        + list(watchdog_details.get("fatal_patterns", [])),
+        stall_timeout=int(
+            watchdog_details.get("stall_timeout", DEFAULT_STALL_TIMEOUT)
+        ),
+        min_cpu_load=float(watchdog_details.get("min_cpu_load", 0.1)),
+    )
+
+
+def _get_script_store(scripts_or_path, script_source_path=None):
+    """Return a ScriptStore for the declared scripts.
+
+    Scripts may be declared as a path, a list of names or a list mixing
+    names with dicts holding a 'name' and the script's options.
+
+    :raises ValueError: If a script depends on one not declared before it.
+
+    """
+    options = {}
+    if isinstance(scripts_or_path, list):
+        names = []
+        for entry in scripts_or_path:
+            if isinstance(entry, dict):
+                options[entry["name"]] = ScriptOptions(
+                    parallel=bool(entry.get("parallel", False)),
+                    depends=list(entry.get("depends", [])),
+                    timeout=entry.get("timeout"),
+                )
+                entry = entry["name"]
+            names.append(entry)
+        scripts_or_path = names
+    executables, location = _generate_script_list(
+        scripts_or_path, script_source_path
+    )
+    options = {
+        name: options.get(name, DEFAULT_SCRIPT_OPTIONS) for name in executables
+    }
+    for index, name in enumerate(executables):
+        for dependency in options[name].depends:
+            if dependency not in executables[:index]:
+                raise ValueError(
+                    'Script "{}" depends on "{}" which is not declared '
+                    "before it".format(name, dependency)
+                )
+    return ScriptStore(executables, location, options)
+
+
 def _generate_script_list(scripts_or_path, script_source_path=None):
     """Return a tuple containing a list of script names and a location string.
 
@@ -0,0 +1,168 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import datetime
+import heapq
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+ScheduledBuild = namedtuple(
+    "ScheduledBuild", ["build_key", "start", "end", "basis"]
+)
+ScheduledRun = namedtuple(
+    "ScheduledRun", ["testsuite", "start", "end", "basis", "build_key"]
+)
+Schedule = namedtuple("Schedule", ["builds", "runs", "completion"])
+
+
+def plan_schedule(testsuites, history, cached, build_jobs=1):
+    """Plan the order images are built and suites run in, with estimates.
+
+    Images are built longest first, `build_jobs` at a time. Suites run one
+    at a time as soon as their image is ready, so those with a cached image
+    go first, and of the suites that are ready the longest goes next. Suites
+    that start from another's upgraded testbed stay right after it.
+
+    :param testsuites: List of TestSpecification, as ordered by
+      plan_shared_upgrades.
+    :param history: RunHistory giving the estimated durations.
+    :param cached: Called with a testsuite, returns whether its image is
+      available without building it.
+    :returns: Schedule, with times in seconds from the start.
+
+    """
+    builds = _plan_builds(
+        {t.provisioning.build_key for t in testsuites if not cached(t)},
+        history,
+        build_jobs,
+    )
+    ready = {build.build_key: build.end for build in builds}
+    units = [
+        (
+            max(ready.get(t.provisioning.build_key, 0) for t in unit),
+            [(t, history.estimate_run(t)) for t in unit],
+        )
+        for unit in _forked_units(testsuites)
+    ]
+    runs = []
+    now = 0
+    while units:
+        unit = _next_unit(units, now)
+        units.remove(unit)
+        now = max(now, unit[0])
+        for testsuite, (duration, basis) in unit[1]:
+            key = testsuite.provisioning.build_key
+            runs.append(
+                ScheduledRun(
+                    testsuite,
+                    now,
+                    now + duration,
+                    basis,
+                    key if key in ready else None,
+                )
+            )
+            now += duration
+    completion = max([now] + [build.end for build in builds])
+    return Schedule(builds, runs, completion)
+
+
+def _plan_builds(build_keys, history, build_jobs):
+    """Place the builds, longest first, on the first free build slot."""
+    estimates = {key: history.estimate_build(key) for key in build_keys}
+    slots = [0] * max(1, build_jobs)
+    builds = []
+    for key in sorted(build_keys, key=lambda k: (-estimates[k][0], k)):
+        start = heapq.heappop(slots)
+        duration, basis = estimates[key]
+        builds.append(ScheduledBuild(key, start, start + duration, basis))
+        heapq.heappush(slots, start + duration)
+    return builds
+
+
+def _forked_units(testsuites):
+    """Group each suite with the suites starting from its testbed."""
+    units = []
+    unit_of = {}
+    for testsuite in testsuites:
+        source = testsuite.provisioning.forked_from
+        if source in unit_of:
+            unit = unit_of[source]
+            unit.append(testsuite)
+        else:
+            unit = [testsuite]
+            units.append(unit)
+        unit_of[testsuite.provisioning] = unit
+    return units
+
+
+def _next_unit(units, now):
+    """Return the longest unit ready by `now`, or else the first ready."""
+    ready = [unit for unit in units if unit[0] <= now]
+    if not ready:
+        first = min(unit[0] for unit in units)
+        ready = [unit for unit in units if unit[0] == first]
+    return max(ready, key=lambda unit: sum(d for _, (d, _) in unit[1]))
+
+
+def format_schedule(schedule, build_jobs=1):
+    """Return the lines describing a Schedule."""
+    output = []
+    if schedule.builds:
+        output.append("Images to build ({} at a time):".format(build_jobs))
+        output.extend(
+            "\t{} -> {} {} ({} estimate)".format(
+                _format_time(build.start),
+                _format_time(build.end),
+                build.build_key,
+                build.basis,
+            )
+            for build in schedule.builds
+        )
+    output.append("Suites:")
+    for run in schedule.runs:
+        image = (
+            "waits for {}".format(run.build_key)
+            if run.build_key
+            else "cached image"
+        )
+        output.append(
+            "\t{} -> {} {} ({}, {} estimate)".format(
+                _format_time(run.start),
+                _format_time(run.end),
+                run.testsuite.name,
+                image,
+                run.basis,
+            )
+        )
+    finish = datetime.datetime.now() + datetime.timedelta(
+        seconds=schedule.completion
+    )
+    output.append(
+        "Estimated completion: {} (at {:%Y-%m-%d %H:%M})".format(
+            _format_time(schedule.completion), finish
+        )
+    )
+    return output
+
+
+def _format_time(seconds):
+    hours, seconds = divmod(int(seconds), 3600)
+    return "{}:{:02d}".format(hours, seconds // 60)
@@ -0,0 +1,134 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def plan_shared_upgrades(testsuites):
+    """Order the testsuites so upgrade paths they share are only run once.
+
+    Suites whose testbeds start out the same (same image, upgrade prompt
+    and pre-upgrade scripts) form a tree of release paths. Each suite forks
+    from the checkpoint of the longest path prefix it shares with a suite
+    planned before it, and that suite is told to take the checkpoints, so
+    every distinct upgrade hop is run once. Each suite is followed by the
+    suites forking from it, so its testbed is still around when they run.
+
+    :param testsuites: List of TestSpecification.
+    :returns: The testsuites in the order they should be run.
+
+    """
+    groups = {}
+    for testsuite in testsuites:
+        groups.setdefault(_sharing_key(testsuite), []).append(testsuite)
+
+    ordered = []
+    for key, group in groups.items():
+        if key is None:
+            ordered.extend(group)
+            continue
+        # Longest paths first so the shorter ones can fork from them.
+        group = sorted(group, key=lambda s: -len(s.provisioning.releases))
+        forks = {}
+        for index, testsuite in enumerate(group):
+            source = _fork_from_longest_prefix(testsuite, group[:index])
+            forks.setdefault(source, []).append(testsuite)
+        ordered.extend(_depth_first(forks, None))
+    return ordered
+
+
+def _depth_first(forks, source):
+    ordered = []
+    for testsuite in forks.get(source, []):
+        ordered.append(testsuite)
+        ordered.extend(_depth_first(forks, testsuite))
+    return ordered
+
+
+def _fork_from_longest_prefix(testsuite, planned):
+    """Arrange for `testsuite` to fork from one of `planned`, if it can.
+
+    :returns: The testsuite it forks from, or None.
+
+    """
+    releases = testsuite.provisioning.releases
+    source = None
+    shared = 1
+    for candidate in planned:
+        length = _common_prefix_length(
+            candidate.provisioning.releases, releases
+        )
+        if length > shared:
+            source, shared = candidate, length
+    if source is None:
+        return None
+    logger.info(
+        "{} shares the {} upgrade of {}".format(
+            testsuite.name, " -> ".join(releases[:shared]), source.name
+        )
+    )
+    source.provisioning.checkpoints = True
+    testsuite.provisioning.fork_upgrade_from(
+        source.provisioning, releases[shared - 1]
+    )
+    return source
+
+
+def _common_prefix_length(first, second):
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+def _sharing_key(testsuite):
+    """Return what a suite's testbed state depends on, or None.
+
+    None means the suite's backend can't share upgrades.
+
+    """
+    provisioning = testsuite.provisioning
+    if not provisioning.supports_shared_upgrades:
+        return None
+    return (
+        provisioning.build_key,
+        provisioning.do_release_upgrade_prompt,
+        _scripts_digest(testsuite.pre_upgrade_scripts),
+        repr(testsuite.scripts_data),
+    )
+
+
+def _scripts_digest(script_store):
+    """Return a digest of the scripts' names, options and contents."""
+    digest = hashlib.sha256()
+    for name in script_store.executables:
+        digest.update(name.encode())
+        digest.update(repr(script_store.options.get(name)).encode())
+        try:
+            with open(os.path.join(script_store.location, name), "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
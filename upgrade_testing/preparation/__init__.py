@@ -17,9 +17,13 @@
 #
 
 from upgrade_testing.preparation._hostprep import prepare_test_environment
-from upgrade_testing.preparation._testbed import get_testbed_storage_location
+from upgrade_testing.preparation._testbed import (
+    get_testbed_meta_release_location,
+    get_testbed_storage_location,
+)
 
 __all__ = [
+    "get_testbed_meta_release_location",
     "get_testbed_storage_location",
     "prepare_test_environment",
 ]
@@ -19,6 +19,7 @@
 import json
 import logging
 import os
+import shlex
 import shutil
 import tempfile
 from collections import namedtuple
@@ -30,7 +31,11 @@ from upgrade_testing.configspec import (
     get_file_data_location,
     test_source_retriever,
 )
-from upgrade_testing.preparation._testbed import get_testbed_storage_location
+from upgrade_testing.preparation._testbed import (
+    get_testbed_meta_release_location,
+    get_testbed_storage_location,
+)
+from upgrade_testing.preparation._upgrader import prepare_meta_release_mirror
 from upgrade_testing.provisioning import run_command_with_logged_output
 
 DEFAULT_GIT_URL = "git://anonscm.debian.org/autopkgtest/autopkgtest.git"
@@ -49,6 +54,7 @@ TestrunTempFiles = namedtuple(
         "testrun_tmp_dir",
         "unbuilt_dir",
         "scripts",
+        "meta_release_mirror",
     ],
 )
 
@@ -69,7 +75,10 @@ def prepare_test_environment(testsuite):
 
     try:
         temp_dir = tempfile.mkdtemp()
-        run_config_path = _write_run_config(testsuite, temp_dir)
+        mirror_path = _prepare_meta_release_mirror(testsuite, temp_dir)
+        run_config_path = _write_run_config(
+            testsuite, temp_dir, mirror_path is not None
+        )
         unbuilt_dir = _create_autopkg_details(temp_dir)
         logger.info("Unbuilt dir: {}".format(unbuilt_dir))
 
@@ -91,6 +100,7 @@ def prepare_test_environment(testsuite):
             unbuilt_dir=temp_dir,
             testrun_tmp_dir=temp_dir,
             scripts=scripts_path,
+            meta_release_mirror=mirror_path,
         )
     finally:
         _cleanup_dir(temp_dir)
@@ -104,12 +114,34 @@ def _cleanup_dir(dir):
     shutil.rmtree(dir)
 
 
-def _write_run_config(testsuite, temp_dir):
+def _prepare_meta_release_mirror(testsuite, temp_dir):
+    """Return the path of a meta-release mirror for the testbed, or None."""
+    if not testsuite.cache_upgrader:
+        return None
+    mirror_path = os.path.join(temp_dir, "meta-release")
+    try:
+        prepare_meta_release_mirror(
+            mirror_path,
+            testsuite.provisioning.system_states[1:],
+            get_testbed_meta_release_location(),
+        )
+    except RuntimeError as e:
+        logger.warning(
+            "Testbed will use the network meta-release: {}".format(e)
+        )
+        return None
+    return mirror_path
+
+
+def _write_run_config(testsuite, temp_dir, meta_release_mirror=False):
     """Write a config file for this run of testing.
 
     Populates a config file with the details from the test config spec as well
     as the dynamic details produced each run (temp dir etc.).
 
+    :param meta_release_mirror: Whether a meta-release mirror is copied to
+      the testbed.
+
     """
     run_config_file = tempfile.mkstemp(dir=temp_dir)[1]
     with open(run_config_file, "w") as f:
@@ -127,6 +159,27 @@ def _write_run_config(testsuite, temp_dir):
         post_tests = " ".join(testsuite.post_upgrade_tests.executables)
         f.write('PRE_TESTS_TO_RUN="{}"\n'.format(pre_tests))
         f.write('POST_TESTS_TO_RUN="{}"\n'.format(post_tests))
+        f.write(
+            "PRE_TESTS_PLAN={}\n".format(
+                shlex.quote(_get_script_plan(testsuite.pre_upgrade_scripts))
+            )
+        )
+        f.write(
+            "POST_TESTS_PLAN={}\n".format(
+                shlex.quote(_get_script_plan(testsuite.post_upgrade_tests))
+            )
+        )
+        f.write("SCRIPT_JOBS={}\n".format(testsuite.script_jobs))
+        if testsuite.script_cgroups:
+            f.write("SCRIPT_CGROUPS=1\n")
+        if testsuite.provisioning.checkpoints:
+            f.write("CHECKPOINTS=1\n")
+        if meta_release_mirror:
+            f.write(
+                "META_RELEASE_MIRROR={}\n".format(
+                    get_testbed_meta_release_location()
+                )
+            )
         # Need to store the expected pristine system and the post-upgrade
         # system
         # Note: This will only support one upgrade, for first -> final
@@ -148,9 +201,33 @@ def _write_run_config(testsuite, temp_dir):
                 testsuite.provisioning.do_release_upgrade_prompt
             )
         )
+        # Patterns and paths are newline separated so they may hold spaces.
+        collect = testsuite.collect_results
+        f.write(
+            "COLLECT_EXCLUDE={}\n".format(
+                shlex.quote("\n".join(collect.exclude))
+            )
+        )
+        f.write(
+            "COLLECT_EXTRA_PATHS={}\n".format(
+                shlex.quote("\n".join(collect.extra_paths))
+            )
+        )
+        f.write("COLLECT_MAX_FILE_SIZE={}\n".format(collect.max_file_size))
+        f.write("COLLECT_MAX_TOTAL_SIZE={}\n".format(collect.max_total_size))
     return run_config_file
 
 
+def _get_script_plan(script_store):
+    """Return the JSON plan the testbed's run_scripts helper works from."""
+    return json.dumps(
+        [
+            dict(name=name, **script_store.options[name]._asdict())
+            for name in script_store.executables
+        ]
+    )
+
+
 def _create_autopkg_details(temp_dir):
     """Create a 'dummy' debian dir structure for autopkg testing.
 
@@ -175,6 +252,7 @@ def _create_autopkg_details(temp_dir):
 
     _copy_file(test_dir_tree, "control")
     _copy_file(test_dir_tree, "upgrade")
+    _copy_file(test_dir_tree, "run_scripts")
     _copy_file(dir_tree, "changelog")
 
     # Main control file can be empty
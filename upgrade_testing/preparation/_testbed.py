@@ -21,3 +21,9 @@ def get_testbed_storage_location():
     # Any changes to this location will need to be updated in the autopkgtest
     # script (TMP_LOCATION var).
     return "/var/tmp/ubuntu-upgrade-testing"
+
+
+def get_testbed_meta_release_location():
+    # Any changes to this location will need to be updated in the autopkgtest
+    # script (use_meta_release_mirror).
+    return "{}/meta-release".format(get_testbed_storage_location())
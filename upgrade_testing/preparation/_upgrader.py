@@ -0,0 +1,277 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+META_RELEASE_URL = "https://changelogs.ubuntu.com/"
+# The meta-release files do-release-upgrade may read, depending on the
+# Prompt setting and whether -d (development) or -p (proposed) is used.
+META_RELEASE_FILES = [
+    name + postfix
+    for name in ("meta-release", "meta-release-lts")
+    for postfix in ("", "-development", "-proposed")
+]
+UPGRADER_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "auto-upgrade-testing",
+    "dist-upgrader",
+)
+# How long cached files are used before checking whether they changed.
+CACHE_MAX_AGE = 3600
+DOWNLOAD_TIMEOUT = 60
+UBUNTU_KEYRING = "/usr/share/keyrings/ubuntu-archive-keyring.gpg"
+
+
+def prepare_meta_release_mirror(mirror_dir, target_releases, testbed_dir):
+    """Populate `mirror_dir` with meta-release files and upgrader tarballs.
+
+    The upgrader tarballs for `target_releases` are fetched once (and kept in
+    UPGRADER_CACHE_DIR between runs) and the meta-release files rewritten to
+    point at their copies under `testbed_dir`, where the mirror is copied to
+    in the testbed, so do-release-upgrade doesn't need the network to find
+    or fetch the upgrader.
+
+    :raises RuntimeError: if the meta-release files can't be fetched.
+
+    """
+    os.makedirs(mirror_dir, exist_ok=True)
+    for name in META_RELEASE_FILES:
+        try:
+            path = _fetch_cached(META_RELEASE_URL + name)[0]
+        except (HTTPError, URLError, OSError) as e:
+            raise RuntimeError(
+                "Unable to fetch meta-release file {}: {}".format(name, e)
+            )
+        with open(path, errors="replace") as f:
+            stanzas = parse_meta_release(f.read())
+        for stanza in stanzas:
+            if stanza.get("Dist") in target_releases:
+                _mirror_upgrade_tool(stanza, mirror_dir, testbed_dir)
+        with open(os.path.join(mirror_dir, name), "w") as f:
+            f.write(format_meta_release(stanzas))
+
+
+def parse_meta_release(content):
+    """Return the stanzas of a meta-release file as a list of dicts."""
+    stanzas = []
+    stanza = {}
+    key = None
+    for line in content.splitlines():
+        if not line.strip():
+            if stanza:
+                stanzas.append(stanza)
+            stanza = {}
+        elif line[0].isspace() and key is not None:
+            stanza[key] += "\n" + line
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            stanza[key] = value.strip()
+    if stanza:
+        stanzas.append(stanza)
+    return stanzas
+
+
+def format_meta_release(stanzas):
+    return "\n".join(
+        "".join("{}: {}\n".format(key, value) for key, value in s.items())
+        for s in stanzas
+    )
+
+
+def _mirror_upgrade_tool(stanza, mirror_dir, testbed_dir):
+    """Point the stanza's upgrader at a verified copy in the mirror."""
+    tool_url = stanza.get("UpgradeTool")
+    signature_url = stanza.get("UpgradeToolSignature")
+    if not tool_url or not signature_url:
+        return
+    try:
+        tool_path, signature_path = _get_verified_upgrader(
+            tool_url, signature_url
+        )
+    except (HTTPError, URLError, OSError, RuntimeError) as e:
+        logger.warning(
+            "Testbeds will download the {} upgrader themselves: {}".format(
+                stanza["Dist"], e
+            )
+        )
+        return
+    relative_dir = os.path.join("upgraders", _url_key(tool_url))
+    os.makedirs(os.path.join(mirror_dir, relative_dir), exist_ok=True)
+    for key, path in (
+        ("UpgradeTool", tool_path),
+        ("UpgradeToolSignature", signature_path),
+    ):
+        relative_path = os.path.join(relative_dir, os.path.basename(path))
+        _link_or_copy(path, os.path.join(mirror_dir, relative_path))
+        stanza[key] = "file://{}".format(
+            os.path.join(testbed_dir, relative_path)
+        )
+    logger.info("Serving {} upgrader from the host".format(stanza["Dist"]))
+
+
+def _get_verified_upgrader(tool_url, signature_url):
+    """Return cached paths of the upgrader tarball and its signature.
+
+    Freshly downloaded tarballs are verified against the Ubuntu archive
+    keyring before they are used.
+
+    """
+    signature_path, signature_changed = _fetch_cached(signature_url)
+    tool_path, tool_changed = _fetch_cached(tool_url)
+    if signature_changed or tool_changed:
+        try:
+            _verify_signature(tool_path, signature_path)
+        except (OSError, RuntimeError):
+            # Forget the download so it is verified again next time.
+            for path in (tool_path, signature_path):
+                os.remove(path + ".json")
+            raise
+    return tool_path, signature_path
+
+
+def _verify_signature(path, signature_path):
+    if not os.path.exists(UBUNTU_KEYRING):
+        raise RuntimeError(
+            "Cannot verify {}: {} is missing".format(path, UBUNTU_KEYRING)
+        )
+    result = subprocess.run(
+        ["gpgv", "--keyring", UBUNTU_KEYRING, signature_path, path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            "Bad signature for {}: {}".format(path, result.stdout)
+        )
+
+
+def _fetch_cached(url, max_age=CACHE_MAX_AGE):
+    """Return the path of a cached copy of `url` and whether it changed.
+
+    The copy is checked against its recorded checksum on every use and only
+    downloaded again when the server has a newer version.
+
+    """
+    path = os.path.join(
+        UPGRADER_CACHE_DIR,
+        _url_key(url),
+        os.path.basename(urlsplit(url).path),
+    )
+    details = _read_cache_details(path)
+    if details is not None and time.time() - details["checked"] < max_age:
+        return path, False
+    try:
+        response = urlopen(
+            Request(url, headers=_conditional_headers(details)),
+            timeout=DOWNLOAD_TIMEOUT,
+        )
+    except HTTPError as e:
+        if e.code != 304 or details is None:
+            raise
+        details["checked"] = time.time()
+        _write_cache_details(path, details)
+        return path, False
+    with response:
+        details = dict(
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            sha256=_download(response, path),
+            checked=time.time(),
+        )
+    _write_cache_details(path, details)
+    return path, True
+
+
+def _conditional_headers(details):
+    """Return headers asking for the file only if it has changed."""
+    headers = {}
+    if details is not None:
+        if details.get("etag"):
+            headers["If-None-Match"] = details["etag"]
+        if details.get("last_modified"):
+            headers["If-Modified-Since"] = details["last_modified"]
+    return headers
+
+
+def _download(response, path):
+    """Save the response body at `path`, returning its sha256."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    checksum = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), delete=False
+    ) as f:
+        try:
+            for chunk in iter(lambda: response.read(65536), b""):
+                checksum.update(chunk)
+                f.write(chunk)
+        except BaseException:
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+    return checksum.hexdigest()
+
+
+def _read_cache_details(path):
+    """Return the recorded details for a cached file if it is intact."""
+    try:
+        with open(path + ".json") as f:
+            details = json.load(f)
+        actual = _sha256(path)
+    except (OSError, ValueError):
+        return None
+    if actual != details.get("sha256"):
+        logger.warning("Discarding corrupt cached file {}".format(path))
+        return None
+    return details
+
+
+def _write_cache_details(path, details):
+    with open(path + ".json", "w") as f:
+        json.dump(details, f)
+
+
+def _sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
@@ -16,9 +16,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from upgrade_testing.provisioning._build import (
+    DEFAULT_BUILD_JOBS,
+    parallel_builds,
+    run_builds,
+    wait_for_build,
+)
+from upgrade_testing.provisioning._checkpoint import CHECKPOINT_PHASES
 from upgrade_testing.provisioning._provisionconfig import (
     ProvisionSpecification,
 )
-from upgrade_testing.provisioning._util import run_command_with_logged_output
+from upgrade_testing.provisioning._storage import parse_size
+from upgrade_testing.provisioning._util import (
+    extract_tar,
+    read_line_batches,
+    run_command_with_logged_output,
+)
 
-__all__ = ["ProvisionSpecification", "run_command_with_logged_output"]
+__all__ = [
+    "CHECKPOINT_PHASES",
+    "DEFAULT_BUILD_JOBS",
+    "ProvisionSpecification",
+    "extract_tar",
+    "parallel_builds",
+    "parse_size",
+    "read_line_batches",
+    "run_builds",
+    "run_command_with_logged_output",
+    "wait_for_build",
+]
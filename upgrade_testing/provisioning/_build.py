@@ -0,0 +1,128 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import fcntl
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BUILD_LOCK_DIR = "/var/cache/auto-upgrade-testing/locks"
+DEFAULT_BUILD_JOBS = 1
+
+
+@contextmanager
+def build_lock(key, lock_dir=BUILD_LOCK_DIR):
+    """Hold an exclusive lock for building the image identified by `key`.
+
+    The lock is a flock on a file in `lock_dir` so it is shared between
+    threads and between separate runs on the same host.
+
+    :returns: True if the lock had to be waited for (i.e. someone else was
+      building the same image), False otherwise.
+
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(
+        lock_dir, "{}.lock".format(re.sub(r"[^\w.-]", "_", key))
+    )
+    lock_fd = _open_lock_file(lock_path)
+    try:
+        waited = False
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Waiting for in-flight build of {}".format(key))
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            waited = True
+        yield waited
+    finally:
+        os.close(lock_fd)
+
+
+def _open_lock_file(lock_path):
+    # The lock directory is shared between users (sticky, world writable) so
+    # only create the lock file when it doesn't exist yet; opening another
+    # user's file with O_CREAT is refused there when fs.protected_regular is
+    # enabled. A read-only descriptor is enough for flock.
+    try:
+        return os.open(lock_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return os.open(lock_path, os.O_RDONLY | os.O_CREAT, 0o644)
+
+
+def single_flight_build(key, available, build, force=False):
+    """Run `build` unless another build of `key` provides the image.
+
+    Only one build per key runs at a time. A caller that arrives while a
+    build is in progress waits for it and then reuses its result instead of
+    starting its own. When `force` is set a fresh build is done unless the
+    image was just built by the build that was waited for.
+
+    :returns: Whether `build` was run.
+
+    """
+    with build_lock(key) as waited:
+        if available() and (waited or not force):
+            logger.info("Image {} is available, not building.".format(key))
+            return False
+        build()
+        return True
+
+
+def run_builds(builds, jobs=DEFAULT_BUILD_JOBS):
+    """Run the builds in parallel, at most `jobs` at a time.
+
+    :param builds: dict mapping an image key to a callable that builds it.
+      Builds for the same key must be collapsed by the caller beforehand.
+    :returns: dict mapping each key to the exception its build raised, or
+      None if it succeeded.
+
+    """
+    with parallel_builds(builds, jobs) as futures:
+        return {
+            key: wait_for_build(key, future) for key, future in futures.items()
+        }
+
+
+@contextmanager
+def parallel_builds(builds, jobs=DEFAULT_BUILD_JOBS):
+    """Start the builds in the background, at most `jobs` at a time.
+
+    The builds start in the order given. Leaving the context waits for the
+    builds still running.
+
+    :param builds: dict mapping an image key to a callable that builds it.
+    :returns: dict mapping each key to the Future of its build.
+
+    """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        yield {key: executor.submit(build) for key, build in builds.items()}
+
+
+def wait_for_build(key, future):
+    """Wait for a build, returning the exception it raised or None."""
+    try:
+        future.result()
+    except Exception as e:
+        logger.error("Failed to build {}: {}".format(key, e))
+        return e
+    return None
@@ -0,0 +1,227 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+# Phases the upgrade script takes checkpoints after, in run order.
+CHECKPOINT_PHASES = ("setup", "pre-test", "hop")
+MANIFEST_SUFFIX = ".checkpoints.json"
+QMP_TIMEOUT = 300
+
+
+class QmpClient:
+    """Just enough of the qemu machine protocol to run commands.
+
+    :param socket_path: Path of the unix socket qemu was started with
+      (-qmp unix:<path>,server=on,wait=off).
+
+    """
+
+    def __init__(self, socket_path, timeout=QMP_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def execute(self, command, **arguments):
+        """Run a QMP command and return its result.
+
+        :raises RuntimeError: if qemu reports an error.
+
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            with sock.makefile("rw") as stream:
+                # Skip the greeting, then leave capabilities negotiation.
+                stream.readline()
+                self._send(stream, "qmp_capabilities", {})
+                self._send(stream, command, arguments)
+                return self._read_reply(stream)
+
+    def _send(self, stream, command, arguments):
+        stream.write(json.dumps(dict(execute=command, arguments=arguments)))
+        stream.write("\n")
+        stream.flush()
+        if command == "qmp_capabilities":
+            self._read_reply(stream)
+
+    @staticmethod
+    def _read_reply(stream):
+        for line in stream:
+            reply = json.loads(line)
+            if "error" in reply:
+                raise RuntimeError(
+                    "QMP error: {}".format(reply["error"].get("desc"))
+                )
+            if "return" in reply:
+                return reply["return"]
+            # Anything else is an asynchronous event.
+        raise RuntimeError("QMP connection closed")
+
+
+def take_internal_snapshot(client, device, name):
+    """Snapshot `device` through QmpClient `client` as `name`.
+
+    A snapshot already called `name` (e.g. in an overlay restored to an
+    earlier checkpoint, or forked from another run's) is deleted first, as
+    qemu refuses to take a second one.
+
+    """
+    try:
+        client.execute(
+            "blockdev-snapshot-delete-internal-sync", device=device, name=name
+        )
+    except RuntimeError:
+        # There was no such snapshot.
+        pass
+    client.execute("blockdev-snapshot-internal-sync", device=device, name=name)
+
+
+class CheckpointStore:
+    """The checkpoints held as internal snapshots of a qcow2 overlay.
+
+    A manifest beside the overlay records the phase of each snapshot and
+    the base image it was taken on, so checkpoints are only offered while
+    that base image is unchanged.
+
+    :param overlay_path: Path of the overlay image.
+    :param base_image_path: Path of the image the overlay is backed by.
+
+    """
+
+    def __init__(self, overlay_path, base_image_path):
+        self.overlay_path = overlay_path
+        self.base_image_path = base_image_path
+        self.manifest_path = overlay_path + MANIFEST_SUFFIX
+
+    def clear(self):
+        """Forget all checkpoints, e.g. when the overlay is recreated."""
+        try:
+            os.remove(self.manifest_path)
+        except FileNotFoundError:
+            pass
+
+    def record(self, name, phase):
+        """Record a snapshot `name` taken after `phase`."""
+        manifest = self._read_manifest()
+        manifest["checkpoints"] = [
+            c for c in manifest["checkpoints"] if c["name"] != name
+        ] + [dict(name=name, phase=phase, created=time.time())]
+        self._write_manifest(manifest)
+
+    def checkpoints(self):
+        """Return the usable checkpoints, oldest first."""
+        manifest = self._read_manifest()
+        if manifest.get("base_image") != self._base_image_id():
+            if manifest["checkpoints"]:
+                logger.warning(
+                    "Base image changed, ignoring checkpoints in {}".format(
+                        self.overlay_path
+                    )
+                )
+            return []
+        snapshots = self._snapshot_names()
+        return [c for c in manifest["checkpoints"] if c["name"] in snapshots]
+
+    def latest(self, phase=None):
+        """Return the name of the latest checkpoint after `phase`, or None.
+
+        :param phase: One of CHECKPOINT_PHASES, or None for the latest
+          checkpoint of any phase.
+
+        """
+        for checkpoint in reversed(self.checkpoints()):
+            if phase is None or checkpoint["phase"] == phase:
+                return checkpoint["name"]
+        return None
+
+    def restore(self, name):
+        """Revert the (unused) overlay to the snapshot `name`.
+
+        The checkpoints taken after it are deleted, the resumed run takes
+        them again.
+
+        """
+        logger.info("Restoring checkpoint {}".format(name))
+        self._qemu_img("snapshot", "-a", name, self.overlay_path)
+        manifest = self._read_manifest()
+        names = [c["name"] for c in manifest["checkpoints"]]
+        if name not in names:
+            return
+        kept = names.index(name) + 1
+        snapshots = self._snapshot_names()
+        for later in names[kept:]:
+            if later in snapshots:
+                self._qemu_img("snapshot", "-d", later, self.overlay_path)
+        manifest["checkpoints"] = manifest["checkpoints"][:kept]
+        self._write_manifest(manifest)
+
+    @staticmethod
+    def _qemu_img(*args):
+        subprocess.check_call(("qemu-img",) + args)
+
+    def _write_manifest(self, manifest):
+        with open(self.manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = dict(base_image=self._base_image_id())
+        manifest.setdefault("checkpoints", [])
+        return manifest
+
+    def _base_image_id(self):
+        try:
+            stat = os.stat(self.base_image_path)
+        except OSError:
+            return None
+        return dict(
+            path=os.path.realpath(self.base_image_path),
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    def _snapshot_names(self):
+        try:
+            info = subprocess.check_output(
+                [
+                    "qemu-img",
+                    "info",
+                    "-U",
+                    "--output=json",
+                    self.overlay_path,
+                ]
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(
+                "Unable to list snapshots of {}: {}".format(
+                    self.overlay_path, e
+                )
+            )
+            return set()
+        return {s["name"] for s in json.loads(info).get("snapshots", [])}
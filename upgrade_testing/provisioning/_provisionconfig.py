@@ -21,11 +21,24 @@ import os
 import re
 
 from upgrade_testing.provisioning import backends
+from upgrade_testing.provisioning._build import single_flight_build
+from upgrade_testing.provisioning._retry import RetryPolicy
+from upgrade_testing.provisioning._storage import (
+    DEFAULT_OVERLAY_SIZE,
+    storage_tiers_from_config,
+)
 
 logger = logging.getLogger(__name__)
 
 
 class ProvisionSpecification:
+    # Whether the testbed should wait for a snapshot at each checkpoint.
+    checkpoints = False
+    # Whether a run can start from another run's upgraded testbed.
+    supports_shared_upgrades = False
+    # The ProvisionSpecification whose upgraded testbed this one starts from.
+    forked_from = None
+
     def __init__(self):
         raise NotImplementedError()
 
@@ -53,13 +66,55 @@ class ProvisionSpecification:
         """Return True if the provisioning backend is available."""
         return self.backend.available()
 
-    def create(self, adt_base_path):
-        """Provision the stored backend."""
-        return self.backend.create(adt_base_path)
+    @property
+    def build_key(self):
+        """Return the key identifying the image this backend provisions."""
+        return self.backend.build_key
+
+    def create(self, adt_base_path, force=False):
+        """Provision the stored backend.
+
+        Concurrent requests to provision the same image share a single build.
+
+        :returns: Whether the image was built, rather than found built.
+
+        """
+
+        def available():
+            # Another run may have built the image while we waited.
+            self.backend.invalidate_cache()
+            return self.backend_available()
+
+        return single_flight_build(
+            self.build_key,
+            available,
+            lambda: self.backend.create(adt_base_path),
+            force=force,
+        )
 
     def close(self):
         return self.backend.close() if hasattr(self.backend, "close") else None
 
+    def on_testbed_event(self, event):
+        """Pass on an event reported by the upgrade script."""
+        if hasattr(self.backend, "on_testbed_event"):
+            self.backend.on_testbed_event(event)
+
+    def testbed_pid(self):
+        """Return the pid of a testbed we launched for autopkgtest, or None."""
+        if hasattr(self.backend, "testbed_pid"):
+            return self.backend.testbed_pid()
+        return None
+
+    def fork_upgrade_from(self, source, release):
+        """Start from the testbed `source` has once upgraded to `release`.
+
+        :param source: ProvisionSpecification of a run planned earlier,
+          which takes checkpoints.
+
+        """
+        raise NotImplementedError()
+
     def get_adt_run_args(self, **kwargs):
         """Return list with the adt args for this provisioning backend."""
         raise NotImplementedError()
@@ -106,7 +161,10 @@ class LXCProvisionSpecification(ProvisionSpecification):
         self._provisionconfig_path = provision_path
 
         self.backend = backends.LXCBackend(
-            self.initial_state, self.distribution, self.arch
+            self.initial_state,
+            self.distribution,
+            self.arch,
+            snapshot_clones=provision_config.get("snapshot_clones", False),
         )
 
     @property
@@ -138,6 +196,8 @@ class LXCProvisionSpecification(ProvisionSpecification):
 
 
 class QemuProvisionSpecification(ProvisionSpecification):
+    supports_shared_upgrades = True
+
     def __init__(self, provision_config, provision_path):
         self._provisionconfig_path = provision_path
 
@@ -161,6 +221,14 @@ class QemuProvisionSpecification(ProvisionSpecification):
         logger.info("Using build args: {}".format(self.build_args))
 
         self.packages = provision_config.get("packages")
+        # Download the packages needed to upgrade to the next release while
+        # building the image so the upgrade itself hits the network less.
+        self.prefetch_upgrade = provision_config.get("prefetch_upgrade", False)
+        self.storage_tiers = storage_tiers_from_config(
+            provision_config.get("storage_tiers", [])
+        )
+        # Snapshot the overlay after setup, pre-tests and each upgrade hop.
+        self.checkpoints = provision_config.get("checkpoints", False)
         self.verbose = False
 
         self.backend = backends.QemuBackend(
@@ -169,6 +237,20 @@ class QemuProvisionSpecification(ProvisionSpecification):
             self.image_name,
             self.packages,
             self.build_args,
+            prefetch_release=(
+                self.releases[1]
+                if self.prefetch_upgrade and len(self.releases) > 1
+                else None
+            ),
+            storage_tiers=self.storage_tiers,
+            stage_images=provision_config.get("stage_images", False),
+            overlay_size=provision_config.get(
+                "overlay_size", DEFAULT_OVERLAY_SIZE
+            ),
+            retry_policy=RetryPolicy.from_config(
+                provision_config.get("retry")
+            ),
+            checkpoints=self.checkpoints,
         )
 
     @property
@@ -190,6 +272,10 @@ class QemuProvisionSpecification(ProvisionSpecification):
         """Return list with the adt args for this provisioning backend."""
         return self.backend.get_adt_run_args(**kwargs)
 
+    def fork_upgrade_from(self, source, release):
+        self.forked_from = source
+        self.backend.fork_source = (source.backend, "hop-{}".format(release))
+
     def __repr__(self):
         return "{classname}(backend={backend}, distribution={dist}, releases={releases})".format(  # NOQA
             classname=self.__class__.__name__,
@@ -0,0 +1,169 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Overall time allowed for a testbed to go from launched to connected.
+DEFAULT_DEADLINE = 600
+# Time allowed for each phase of connecting, bounded by the overall deadline.
+DEFAULT_PHASE_BUDGETS = dict(wait_for_device=420, connect=180)
+DEFAULT_INITIAL_DELAY = 0.5
+DEFAULT_MAX_DELAY = 15
+DEFAULT_MULTIPLIER = 2
+# Fraction of each delay that is randomised so testbeds started together
+# don't retry in lock step.
+DEFAULT_JITTER = 0.5
+
+
+class RetryPolicy:
+    """How long, and how often, to retry while waiting for a testbed.
+
+    A policy describes an overall deadline, a budget per named phase and a
+    jittered exponential backoff between attempts. Call `start` to begin
+    timing a sequence of phases against it.
+
+    """
+
+    def __init__(
+        self,
+        deadline=DEFAULT_DEADLINE,
+        phase_budgets=None,
+        initial_delay=DEFAULT_INITIAL_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        multiplier=DEFAULT_MULTIPLIER,
+        jitter=DEFAULT_JITTER,
+    ):
+        self.deadline = deadline
+        self.phase_budgets = dict(DEFAULT_PHASE_BUDGETS)
+        self.phase_budgets.update(phase_budgets or {})
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    @classmethod
+    def from_config(cls, config):
+        """Return a policy from the 'retry' details of a provision config.
+
+        :param config: dict with optional 'deadline', 'initial_delay',
+          'max_delay', 'multiplier', 'jitter' and a 'phases' dict mapping
+          phase names to their budget in seconds.
+
+        """
+        config = dict(config or {})
+        phase_budgets = config.pop("phases", None)
+        unknown = set(config) - {
+            "deadline",
+            "initial_delay",
+            "max_delay",
+            "multiplier",
+            "jitter",
+        }
+        if unknown:
+            raise ValueError(
+                "Unknown retry settings: {}".format(", ".join(sorted(unknown)))
+            )
+        return cls(phase_budgets=phase_budgets, **config)
+
+    def delays(self):
+        """Yield the delay to wait before each successive retry."""
+        delay = self.initial_delay
+        while True:
+            spread = delay * self.jitter
+            yield max(0, delay - spread + random.uniform(0, 2 * spread))
+            delay = min(self.max_delay, delay * self.multiplier)
+
+    def start(self, clock=time.monotonic):
+        return RetryState(self, clock)
+
+    def __repr__(self):
+        return "{classname}(deadline={deadline})".format(
+            classname=self.__class__.__name__, deadline=self.deadline
+        )
+
+
+class RetryState:
+    """A sequence of phases being timed against a RetryPolicy."""
+
+    def __init__(self, policy, clock=time.monotonic):
+        self.policy = policy
+        self._clock = clock
+        self.end = clock() + policy.deadline
+
+    def remaining(self):
+        """Return the seconds left before the overall deadline."""
+        return max(0, self.end - self._clock())
+
+    def _phase_end(self, phase):
+        budget = self.policy.phase_budgets.get(phase)
+        if budget is None:
+            return self.end
+        return min(self.end, self._clock() + budget)
+
+    def call(self, phase, func, retry_on=(Exception,), alive=None):
+        """Call `func` until it succeeds or the phase runs out of time.
+
+        :param phase: Name of the phase, used to look up its budget.
+        :param func: Callable taking the seconds left in the phase, so a
+          single attempt never outlives it.
+        :param retry_on: Exceptions that mean the attempt should be retried.
+        :param alive: Optional callable returning False once the target can
+          no longer succeed (e.g. the vm exited), to give up straight away.
+        :raises TimeoutError: once the phase budget or deadline is spent.
+
+        """
+        end = self._phase_end(phase)
+        for attempt, delay in enumerate(self.policy.delays(), start=1):
+            try:
+                return func(max(0, end - self._clock()))
+            except retry_on as e:
+                self._check_retry(phase, attempt, e, end, delay, alive)
+            time.sleep(delay)
+
+    async def async_call(self, phase, func, retry_on=(Exception,), alive=None):
+        """asyncio variant of `call`, `func` must return an awaitable."""
+        end = self._phase_end(phase)
+        for attempt, delay in enumerate(self.policy.delays(), start=1):
+            try:
+                return await func(max(0, end - self._clock()))
+            except retry_on as e:
+                self._check_retry(phase, attempt, e, end, delay, alive)
+            await asyncio.sleep(delay)
+
+    def _check_retry(self, phase, attempt, error, end, delay, alive):
+        """Raise if there is no point in another attempt of `phase`."""
+        if alive is not None and not alive():
+            raise RuntimeError(
+                "Target went away during {}: {}".format(phase, error)
+            ) from error
+        if end - self._clock() <= delay:
+            raise TimeoutError(
+                "{} did not succeed after {} attempts: {}".format(
+                    phase, attempt, error
+                )
+            ) from error
+        logger.debug(
+            "{} attempt {} failed, retrying in {:.1f}s: {}".format(
+                phase, attempt, delay, error
+            )
+        )
@@ -0,0 +1,284 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import fcntl
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Space we expect an overlay to grow to during a full release upgrade.
+DEFAULT_OVERLAY_SIZE = "8G"
+# RAM that must stay available to the host (and the guests) when placing
+# files on a memory backed tier.
+DEFAULT_MEMORY_RESERVE = "4G"
+MEMORY_FILESYSTEMS = ("tmpfs", "ramfs")
+
+_SIZE_SUFFIXES = dict(K=1 << 10, M=1 << 20, G=1 << 30, T=1 << 40)
+
+# A storage tier is a directory that overlays, working directories and staged
+# base images can be placed in. Tiers are tried in the order they are
+# configured so the fastest should be listed first.
+StorageTier = namedtuple("StorageTier", ["path", "min_free"])
+# Directory of a tier holding the staged copies of base images.
+STAGED_IMAGES_DIR = "images"
+
+
+def parse_size(size):
+    """Return the number of bytes for a size like '512M' or '8G'.
+
+    :raises ValueError: if the size cannot be understood.
+
+    """
+    if isinstance(size, int):
+        return size
+    match = re.match(r"^\s*(\d+)\s*([KMGT]?)i?B?\s*$", str(size), re.I)
+    if match is None:
+        raise ValueError("Unable to parse size: {}".format(size))
+    number, suffix = match.groups()
+    return int(number) * _SIZE_SUFFIXES.get(suffix.upper(), 1)
+
+
+def storage_tiers_from_config(tiers_config):
+    """Return a list of StorageTier from the provisioning config details.
+
+    Each entry is either a path string or a dict with a 'path' and an
+    optional 'min_free' size that must remain free on that tier.
+
+    """
+    tiers = []
+    for entry in tiers_config or []:
+        if isinstance(entry, str):
+            entry = dict(path=entry)
+        tiers.append(
+            StorageTier(
+                path=os.path.abspath(entry["path"]),
+                min_free=parse_size(entry.get("min_free", 0)),
+            )
+        )
+    return tiers
+
+
+def select_storage_dir(tiers, required, default):
+    """Return the first tier directory with room for `required` bytes.
+
+    Memory backed tiers (tmpfs) are only used when the host also has enough
+    available RAM, so under memory pressure files spill over to the next,
+    slower, tier. `default` is returned when no tier is suitable.
+
+    """
+    for tier in tiers:
+        try:
+            os.makedirs(tier.path, exist_ok=True)
+            free = _get_usable_space(tier.path)
+        except OSError as e:
+            logger.warning("Skipping storage tier {}: {}".format(tier.path, e))
+            continue
+        if free - tier.min_free >= required:
+            logger.info("Using storage tier: {}".format(tier.path))
+            return tier.path
+        logger.info(
+            "Storage tier {} has {} bytes usable, {} needed.".format(
+                tier.path, free - tier.min_free, required
+            )
+        )
+    return default
+
+
+def make_working_dir(tiers, required=0):
+    """Return a new temporary directory placed on the best storage tier."""
+    return tempfile.mkdtemp(
+        prefix="auto-upgrade-testing-",
+        dir=select_storage_dir(tiers, required, default=None),
+    )
+
+
+def stage_image(image_path, tiers):
+    """Return the path of `image_path` staged onto the fastest tier.
+
+    The copy is kept between runs, on whichever tier it was first staged to,
+    until the source image changes. Staged copies of images that changed or
+    went away are removed first to make room, unless a run still holds them
+    (see hold_image). When no tier has room the original path is returned.
+    Either way the page cache is warmed for the returned image before it is
+    used.
+
+    """
+    _evict_stale_copies(os.path.dirname(image_path), tiers)
+    staged_name = _staged_name(image_path)
+    staged_path = _find_copy(staged_name, tiers)
+    if staged_path is None:
+        size = os.path.getsize(image_path)
+        stage_dir = select_storage_dir(tiers, size, default=None)
+        staged_path = image_path
+        if stage_dir is not None:
+            staged_path = os.path.join(
+                stage_dir, STAGED_IMAGES_DIR, staged_name
+            )
+            logger.info("Staging {} to {}".format(image_path, staged_path))
+            _copy_into_place(image_path, staged_path)
+    warm_page_cache(staged_path)
+    return staged_path
+
+
+def hold_image(image_path):
+    """Return an open file holding a shared lock on `image_path`.
+
+    Staged copies held this way are not evicted, even once their source
+    image changes. Close the file once the image is no longer used.
+
+    """
+    image = open(image_path, "rb")
+    fcntl.flock(image, fcntl.LOCK_SH)
+    return image
+
+
+def _staged_name(image_path):
+    """Return the name of the staged copy of `image_path` as it is now.
+
+    Copies are named after the size and mtime of their source, so a rebuilt
+    image is staged beside copies still in use rather than over them.
+
+    """
+    stat = os.stat(image_path)
+    return "{}.{}-{}".format(
+        os.path.basename(image_path), stat.st_size, stat.st_mtime_ns
+    )
+
+
+def _find_copy(staged_name, tiers):
+    """Return the path of the staged copy `staged_name` on any tier."""
+    for tier in tiers:
+        staged_path = os.path.join(tier.path, STAGED_IMAGES_DIR, staged_name)
+        if os.path.isfile(staged_path):
+            return staged_path
+    return None
+
+
+def _evict_stale_copies(source_dir, tiers):
+    """Remove staged copies no longer matching their image in `source_dir`.
+
+    Copies still being made (hidden temporary files) are left alone.
+
+    """
+    for tier in tiers:
+        images_dir = os.path.join(tier.path, STAGED_IMAGES_DIR)
+        for name in _list_dir(images_dir):
+            if name.startswith(".") or _is_current_copy(source_dir, name):
+                continue
+            _remove_unused_copy(os.path.join(images_dir, name))
+
+
+def _remove_unused_copy(staged_path):
+    """Remove `staged_path` unless a run holds it (see hold_image)."""
+    try:
+        with open(staged_path, "rb") as image:
+            fcntl.flock(image, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(staged_path)
+    except BlockingIOError:
+        logger.info(
+            "Keeping stale staged image {}, in use".format(staged_path)
+        )
+        return
+    except FileNotFoundError:
+        return
+    logger.info("Removed stale staged image {}".format(staged_path))
+
+
+def _list_dir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def _copy_into_place(source, dest):
+    """Copy `source` to `dest` so that `dest` is only ever complete.
+
+    Each copy goes to its own temporary file, so concurrent runs staging the
+    same image never write to the same file.
+
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    fd, partial_path = tempfile.mkstemp(
+        prefix=".{}-".format(os.path.basename(dest)),
+        dir=os.path.dirname(dest),
+    )
+    os.close(fd)
+    try:
+        shutil.copy2(source, partial_path)
+        os.replace(partial_path, dest)
+    except BaseException:
+        os.remove(partial_path)
+        raise
+
+
+def warm_page_cache(path):
+    """Ask the kernel to read `path` into the page cache ahead of use."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def _is_current_copy(source_dir, staged_name):
+    """Return whether `staged_name` copies its image in `source_dir`."""
+    source = os.path.join(source_dir, staged_name.rpartition(".")[0])
+    try:
+        return _staged_name(source) == staged_name
+    except FileNotFoundError:
+        return False
+
+
+def _get_usable_space(path):
+    """Return bytes that can be written to `path` right now."""
+    free = shutil.disk_usage(path).free
+    if _get_filesystem_type(path) in MEMORY_FILESYSTEMS:
+        reserve = parse_size(DEFAULT_MEMORY_RESERVE)
+        free = min(free, _get_available_memory() - reserve)
+    return free
+
+
+def _get_filesystem_type(path):
+    """Return the filesystem type of the mount holding `path`."""
+    path = os.path.realpath(path)
+    fs_type = None
+    longest = -1
+    with open("/proc/self/mounts") as f:
+        for line in f:
+            _, mount_point, mount_type = line.split()[:3]
+            if (
+                path == mount_point
+                or path.startswith(mount_point.rstrip("/") + "/")
+            ) and len(mount_point) > longest:
+                fs_type = mount_type
+                longest = len(mount_point)
+    return fs_type
+
+
+def _get_available_memory():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return 0
@@ -17,27 +17,122 @@
 #
 
 import logging
+import os
 import subprocess
+import tarfile
+from contextlib import ExitStack
 
 logger = logging.getLogger(__name__)
 
+JOB_LOG_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "auto-upgrade-testing",
+    "logs",
+)
+# Output is read as it comes, up to this much at a time.
+CHUNK_SIZE = 65536
+# A line without an end is passed on once it gets this long.
+MAX_LINE_LENGTH = 16 * CHUNK_SIZE
 
-def run_command_with_logged_output(command, shell=False):
+
+def run_command_with_logged_output(command, shell=False, job=None):
     """Run provided command while outputting stdout & stderr in 'real time'.
 
+    The output is logged a batch of lines at a time, with progress bars
+    redrawn with carriage returns reduced to their final state.
+
+    :param job: Optional name for the command, e.g. the image it builds.
+      Each line logged is prefixed with it and the raw output is also saved
+      to JOB_LOG_DIR/<job>.log, so commands run in parallel stay readable.
     :returns: Returncode of command that was run.
 
     """
     logger.debug("Running command: {}".format(command))
-    with subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        bufsize=1,
-        universal_newlines=True,
-        shell=shell,
-    ) as proc:
-        for line in proc.stdout:
-            logger.info(line.strip("\n"))
+    prefix = "[{}] ".format(job) if job else ""
+    with ExitStack() as stack:
+        tee = None
+        if job:
+            os.makedirs(JOB_LOG_DIR, exist_ok=True)
+            tee = stack.enter_context(
+                open(os.path.join(JOB_LOG_DIR, job + ".log"), "wb")
+            )
+        proc = stack.enter_context(
+            subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                shell=shell,
+            )
+        )
+        for lines in read_line_batches(proc.stdout, tee):
+            logger.info(
+                "\n".join(
+                    prefix + line.decode(errors="replace") for line in lines
+                )
+            )
         proc.wait()
         return proc.returncode
+
+
+def read_line_batches(stream, tee=None):
+    """Yield the lines of a binary stream in batches, as they are read.
+
+    Each batch holds the complete lines from one read of up to CHUNK_SIZE
+    bytes, without their line ends. Text a line redraws after a carriage
+    return replaces what it had before, so a progress bar becomes one line.
+
+    :param tee: Optional binary file the raw output is also written to.
+
+    """
+    pending = b""
+    for chunk in iter(lambda: os.read(stream.fileno(), CHUNK_SIZE), b""):
+        if tee is not None:
+            tee.write(chunk)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        # Only the latest redraw of an unfinished line needs keeping, with
+        # a carriage return ending it in case a line feed comes next.
+        ending = b"\r" if pending.endswith(b"\r") else b""
+        pending = collapse_redraws(pending) + ending
+        if len(pending) > MAX_LINE_LENGTH:
+            lines.append(pending)
+            pending = b""
+        lines = [collapse_redraws(line) for line in lines]
+        if lines:
+            yield lines
+    if pending:
+        yield [collapse_redraws(pending)]
+
+
+def collapse_redraws(line):
+    """Return the text a terminal would show for a line of output."""
+    return line.rstrip(b"\r").rpartition(b"\r")[2]
+
+
+def extract_tar(tar, path):
+    """Extract a tar stream, refusing members that escape `path`.
+
+    Symlinks are extracted as they are, absolute ones included (e.g. the
+    keyrings in /etc/apt/trusted.gpg.d), but nothing is written through
+    them: each member's path is resolved, following the links extracted
+    before it, and must stay under `path`. Hard links must point under
+    `path` too.
+
+    :raises RuntimeError: if a member would escape `path`.
+    :raises tarfile.TarError: if the archive can't be read.
+
+    """
+    root = os.path.realpath(path)
+    # The "tar" filter drops unsafe modes but, unlike "data", keeps links.
+    kwargs = dict(filter="tar") if hasattr(tarfile, "tar_filter") else {}
+    for member in tar:
+        _check_member_path(root, member.name, member.name)
+        if member.islnk():
+            _check_member_path(root, member.linkname, member.name)
+        tar.extract(member, path, **kwargs)
+
+
+def _check_member_path(root, name, member_name):
+    target = os.path.realpath(os.path.join(root, name.lstrip("/")))
+    if os.path.commonpath([root, target]) != root:
+        raise RuntimeError("Refusing to extract {}".format(member_name))
@@ -0,0 +1,227 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2017 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import codecs
+import sys
+
+from upgrade_testing.provisioning._retry import RetryPolicy
+from upgrade_testing.provisioning.executors import (
+    CONNECT_ERRORS,
+    REBOOT_CMD,
+    RECV_SIZE,
+    SHUTDOWN_CMD,
+    TIMEOUT_CMD,
+    TIMEOUT_CONNECT,
+    TIMEOUT_WAIT_FOR_DEVICE,
+    Executor,
+    OutputBuffer,
+    Result,
+    SSHClient,
+    connect_once,
+)
+
+# How often to check for a command having exited while something still holds
+# its output open.
+EXIT_POLL_INTERVAL = 1
+
+
+class AsyncSSHExecutor(Executor):
+    """asyncio variant of SSHExecutor.
+
+    Command output is read through the event loop as it arrives, so one
+    process can drive many targets without a thread per target. Only the
+    calls paramiko can't make without blocking (the handshake and sftp
+    transfers) are handed to the loop's default executor while they last.
+    """
+
+    def __init__(self):
+        self.ssh_client = SSHClient()
+        self.password = None
+        self.last_status = None
+
+    async def _in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def wait_for_device(self, host, port, retry_state=None, alive=None):
+        """Wait until the target accepts connections on `port`.
+
+        :param retry_state: RetryState whose 'wait_for_device' phase bounds
+          the wait, by default TIMEOUT_WAIT_FOR_DEVICE.
+
+        """
+        if retry_state is None:
+            retry_state = RetryPolicy(deadline=TIMEOUT_WAIT_FOR_DEVICE).start()
+
+        async def attempt(remaining):
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), remaining
+            )
+            writer.close()
+
+        await retry_state.async_call(
+            "wait_for_device",
+            attempt,
+            retry_on=(OSError, asyncio.TimeoutError),
+            alive=alive,
+        )
+
+    async def connect(
+        self,
+        username,
+        password,
+        port,
+        host="localhost",
+        timeout=TIMEOUT_CONNECT,
+        key_filename=None,
+        retry_state=None,
+        alive=None,
+    ):
+        """Connect to the target, retrying as SSHExecutor.connect does."""
+        self.password = password
+        if retry_state is None:
+            retry_state = RetryPolicy(deadline=timeout).start()
+        auth_error = await retry_state.async_call(
+            "connect",
+            lambda remaining: self._in_executor(
+                connect_once,
+                self.ssh_client,
+                host,
+                username,
+                password,
+                port,
+                min(timeout, remaining),
+                key_filename,
+            ),
+            retry_on=CONNECT_ERRORS,
+            alive=alive,
+        )
+        if auth_error is not None:
+            raise auth_error
+
+    def close(self):
+        self.ssh_client.close()
+
+    async def stream(self, cmd, timeout=TIMEOUT_CMD):
+        """Run `cmd` yielding its (combined) output as it arrives.
+
+        The exit status is available from `self.last_status` once the
+        generator is exhausted.
+        """
+        loop = asyncio.get_running_loop()
+        channel = self.ssh_client.client.get_transport().open_session()
+        channel.set_combine_stderr(True)
+        channel.exec_command(cmd)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        readable = asyncio.Event()
+        loop.add_reader(channel.fileno(), readable.set)
+        end = loop.time() + timeout
+        try:
+            while not SSHClient._command_finished(channel):
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        "Timeout waiting {} seconds for command to "
+                        "complete: {}".format(timeout, cmd)
+                    )
+                if channel.eof_received and not channel.recv_ready():
+                    # The output is closed, only the exit status is to come.
+                    await self._in_executor(
+                        channel.status_event.wait,
+                        min(remaining, EXIT_POLL_INTERVAL),
+                    )
+                    continue
+                content = await self._read_available(
+                    channel,
+                    decoder,
+                    readable,
+                    min(remaining, EXIT_POLL_INTERVAL),
+                )
+                if content:
+                    yield content
+            content = decoder.decode(b"", final=True)
+            if content:
+                yield content
+            self.last_status = await self._in_executor(
+                channel.recv_exit_status
+            )
+        finally:
+            loop.remove_reader(channel.fileno())
+            channel.close()
+
+    @staticmethod
+    async def _read_available(channel, decoder, readable, timeout):
+        """Return decoded output once the channel is readable, or ''."""
+        try:
+            await asyncio.wait_for(readable.wait(), timeout)
+        except asyncio.TimeoutError:
+            return ""
+        readable.clear()
+        if channel.recv_ready() or channel.eof_received:
+            return decoder.decode(channel.recv(RECV_SIZE))
+        return ""
+
+    async def run(
+        self, cmd, timeout=TIMEOUT_CMD, log_stdout=True, spool_path=None
+    ):
+        """Run a command, returning a Result like SSHExecutor.run."""
+        result = Result()
+        output = OutputBuffer(spool_path=spool_path)
+        try:
+            async for content in self.stream(cmd, timeout):
+                output.append(content)
+                if log_stdout:
+                    sys.stdout.write(content)
+                    sys.stdout.flush()
+            output.append("\n")
+        finally:
+            output.close()
+        result.output = output.getvalue()
+        result.spool_path = output.spool_path
+        result.status = self.last_status
+        return result
+
+    async def run_sudo(
+        self, cmd, timeout=TIMEOUT_CMD, log_stdout=True, spool_path=None
+    ):
+        return await self.run(
+            self._get_sudo_command(cmd), timeout, log_stdout, spool_path
+        )
+
+    async def reboot(self):
+        self._check_sudo_result(await self.run_sudo(REBOOT_CMD), "Reboot")
+
+    async def shutdown(self):
+        self._check_sudo_result(await self.run_sudo(SHUTDOWN_CMD), "Shutdown")
+
+    async def put(self, localpath, remotepath):
+        await self._in_executor(self.ssh_client.put, localpath, remotepath)
+
+    async def get(self, remotepath, localpath):
+        await self._in_executor(self.ssh_client.get, remotepath, localpath)
+
+    async def put_dir(self, localpath, remotepath, timeout=TIMEOUT_CMD):
+        await self._in_executor(
+            self.ssh_client.put_dir, localpath, remotepath, timeout
+        )
+
+    async def get_dir(self, remotepath, localpath, timeout=TIMEOUT_CMD):
+        await self._in_executor(
+            self.ssh_client.get_dir, remotepath, localpath, timeout
+        )
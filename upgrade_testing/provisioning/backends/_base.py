@@ -48,6 +48,14 @@ class ProviderBackend:
     def set_verbose(self, verbose):
         self.verbose = verbose
 
+    def invalidate_cache(self):
+        """Forget any cached view of the available instances."""
+
     @property
     def name(self):
         raise NotImplementedError()
+
+    @property
+    def build_key(self):
+        """Return a string identifying the image or container to build."""
+        raise NotImplementedError()
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import functools
 import logging
 import os
 
@@ -27,17 +28,32 @@ from upgrade_testing.provisioning.backends._base import ProviderBackend
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def _list_containers():
+    """Return the names of the existing containers.
+
+    Cached for the duration of the run, call `_list_containers.cache_clear()`
+    after creating or destroying containers.
+
+    """
+    return frozenset(lxc.list_containers())
+
+
 class LXCBackend(ProviderBackend):
-    def __init__(self, release, distribution, arch):
+    def __init__(self, release, distribution, arch, snapshot_clones=False):
         """Provide backend capabilities as requested in the provision spec.
 
         :param provision_spec: ProvisionSpecification object containing backend
           details.
+        :param snapshot_clones: Whether to run each job in its own
+          ephemeral copy-on-write clone of the cached container instead of a
+          full copy of it.
 
         """
         self.release = release
         self.distro = distribution
         self.arch = arch
+        self.snapshot_clones = snapshot_clones
 
     def available(self):
         """Return true if an lxc container exists that matches the provided
@@ -46,7 +62,10 @@ class LXCBackend(ProviderBackend):
         """
         container_name = self._get_container_name()
         logger.info("Checking for {}".format(container_name))
-        return container_name in lxc.list_containers()
+        return container_name in _list_containers()
+
+    def invalidate_cache(self):
+        _list_containers.cache_clear()
 
     def _get_container_name(self):
         return "autopkgtest-{}-{}".format(self.release, self.arch)
@@ -62,13 +81,26 @@ class LXCBackend(ProviderBackend):
             self.release,
             self.arch,
         ]
-        retcode = run_command_with_logged_output(cmd)
+        retcode = run_command_with_logged_output(
+            cmd, job=self._get_container_name()
+        )
+        _list_containers.cache_clear()
         if retcode != 0:
             raise RuntimeError("Failed to create lxc container.")
 
         logger.info("Container created.")
 
+    @property
+    def build_key(self):
+        return self._get_container_name()
+
     def get_adt_run_args(self, **kwargs):
+        if self.snapshot_clones:
+            # autopkgtest-virt-lxc then starts the job in an ephemeral
+            # snapshot of the cached container (overlayfs, btrfs or zfs
+            # depending on its storage) that lxc destroys once it stops,
+            # rather than making a full copy of it.
+            return ["lxc", "--ephemeral", "-s", self._get_container_name()]
         return ["lxc", "-s", self._get_container_name()]
 
     @property
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
 import logging
 import os
 import shlex
@@ -23,10 +24,24 @@ import shutil
 import signal
 import subprocess
 import tempfile
+import textwrap
 import threading
 
 from paramiko.ssh_exception import SSHException
 
+from upgrade_testing.provisioning._checkpoint import (
+    CheckpointStore,
+    QmpClient,
+    take_internal_snapshot,
+)
+from upgrade_testing.provisioning._storage import (
+    DEFAULT_OVERLAY_SIZE,
+    hold_image,
+    make_working_dir,
+    parse_size,
+    select_storage_dir,
+    stage_image,
+)
 from upgrade_testing.provisioning._util import run_command_with_logged_output
 from upgrade_testing.provisioning.backends._ssh import SshBackend
 
@@ -50,10 +65,56 @@ QEMU_DISK_IMAGE_OPTS = "-drive file={disk_img},if=virtio "
 QEMU_DISK_IMAGE_OVERLAY_OPTS = (
     "-drive file={overlay_img},cache=unsafe,if=virtio,index=0 "
 )
+# The name qemu gives the drive above, used to snapshot it.
+QEMU_OVERLAY_DRIVE = "virtio0"
+QEMU_QMP_OPTS = "-qmp unix:{socket},server=on,wait=off "
+QMP_SOCKET_NAME = "qmp.sock"
+# Created in the testbed once a checkpoint is taken, or couldn't be. Any
+# changes to this location will need to be updated in the autopkgtest script
+# (CHECKPOINT_DIR).
+TESTBED_CHECKPOINT_ACK = "/var/tmp/ubuntu-upgrade-testing/checkpoint/taken"
+TESTBED_CHECKPOINT_FAILED = "/var/tmp/ubuntu-upgrade-testing/checkpoint/failed"
 DEFAULT_RAM = "3072"
 DEFAULT_CPU = "2"
 TIMEOUT_REBOOT = "300"
 HEADLESS = True
+PREFETCH_SCRIPT_PATH = "/usr/local/sbin/auto-upgrade-testing-prefetch"
+PREFETCH_ARCHIVES_DIR = "/var/cache/auto-upgrade-testing/archives"
+# Run inside the image while it is being built: resolve the package set of the
+# target release against the installed system and download it into an
+# archives directory that apt (and so do-release-upgrade) is configured to use.
+# Only the first hop can be resolved this way, a later one depends on what the
+# hop before it leaves installed.
+PREFETCH_SCRIPT = r"""#!/bin/sh
+set -e
+current="$(lsb_release -sc)"
+target="$1"
+archives="{archives}"
+mkdir -p "$archives/partial"
+cat > /etc/apt/apt.conf.d/00auto-upgrade-testing-prefetch <<EOF
+Dir::Cache::Archives "$archives/";
+APT::Keep-Downloaded-Packages "true";
+Binary::apt::APT::Keep-Downloaded-Packages "true";
+EOF
+work="$(mktemp -d)"
+mkdir -p "$work/lists/partial" "$work/sources.list.d"
+touch "$work/sources.list"
+if [ -f /etc/apt/sources.list ]; then
+    sed "s/\b$current/$target/g" /etc/apt/sources.list > "$work/sources.list"
+fi
+for f in /etc/apt/sources.list.d/*.list /etc/apt/sources.list.d/*.sources; do
+    [ -f "$f" ] || continue
+    sed "s/\b$current/$target/g" "$f" > "$work/sources.list.d/${{f##*/}}"
+done
+opts="-o Dir::State::Lists=$work/lists"
+opts="$opts -o Dir::Etc::SourceList=$work/sources.list"
+opts="$opts -o Dir::Etc::SourceParts=$work/sources.list.d"
+apt-get $opts update
+apt-get $opts -y --download-only dist-upgrade
+rm -rf "$work"
+""".format(
+    archives=PREFETCH_ARCHIVES_DIR
+)
 
 logger = logging.getLogger(__name__)
 
@@ -62,21 +123,63 @@ class QemuBackend(SshBackend):
 
     # We can change the Backends to require just what they need. In this case
     # it would be distribution, release name (, arch)
-    def __init__(self, release, arch, image_name, packages, build_args=[]):
+    def __init__(
+        self,
+        release,
+        arch,
+        image_name,
+        packages,
+        build_args=[],
+        prefetch_release=None,
+        storage_tiers=[],
+        stage_images=False,
+        overlay_size=DEFAULT_OVERLAY_SIZE,
+        retry_policy=None,
+        checkpoints=False,
+    ):
         """Provide backend capabilities as requested in the provision spec.
 
         :param provision_spec: ProvisionSpecification object containing backend
           details.
+        :param prefetch_release: Name of the release upgraded to first, whose
+          upgrade package set is downloaded into the image while it is being
+          built.
+        :param storage_tiers: List of StorageTier, fastest first, to place
+          overlays and working directories on.
+        :param stage_images: Whether to copy the base image onto the fastest
+          storage tier with room for it before launching.
+        :param overlay_size: Space an overlay is expected to grow to.
+        :param retry_policy: RetryPolicy bounding how long to wait for the
+          vm to boot and accept a connection.
+        :param checkpoints: Whether to snapshot the overlay when the upgrade
+          script reports a checkpoint (only with keep_overlay).
 
         """
-        super().__init__(release, arch, image_name, build_args)
+        super().__init__(
+            release, arch, image_name, build_args, retry_policy=retry_policy
+        )
         self.release = release
         self.arch = arch
         self.image_name = image_name
         self.build_args = build_args
         self.packages = packages
-        self.working_dir = tempfile.mkdtemp()
+        self.prefetch_release = prefetch_release
+        self.storage_tiers = storage_tiers
+        self.stage_images = stage_images
+        self.overlay_size = parse_size(overlay_size)
+        self.checkpoints = checkpoints
+        # Name of the checkpoint the overlay was restored to, if resuming.
+        self.resumed_checkpoint = None
+        # (QemuBackend, checkpoint name) of another run to start from.
+        self.fork_source = None
+        self.overlay_path = None
+        # The base image this run uses, resolved (and staged) once.
+        self.base_image_path = None
+        # Keeps a staged base image from being evicted while it is used.
+        self.base_image_hold = None
+        self.working_dir = make_working_dir(self.storage_tiers)
         self.qemu_runner = None
+        self.qemu_process = None
         self.find_free_port()
 
     def available(self):
@@ -89,80 +192,302 @@ class QemuBackend(SshBackend):
         """Create a qemu image."""
 
         logger.info("Creating qemu image for run.")
+        # Build into a private directory and publish the finished image with
+        # an atomic rename so concurrent runs never see a partial image.
+        build_dir = tempfile.mkdtemp(prefix=".build-", dir=CACHE_DIR)
+        try:
+            self._build_image(adt_base_path, build_dir)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        logger.info("Image created.")
+
+    def _build_image(self, adt_base_path, build_dir):
         cmd = "{builder_cmd} -a {arch} -r {release} -o {output} --userdata {userdata} {verbose} {args}".format(
             builder_cmd=os.path.join(
                 adt_base_path, "autopkgtest-buildvm-ubuntu-cloud"
             ),
             arch=self.arch,
             release=self.release,
-            output=CACHE_DIR,
+            output=build_dir,
             userdata=self.create_custom_cloud_init(),
             verbose="-v" if self.verbose else "",
             args=" ".join(self.build_args),
         )
 
-        run_command_with_logged_output(cmd, shell=True)
+        retcode = run_command_with_logged_output(
+            cmd, shell=True, job=self.image_name
+        )
+        if retcode != 0:
+            raise RuntimeError("Failed to create qemu image.")
 
         initial_image_name = "autopkgtest-{}-{}.img".format(
             self.release, self.arch
         )
-        initial_image_path = os.path.join(CACHE_DIR, initial_image_name)
+        initial_image_path = os.path.join(build_dir, initial_image_name)
         final_image_path = os.path.join(CACHE_DIR, self.image_name)
-        os.rename(initial_image_path, final_image_path)
-        logger.info("Image created.")
+        os.replace(initial_image_path, final_image_path)
 
     def close(self):
         if self.qemu_runner:
             try:
-                self.shutdown()
-            except PermissionError:
-                print(
-                    "Shutdown sudo command failed. "
-                    'Check password: "{}".'.format(self.password)
-                )
-                self.stop_qemu()
-            except SSHException:
-                self.stop_qemu()
+                self._shutdown_vm()
             finally:
                 self.qemu_runner.join(timeout=5)
             shutil.rmtree(self.working_dir)
             self.working_dir = None
             self.qemu_runner = None
             super().close()
+        self.base_image_path = None
+        if self.base_image_hold is not None:
+            self.base_image_hold.close()
+            self.base_image_hold = None
 
     def reboot(self):
         self.close()
         self.connect()
 
+    def is_alive(self):
+        """Return False once the vm we launched has exited."""
+        if self.qemu_process is not None:
+            return self.qemu_process.returncode is None
+        if self.qemu_runner is not None:
+            return self.qemu_runner.is_alive()
+        return True
+
+    def _shutdown_vm(self):
+        """Shut the vm down over ssh, or stop it if that isn't possible."""
+        if not self.connected:
+            # e.g. the vm never booted or accepted our login.
+            self.stop_qemu()
+            return
+        try:
+            self.shutdown()
+        except PermissionError:
+            print(
+                "Shutdown sudo command failed. "
+                'Check password: "{}".'.format(self.password)
+            )
+            self.stop_qemu()
+        except Exception as e:
+            logger.warning("Unable to shut the vm down: {}".format(e))
+            self.stop_qemu()
+
     def stop_qemu(self):
-        pid_file = os.path.join(self.working_dir, "qemu.pid")
-        with open(pid_file) as f:
-            pid = int(f.read().strip())
-        os.kill(pid, signal.SIGTERM)
+        pid = self.testbed_pid()
+        if pid is None:
+            return
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as e:
+            # qemu has already gone.
+            logger.debug("Not stopping qemu: {}".format(e))
+
+    def testbed_pid(self):
+        """Return the pid of the qemu we launched, or None.
+
+        autopkgtest connects to that vm over ssh, so its CPU use isn't
+        part of the autopkgtest process tree.
+
+        """
+        if self.qemu_process is not None:
+            return self.qemu_process.pid
+        if self.qemu_runner is None:
+            return None
+        try:
+            with open(os.path.join(self.working_dir, "qemu.pid")) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError) as e:
+            # qemu never started or has already gone.
+            logger.debug("No qemu pid: {}".format(e))
+            return None
+
+    def get_adt_run_args(self, keep_overlay=False, resume_from=None, **kwargs):
+        """Return the autopkgtest virt-server args to test with.
+
+        :param keep_overlay: Launch the vm ourselves, on an overlay that is
+          kept after the run, and have autopkgtest connect to it over ssh.
+        :param resume_from: With keep_overlay, restore the kept overlay to
+          its latest checkpoint after this phase (see CHECKPOINT_PHASES,
+          or 'latest' for any phase) instead of starting from scratch.
+        :raises RuntimeError: if there is no checkpoint to resume from.
 
-    def get_adt_run_args(self, keep_overlay=False, **kwargs):
+        """
         if keep_overlay:
+            if self.working_dir is None:
+                # Closed after an earlier run, e.g. one being retried.
+                self.working_dir = make_working_dir(self.storage_tiers)
+            # Only set again by the restore or fork for this run.
+            self.resumed_checkpoint = None
+            if resume_from:
+                self.overlay_path = self._restore_checkpoint(resume_from)
+            elif self.fork_source is not None:
+                self.overlay_path = self._fork_overlay(*self.fork_source)
+            else:
+                self.overlay_path = os.path.join(
+                    self.get_overlay_dir(OVERLAY_DIR), self.image_name
+                )
             self.qemu_runner = self.launch_qemu(
                 self.image_name,
                 kwargs.get("ram", DEFAULT_RAM),
                 kwargs.get("cpu", DEFAULT_CPU),
                 kwargs.get("headless", HEADLESS),
                 port=self.port,
-                overlay=os.path.join(OVERLAY_DIR, self.image_name),
+                overlay=self.overlay_path,
             )
             super().connect()
             return super().get_adt_run_args()
+        return (
+            [
+                "qemu",
+                "-c",
+                DEFAULT_CPU,
+                "--ram-size",
+                DEFAULT_RAM,
+                "--timeout-reboot",
+                TIMEOUT_REBOOT,
+            ]
+            + self._get_overlay_dir_args()
+            + [self.get_base_image_path()]
+        )
+
+    def on_testbed_event(self, event):
+        """Snapshot the overlay when the upgrade script asks for it."""
+        if event.get("event") != "checkpoint" or not self.checkpoints:
+            return
+        if self.qemu_runner is None:
+            logger.debug("Not running the vm, can't take checkpoints")
+            return
+        name = event["name"]
+        try:
+            take_internal_snapshot(
+                QmpClient(self._qmp_socket_path()), QEMU_OVERLAY_DRIVE, name
+            )
+        except (OSError, RuntimeError) as e:
+            logger.warning("Unable to take checkpoint {}: {}".format(name, e))
+            # Don't keep the testbed waiting for a snapshot that won't come.
+            self._acknowledge_checkpoint(TESTBED_CHECKPOINT_FAILED)
+            return
+        self._checkpoint_store(self.overlay_path).record(name, event["phase"])
+        logger.info("Took checkpoint {}".format(name))
+        self._acknowledge_checkpoint(TESTBED_CHECKPOINT_ACK)
+
+    def _acknowledge_checkpoint(self, marker):
+        """Let the testbed carry on, creating `marker` on it."""
+        command = "touch {}".format(marker)
+        try:
+            self.run_sudo(command, log_stdout=False)
+        except (OSError, SSHException):
+            # Our connection doesn't survive the testbed rebooting.
+            SshBackend.close(self)
+            self.connect()
+            self.run_sudo(command, log_stdout=False)
+
+    def _restore_checkpoint(self, phase):
+        """Restore a kept overlay to its latest checkpoint after `phase`.
+
+        A retry resumes the overlay of the run being retried, which for a
+        forked run isn't among the kept overlays of the image.
+
+        """
+        if self.overlay_path is not None:
+            overlay_paths = [self.overlay_path]
+        else:
+            overlay_paths = self._kept_overlay_paths()
+        for overlay_path in overlay_paths:
+            store = self._checkpoint_store(overlay_path)
+            name = store.latest(None if phase == "latest" else phase)
+            if name is not None:
+                store.restore(name)
+                self.resumed_checkpoint = name
+                return overlay_path
+        raise RuntimeError(
+            "No usable {} checkpoint for {}".format(phase, self.image_name)
+        )
+
+    def _fork_overlay(self, source, name):
+        """Return a copy of the overlay of `source` restored to `name`.
+
+        Falls back to a fresh overlay at the same path if the checkpoint
+        wasn't taken.
+
+        """
+        if source.overlay_path is None:
+            fork_path = os.path.join(
+                self.get_overlay_dir(OVERLAY_DIR), self.image_name
+            )
+            logger.warning("{} never ran, starting afresh".format(source))
+            return fork_path
+        fork_path = "{}.{}".format(source.overlay_path, name)
+        source_store = source._checkpoint_store(source.overlay_path)
+        if name not in [c["name"] for c in source_store.checkpoints()]:
+            logger.warning("No {} checkpoint, starting afresh".format(name))
+            return fork_path
+        try:
+            # Cheap where the filesystem can share the blocks.
+            subprocess.check_call(
+                ["cp", "--reflink=auto", source.overlay_path, fork_path]
+            )
+            store = self._checkpoint_store(fork_path)
+            # Restoring trims the copied checkpoints to those up to `name`,
+            # which a retry of this run can then resume from.
+            shutil.copyfile(source_store.manifest_path, store.manifest_path)
+            store.restore(name)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(
+                "Unable to fork {}, starting afresh: {}".format(name, e)
+            )
+            return fork_path
+        self.resumed_checkpoint = name
+        return fork_path
+
+    def _kept_overlay_paths(self):
+        overlay_dirs = [
+            os.path.join(tier.path, "overlay") for tier in self.storage_tiers
+        ] + [OVERLAY_DIR]
         return [
-            "qemu",
-            "-c",
-            DEFAULT_CPU,
-            "--ram-size",
-            DEFAULT_RAM,
-            "--timeout-reboot",
-            TIMEOUT_REBOOT,
-            os.path.join(CACHE_DIR, self.image_name),
+            os.path.join(overlay_dir, self.image_name)
+            for overlay_dir in overlay_dirs
+            if os.path.isfile(os.path.join(overlay_dir, self.image_name))
         ]
 
+    def _checkpoint_store(self, overlay_path):
+        return CheckpointStore(overlay_path, self.get_base_image_path())
+
+    def _qmp_socket_path(self):
+        return os.path.join(self.working_dir, QMP_SOCKET_NAME)
+
+    def get_base_image_path(self):
+        """Return the path of the base image to boot or build overlays on.
+
+        Staged onto a faster storage tier first if requested. The path is
+        resolved once per run, so the overlay and its checkpoints agree on
+        it, and kept until the backend is closed.
+
+        """
+        if self.base_image_path is None:
+            image_path = os.path.join(CACHE_DIR, self.image_name)
+            if self.stage_images and self.storage_tiers:
+                image_path = stage_image(image_path, self.storage_tiers)
+                self.base_image_hold = hold_image(image_path)
+            self.base_image_path = image_path
+        return self.base_image_path
+
+    def get_overlay_dir(self, default=None):
+        """Return the directory overlay images should be created in."""
+        overlay_dir = select_storage_dir(
+            self.storage_tiers, self.overlay_size, default=None
+        )
+        if overlay_dir is None:
+            return default
+        return os.path.join(overlay_dir, "overlay")
+
+    def _get_overlay_dir_args(self):
+        overlay_dir = self.get_overlay_dir()
+        if overlay_dir is None:
+            return []
+        os.makedirs(overlay_dir, exist_ok=True)
+        return ["--overlay-dir", overlay_dir]
+
     def create_custom_cloud_init(self):
         userdata = """#cloud-config
 timezone: UTC
@@ -206,27 +531,51 @@ write_files:
      [Install]
      WantedBy=multi-user.target
    path: /etc/systemd/system/auto-upgrade-testing@.service
-runcmd:
+%(prefetch_files)sruncmd:
  # configure serial console for autopkgtest access
  - ln -sf /dev/null /etc/systemd/system/auto-upgrade-testing.service
  - ln -sf /etc/systemd/system/auto-upgrade-testing@.service /etc/systemd/system/multi-user.target.wants/auto-upgrade-testing@ttyS1.service
  - ln -sf /etc/systemd/system/auto-upgrade-testing@.service /etc/systemd/system/multi-user.target.wants/auto-upgrade-testing@hvc1.service
-power_state:
+%(prefetch_cmds)spower_state:
   delay: now
   mode: poweroff
   message: Image creation finished, powering off
   timeout: 2
   condition: true""" % {
-            "packages": "\n".join([f" - {x}" for x in self.packages] or [])
+            "packages": "\n".join([f" - {x}" for x in self.packages] or []),
+            **self._get_prefetch_userdata(),
         }
         userdata_path = os.path.join(self.working_dir, "user-data")
         with open(userdata_path, "w") as f:
             f.write(userdata)
         return userdata_path
 
+    def _get_prefetch_userdata(self):
+        """Return the cloud-init snippets for the upgrade prefetch stage.
+
+        These are empty unless a release to prefetch for was requested, in
+        which case the image is left exactly as it was built before.
+
+        """
+        if not self.prefetch_release:
+            return dict(prefetch_files="", prefetch_cmds="")
+        prefetch_files = (
+            " - content: |\n{content}"
+            "   path: {path}\n"
+            "   permissions: '0755'\n"
+        ).format(
+            content=textwrap.indent(PREFETCH_SCRIPT, " " * 5),
+            path=PREFETCH_SCRIPT_PATH,
+        )
+        prefetch_cmds = " - [{}, {}]\n".format(
+            PREFETCH_SCRIPT_PATH, self.prefetch_release
+        )
+        return dict(prefetch_files=prefetch_files, prefetch_cmds=prefetch_cmds)
+
     def create_overlay_image(self, overlay_img):
         """Create an overlay image for specified base image."""
         overlay_dir = os.path.dirname(overlay_img)
+        self._checkpoint_store(overlay_img).clear()
         if os.path.isfile(overlay_img):
             os.remove(overlay_img)
         elif not os.path.isdir(overlay_dir):
@@ -238,7 +587,7 @@ power_state:
                 "-f",
                 "qcow2",
                 "-b",
-                os.path.join(CACHE_DIR, self.image_name),
+                self.get_base_image_path(),
                 "-F",
                 "qcow2",
                 overlay_img,
@@ -282,7 +631,9 @@ power_state:
         :return: Disk image arguments as string.
         """
         if overlay:
-            self.create_overlay_image(overlay)
+            # A restored checkpoint is booted as it is.
+            if self.resumed_checkpoint is None:
+                self.create_overlay_image(overlay)
             return QEMU_DISK_IMAGE_OVERLAY_OPTS.format(overlay_img=overlay)
         else:
             return QEMU_DISK_IMAGE_OPTS.format(disk_img=self.image_name)
@@ -309,6 +660,50 @@ power_state:
         runner.start()
         return runner
 
+    async def async_launch_qemu(
+        self, img, ram, cpu, headless, port=None, overlay=None
+    ):
+        """asyncio variant of launch_qemu.
+
+        The qemu process is supervised by the event loop rather than by a
+        thread blocked waiting on it.
+
+        :returns: The asyncio.subprocess.Process running qemu.
+
+        """
+        cmd = self.get_qemu_launch_command(
+            self.working_dir, img, ram, cpu, headless, port, overlay
+        )
+        logger.info(" ".join(cmd))
+        self.qemu_process = await asyncio.create_subprocess_exec(*cmd)
+        return self.qemu_process
+
+    async def async_stop_qemu(self, executor=None, timeout=60):
+        """Shut the guest down and wait for the qemu process to exit.
+
+        :param executor: Optional connected AsyncSSHExecutor used to ask the
+          guest to shut down cleanly, otherwise qemu is terminated.
+
+        """
+        if self.qemu_process is None:
+            return
+        try:
+            if executor is not None:
+                try:
+                    await executor.shutdown()
+                except (PermissionError, SSHException):
+                    self.qemu_process.terminate()
+                finally:
+                    executor.close()
+            else:
+                self.qemu_process.terminate()
+            await asyncio.wait_for(self.qemu_process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.qemu_process.kill()
+            await self.qemu_process.wait()
+        finally:
+            self.qemu_process = None
+
     def _launch_qemu(
         self,
         working_dir,
@@ -358,6 +753,10 @@ power_state:
         )
         # Get disk args including overlay image if specified
         cmd += self.get_disk_args(overlay)
+        if self.checkpoints and overlay:
+            cmd += QEMU_QMP_OPTS.format(
+                socket=os.path.join(work_dir, QMP_SOCKET_NAME)
+            )
         # Add display parameters
         cmd += self.get_display_args(headless)
         # Add network. This must preceed the port forwarding option.
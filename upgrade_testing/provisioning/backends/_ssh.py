@@ -19,13 +19,12 @@
 import errno
 import logging
 import os
+import shlex
 import socket
 import subprocess
-import time
-
-import pexpect
-from retrying import retry
 
+from upgrade_testing.provisioning._retry import RetryPolicy
+from upgrade_testing.provisioning.async_executors import AsyncSSHExecutor
 from upgrade_testing.provisioning.backends._base import ProviderBackend
 from upgrade_testing.provisioning.executors import SSHExecutor
 
@@ -50,11 +49,14 @@ class SshBackend(ProviderBackend):
         username=None,
         password=None,
         device_ip=None,
+        retry_policy=None,
     ):
         """Provide backend capabilities as requested in the provision spec.
 
         :param provision_spec: ProvisionSpecification object containing backend
           details.
+        :param retry_policy: RetryPolicy bounding how long to wait for the
+          device to come up and accept a connection.
 
         """
         self.release = release
@@ -68,6 +70,7 @@ class SshBackend(ProviderBackend):
         self.key_file = None
         self.device_ip = device_ip or "localhost"
         self.port = -1
+        self.retry_policy = retry_policy or RetryPolicy()
 
     def available(self):
         """Return true if a qemu exists that matches the provided args."""
@@ -98,6 +101,10 @@ class SshBackend(ProviderBackend):
     def name(self):
         return "ssh"
 
+    @property
+    def build_key(self):
+        return self.image_name
+
     def __repr__(self):
         return "{classname}(release={release})".format(
             classname=self.__class__.__name__, release=self.release
@@ -107,17 +114,61 @@ class SshBackend(ProviderBackend):
     port_to = 23000
 
     def connect(self, timeout=TIMEOUT_CONNECT):
+        """Connect to the device once it is up.
+
+        Waiting for the device and logging in share the deadline of the
+        backend's retry policy, `timeout` only bounds each single attempt.
+
+        """
         if not self.connected:
-            self.enable_ssh()
+            retry_state = self.retry_policy.start()
+            self._wait_for_device(retry_state, timeout)
+            self._get_ssh_id_path()
             self.executor.connect(
                 self.username,
                 self.password,
                 self.port,
                 self.device_ip,
                 timeout,
+                key_filename=self.key_file,
+                retry_state=retry_state,
+                alive=self.is_alive,
             )
+            self.enable_ssh()
             self.connected = True
 
+    def is_alive(self):
+        """Return False once the device can no longer come up."""
+        return True
+
+    async def async_connect(self, timeout=TIMEOUT_CONNECT):
+        """asyncio variant of connect.
+
+        :returns: A connected AsyncSSHExecutor for the device.
+
+        """
+        executor = AsyncSSHExecutor()
+        retry_state = self.retry_policy.start()
+        await executor.wait_for_device(
+            self.device_ip, self.port, retry_state, alive=self.is_alive
+        )
+        self._get_ssh_id_path()
+        await executor.connect(
+            self.username,
+            self.password,
+            self.port,
+            self.device_ip,
+            timeout,
+            key_filename=self.key_file,
+            retry_state=retry_state,
+            alive=self.is_alive,
+        )
+        result = await executor.run(
+            self._get_install_key_command(), log_stdout=False
+        )
+        self._check_key_installed(result)
+        return executor
+
     def close(self):
         if self.connected:
             self.executor.close()
@@ -132,6 +183,15 @@ class SshBackend(ProviderBackend):
     def put(self, src, dst):
         self.executor.put(src, dst)
 
+    def get(self, src, dst):
+        self.executor.get(src, dst)
+
+    def put_dir(self, src, dst, timeout=TIMEOUT_CMD):
+        self.executor.put_dir(src, dst, timeout)
+
+    def get_dir(self, src, dst, timeout=TIMEOUT_CMD):
+        self.executor.get_dir(src, dst, timeout)
+
     def run(self, command, timeout=TIMEOUT_CMD, log_stdout=True):
         return self.executor.run(command, timeout, log_stdout)
 
@@ -155,59 +215,52 @@ class SshBackend(ProviderBackend):
         raise RuntimeError("Could not find free port for SSH connection.")
 
     def enable_ssh(self):
-        """Enable ssh using public key."""
-        self._wait_for_device()
-        self._get_ssh_id_path()
-        if not self._try_public_key_login():
-            self._update_device_host_key()
-            self._copy_ssh_id_to_device()
-            self._verify_ssh_connect()
-
-    def _wait_for_device(self, timeout=TIMEOUT_CONNECT):
-        end = time.time() + timeout
-        while time.time() < end:
-            try:
-                s = socket.create_connection(
-                    (self.device_ip, str(self.port)), timeout
-                )
-            except ConnectionRefusedError:
-                time.sleep(1)
-            else:
-                s.close()
-                return
-        raise TimeoutError(
-            "Could not connect to {} "
-            "port {}.".format(self.device_ip, self.port)
-        )
+        """Enable ssh using public key.
 
-    def _update_device_host_key(self):
-        hosts_path = os.path.expanduser("~/.ssh/known_hosts")
-        subprocess.call(
-            [
-                "ssh-keygen",
-                "-f",
-                hosts_path,
-                "-R",
-                "[{}]:{}".format(self.device_ip, self.port),
-            ]
+        Installs the public key over the executor's (already authenticated)
+        connection so later logins, e.g. by autopkgtest, can use the key.
+
+        """
+        result = self.executor.run(
+            self._get_install_key_command(), log_stdout=False
         )
+        self._check_key_installed(result)
 
-    @retry(
-        stop_max_attempt_number=20,
-        wait_fixed=2000,
-        retry_on_exception=lambda exception: isinstance(
-            exception, RuntimeError
-        ),
-    )
-    def _copy_ssh_id_to_device(self):
-        pub_path = "{}.pub".format(self.key_file)
+    def _get_install_key_command(self):
+        """Return a command adding our public key to authorized_keys."""
+        with open("{}.pub".format(self.key_file)) as f:
+            public_key = f.read().strip()
         home_ssh = "/home/{u}/.ssh".format(u=self.username)
         authorized_keys = os.path.join(home_ssh, "authorized_keys")
-        self._run(["mkdir", "-p", home_ssh])
-        self._put(pub_path, authorized_keys)
-        self._run(["chown", "{u}:{u}".format(u=self.username), "-R", home_ssh])
-        self._run(["chmod", "700", home_ssh])
-        self._run(["chmod", "600", authorized_keys])
+        return (
+            "mkdir -p {ssh} && chmod 700 {ssh} && touch {keys} && "
+            "chmod 600 {keys} && "
+            "(grep -qxF {key} {keys} || echo {key} >> {keys}) && "
+            "grep -qxF {key} {keys}".format(
+                ssh=shlex.quote(home_ssh),
+                keys=shlex.quote(authorized_keys),
+                key=shlex.quote(public_key),
+            )
+        )
+
+    @staticmethod
+    def _check_key_installed(result):
+        if result.status != 0:
+            raise RuntimeError(
+                "Could not install ssh key: {}".format(result.output)
+            )
+
+    def _wait_for_device(self, retry_state, timeout=TIMEOUT_CONNECT):
+        """Wait until the device accepts connections on the ssh port."""
+
+        def attempt(remaining):
+            socket.create_connection(
+                (self.device_ip, str(self.port)), min(timeout, remaining)
+            ).close()
+
+        retry_state.call(
+            "wait_for_device", attempt, retry_on=OSError, alive=self.is_alive
+        )
 
     def _get_ssh_id_path(self):
         match = False
@@ -221,91 +274,3 @@ class SshBackend(ProviderBackend):
                 ["ssh-keygen", "-q", "-t", "rsa", "-f", path, "-N", ""]
             )
         self.key_file = path
-
-    def _try_public_key_login(self):
-        """Try and log in using public key. If this succeeds then there is no
-        need to do any further ssh setup.
-        :return: True if login was successful, False otherwise
-        """
-        cmd = " ".join(
-            [
-                "ssh",
-                "-p",
-                str(self.port),
-                "-o",
-                "UserKnownHostsFile=/dev/null",
-                "-o",
-                "StrictHostKeyChecking=no",
-                "-i",
-                self.key_file,
-                "-l",
-                self.username,
-                self.device_ip,
-            ]
-        )
-        child = pexpect.spawn(cmd)
-        try:
-            index = child.expect(
-                [r"\$", "password", "denied"], timeout=TIMEOUT_CONNECT
-            )
-        except (pexpect.exceptions.TIMEOUT, pexpect.exceptions.EOF):
-            index = -1
-        finally:
-            child.close()
-        return index == 0
-
-    def _verify_ssh_connect(self):
-        """Verify that an ssh connection can be established without using
-        password.
-        """
-        for count in range(20):
-            if self._try_public_key_login():
-                return
-            else:
-                time.sleep(1)
-        raise RuntimeError("Could not create ssh connection")
-
-    def _run(self, commands, timeout=TIMEOUT_CMD):
-        """Run a command setting up an ssh connection using password."""
-        ssh_cmd = [
-            "ssh",
-            "-o",
-            "StrictHostKeyChecking=no",
-            "-p",
-            str(self.port),
-            "{}@{}".format(self.username, self.device_ip),
-        ]
-        self._run_with_password(ssh_cmd + commands, self.password, timeout)
-
-    def _put(self, src, dst, timeout=TIMEOUT_CMD):
-        """Put file onto device setting up an ssh connection using password."""
-        scp_cmd = [
-            "scp",
-            "-o",
-            "StrictHostKeyChecking=no",
-            "-P",
-            str(self.port),
-            src,
-            "{}@{}:{}".format(self.username, self.device_ip, dst),
-        ]
-        self._run_with_password(scp_cmd, self.password, timeout)
-
-    def _run_with_password(self, commands, password, timeout=TIMEOUT_CMD):
-        """Run command expecting a password prompt to be displayed."""
-        command = " ".join(commands)
-        child = pexpect.spawn(command)
-        try:
-            child.expect("password", timeout=timeout)
-        except pexpect.exceptions.EOF:
-            # No password prompt is displayed, so just continue
-            pass
-        else:
-            child.sendline(password)
-            if child.expect([pexpect.EOF, "denied"], timeout=timeout):
-                raise PermissionError(
-                    'Check password is correct: "{}"'.format(password)
-                )
-        finally:
-            child.close()
-        if child.exitstatus:
-            raise RuntimeError("Error running {}".format(command))
@@ -17,24 +17,140 @@
 #
 
 
+import codecs
+import collections
+import gzip
 import os
+import select
+import shlex
 import sys
+import tarfile
+import tempfile
 import time
 from abc import ABCMeta, abstractmethod
 
 import paramiko
 
+from upgrade_testing.provisioning._retry import RetryPolicy
+from upgrade_testing.provisioning._util import extract_tar
+
 TIMEOUT_CMD = 60
 TIMEOUT_CONNECT = 120
 TIMEOUT_WAIT_FOR_DEVICE = 120
+REBOOT_CMD = "shutdown -r now"
+SHUTDOWN_CMD = "shutdown now"
+# Bytes read from the channel at a time.
+RECV_SIZE = 32768
+# Characters of command output kept in memory, any more is spooled to a file.
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Flow control window for channels, large enough to keep bulk transfers over
+# the (slow, high latency) user-mode network limited by bandwidth.
+WINDOW_SIZE = 8 * 1024 * 1024
+MAX_PACKET_SIZE = 32768
+# Low compression level: the link is faster than gzip at higher levels.
+TAR_COMPRESS_LEVEL = 1
+# CBC mode and legacy ciphers are much slower than the CTR/GCM ones paramiko
+# prefers otherwise, don't let the server pick them.
+DISABLED_CIPHERS = [
+    "3des-cbc",
+    "blowfish-cbc",
+    "aes128-cbc",
+    "aes192-cbc",
+    "aes256-cbc",
+]
+# Errors a booting target gives before it accepts logins: refused or reset
+# connections and sshd not answering yet (TypeError from paramiko on an early
+# banner). Authentication failures are not retried, see connect_once.
+CONNECT_ERRORS = (OSError, TypeError, paramiko.ssh_exception.SSHException)
+
+
+def connect_once(ssh_client, *args):
+    """Make one connection attempt, returning any authentication error.
+
+    The error is returned rather than raised so that retrying on
+    CONNECT_ERRORS (which include its base class, SSHException) doesn't
+    spend the whole connect budget on a wrong password or key.
+
+    """
+    try:
+        ssh_client.connect(*args)
+    except paramiko.AuthenticationException as e:
+        return e
+    return None
 
 
 class Result:
-    """Result of command with status and output properties."""
+    """Result of command with status and output properties.
+
+    `output` holds (at most the last OUTPUT_BUFFER_SIZE characters of) the
+    command output. When a spool path was asked for, the complete output is
+    in the file at `spool_path`.
+    """
 
     def __init__(self):
         self.status = None
         self.output = ""
+        self.spool_path = None
+
+
+class OutputBuffer:
+    """Size capped buffer keeping the most recent output.
+
+    Once more than `max_size` characters have been added the oldest output is
+    dropped, after the complete output so far has been written to a spool
+    file which then receives all further output. The spool is a temporary
+    file removed on close, unless `spool_path` asked for the complete output
+    to be kept there.
+    """
+
+    def __init__(self, max_size=OUTPUT_BUFFER_SIZE, spool_path=None):
+        self.max_size = max_size
+        self.spool_path = spool_path
+        self._keep_spool = spool_path is not None
+        self._chunks = collections.deque()
+        self._size = 0
+        self._spool = None
+        if spool_path is not None:
+            self._spool = open(spool_path, "w")
+
+    def append(self, content):
+        if self._spool is not None:
+            self._spool.write(content)
+        self._chunks.append(content)
+        self._size += len(content)
+        if self._size > self.max_size:
+            self._trim()
+
+    def _trim(self):
+        if self._spool is None:
+            self._start_spool()
+        while self._size > self.max_size:
+            excess = self._size - self.max_size
+            oldest = self._chunks[0]
+            if len(oldest) <= excess:
+                self._chunks.popleft()
+                self._size -= len(oldest)
+            else:
+                self._chunks[0] = oldest[excess:]
+                self._size -= excess
+
+    def _start_spool(self):
+        self._spool = tempfile.NamedTemporaryFile(
+            "w", prefix="auto-upgrade-testing-output-", delete=False
+        )
+        self.spool_path = self._spool.name
+        self._spool.writelines(self._chunks)
+
+    def getvalue(self):
+        return "".join(self._chunks)
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+            if not self._keep_spool:
+                os.remove(self.spool_path)
+                self.spool_path = None
 
 
 class SSHClient:
@@ -51,58 +167,118 @@ class SSHClient:
         """
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self._sftp = None
+
+    def connect(
+        self, hostname, user, password, port, timeout=60, key_filename=None
+    ):
+        """Connect to remote host.
 
-    def connect(self, hostname, user, password, port, timeout=60):
-        """Connect to remote host."""
+        When a key_filename is given the key is tried first, falling back to
+        the password on the same connection.
+        """
         timeout = float(timeout)
         self.client.connect(
             hostname,
             username=user,
             password=password,
+            key_filename=key_filename,
+            look_for_keys=False,
+            allow_agent=False,
             port=port,
             timeout=timeout,
             banner_timeout=timeout,
+            disabled_algorithms=dict(ciphers=DISABLED_CIPHERS),
         )
+        transport = self.client.get_transport()
+        transport.default_window_size = WINDOW_SIZE
+        transport.default_max_packet_size = MAX_PACKET_SIZE
 
     def close(self):
         """Close the connection"""
+        if self._sftp is not None:
+            self._sftp.close()
+            self._sftp = None
         self.client.close()
 
-    def run(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True):
+    def _get_sftp(self):
+        """Return the sftp session, opened once for the connection."""
+        if self._sftp is None:
+            self._sftp = paramiko.SFTPClient.from_transport(
+                self.client.get_transport(),
+                window_size=WINDOW_SIZE,
+                max_packet_size=MAX_PACKET_SIZE,
+            )
+        return self._sftp
+
+    def run(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True, spool_path=None):
         """Run a command in the remote host.
         :param cmd: Command to run.
         :param timeout: Period to wait before raising TimeoutError.
         :param log_stdout: Whether to log output to stdout.
+        :param spool_path: Optional file to write the complete output to.
         :return: Result object containing command output and status code.
         """
         channel = self.client.get_transport().open_session()
         channel.set_combine_stderr(True)
         end = time.time() + timeout
         result = Result()
+        output = OutputBuffer(spool_path=spool_path)
+        # Decode incrementally so multi-byte characters split across reads
+        # are kept intact.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
         channel.exec_command(cmd)
-        while not channel.exit_status_ready() or (
-            channel.exit_status_ready() and channel.recv_ready()
-        ):
-            if channel.recv_ready():
-                self._process_output(
-                    result, log_stdout, channel.recv(1024).decode()
-                )
-            elif time.time() > end:
-                print(
-                    "Timeout waiting {} seconds for command to "
-                    "complete: {}".format(timeout, cmd)
-                )
-                raise TimeoutError
-            time.sleep(0.2)
-        # Add a new line after command has completed to ensure output
-        # is separated.
-        self._process_output(result, log_stdout, "\n")
-        result.status = channel.recv_exit_status()
+        try:
+            while not self._command_finished(channel):
+                remaining = end - time.time()
+                if remaining <= 0:
+                    print(
+                        "Timeout waiting {} seconds for command to "
+                        "complete: {}".format(timeout, cmd)
+                    )
+                    raise TimeoutError
+                if channel.eof_received and not channel.recv_ready():
+                    # The output is closed, only the exit status is to come.
+                    channel.status_event.wait(min(remaining, 1))
+                    continue
+                # Wake up on new output, or periodically to notice the
+                # command exiting while something still holds its output open.
+                select.select([channel], [], [], min(remaining, 1))
+                if channel.recv_ready() or channel.eof_received:
+                    data = channel.recv(RECV_SIZE)
+                    self._process_output(
+                        output, log_stdout, decoder.decode(data)
+                    )
+            # Add a new line after command has completed to ensure output
+            # is separated.
+            self._process_output(
+                output, log_stdout, decoder.decode(b"", final=True) + "\n"
+            )
+            result.status = channel.recv_exit_status()
+        finally:
+            output.close()
+            channel.close()
+        result.output = output.getvalue()
+        result.spool_path = output.spool_path
         return result
 
-    def _process_output(self, result, log_stdout, content):
-        """Save output to result and print to stdout if required."""
-        result.output += content
+    @staticmethod
+    def _command_finished(channel):
+        """Return whether the command exited and its output was read.
+
+        A command still running after closing its output isn't finished, one
+        that exited while something still holds its output open is.
+
+        """
+        if channel.recv_ready():
+            return False
+        return channel.exit_status_ready()
+
+    def _process_output(self, output, log_stdout, content):
+        """Save output to buffer and print to stdout if required."""
+        if not content:
+            return
+        output.append(content)
         if log_stdout:
             sys.stdout.write(content)
             sys.stdout.flush()
@@ -112,24 +288,99 @@ class SSHClient:
         if not os.path.isfile(local_path):
             raise RuntimeError("File to copy does not exist")
 
-        with self.client.open_sftp() as sftp:
-            sftp.put(local_path, remote_path)
+        self._get_sftp().put(local_path, remote_path)
 
     def get(self, remote_path, local_path):
         """Copy a file through sftp from the remote_path to the local_path"""
-        with self.client.open_sftp() as sftp:
-            sftp.get(remote_path, local_path)
+        self._get_sftp().get(remote_path, local_path)
 
         if not os.path.isfile(local_path):
             raise RuntimeError("File couldn't be copied")
 
+    def put_dir(self, local_path, remote_path, timeout=TIMEOUT_CMD):
+        """Copy a directory tree from local_path to remote_path.
+
+        The tree is streamed as a single compressed tar over one channel
+        rather than file by file.
+        """
+        if not os.path.isdir(local_path):
+            raise RuntimeError("Directory to copy does not exist")
+
+        cmd = "mkdir -p {dest} && tar -C {dest} -xzf -".format(
+            dest=shlex.quote(remote_path)
+        )
+        channel = self._open_transfer_channel(cmd, timeout)
+        try:
+            with channel.makefile("wb") as channel_file:
+                with gzip.GzipFile(
+                    fileobj=channel_file,
+                    mode="wb",
+                    compresslevel=TAR_COMPRESS_LEVEL,
+                ) as gzip_file:
+                    with tarfile.open(fileobj=gzip_file, mode="w|") as tar:
+                        tar.add(local_path, arcname=".")
+            channel.shutdown_write()
+            self._check_transfer_status(channel, cmd)
+        finally:
+            channel.close()
+
+    def get_dir(self, remote_path, local_path, timeout=TIMEOUT_CMD):
+        """Copy a directory tree from remote_path to local_path.
+
+        The tree is streamed as a single compressed tar over one channel
+        rather than file by file.
+        """
+        cmd = "tar -C {src} -I 'gzip -{level}' -cf - .".format(
+            src=shlex.quote(remote_path), level=TAR_COMPRESS_LEVEL
+        )
+        channel = self._open_transfer_channel(cmd, timeout)
+        try:
+            os.makedirs(local_path, exist_ok=True)
+            with channel.makefile("rb") as channel_file:
+                with tarfile.open(fileobj=channel_file, mode="r|gz") as tar:
+                    extract_tar(tar, local_path)
+            self._check_transfer_status(channel, cmd)
+        finally:
+            channel.close()
+
+    def _open_transfer_channel(self, cmd, timeout):
+        channel = self.client.get_transport().open_session(
+            window_size=WINDOW_SIZE, max_packet_size=MAX_PACKET_SIZE
+        )
+        channel.settimeout(timeout)
+        channel.exec_command(cmd)
+        return channel
+
+    @staticmethod
+    def _check_transfer_status(channel, cmd):
+        status = channel.recv_exit_status()
+        if status != 0:
+            error = ""
+            if channel.recv_stderr_ready():
+                error = channel.recv_stderr(RECV_SIZE).decode(errors="replace")
+            raise RuntimeError(
+                "Transfer command failed ({}): {} {}".format(
+                    status, cmd, error
+                )
+            )
+
 
 class Executor:
     __metaclass__ = ABCMeta
     """Base class for all target executors."""
 
     @abstractmethod
-    def connect(self, username, password, port, host=None, timeout=None):
+    def connect(
+        self,
+        username,
+        password,
+        port,
+        host=None,
+        timeout=None,
+        key_filename=None,
+        retry_state=None,
+        alive=None,
+    ):
         pass
 
     @abstractmethod
@@ -145,14 +396,10 @@ class Executor:
         pass
 
     def reboot(self):
-        result = self.run_sudo("shutdown -r now")
-        if result.status > 0:
-            raise PermissionError("Reboot failed, check password.")
+        self._check_sudo_result(self.run_sudo(REBOOT_CMD), "Reboot")
 
     def shutdown(self):
-        result = self.run_sudo("shutdown now")
-        if result.status > 0:
-            raise PermissionError("Shutdown failed, check password.")
+        self._check_sudo_result(self.run_sudo(SHUTDOWN_CMD), "Shutdown")
 
     @abstractmethod
     def wait_for_device(self, timeout=None):
@@ -172,6 +419,11 @@ class Executor:
             command = "echo {} | sudo -S {}".format(self.password, cmd)
         return command
 
+    @staticmethod
+    def _check_sudo_result(result, action):
+        if result.status > 0:
+            raise PermissionError("{} failed, check password.".format(action))
+
 
 class SSHExecutor(Executor):
     def __init__(self):
@@ -184,37 +436,63 @@ class SSHExecutor(Executor):
         port,
         host="localhost",
         timeout=TIMEOUT_CONNECT,
+        key_filename=None,
+        retry_state=None,
+        alive=None,
     ):
+        """Connect to the target, retrying while it isn't ready.
+
+        :param timeout: Longest time to spend on a single attempt.
+        :param retry_state: RetryState whose 'connect' phase bounds the
+          retries, by default they are bounded by `timeout`.
+        :param alive: Optional callable returning False once the target can
+          no longer come up.
+
+        """
         self.password = password
-        count = max(1, timeout)
-        for attempt in range(count):
-            try:
-                self.ssh_client.connect(
-                    host, username, password, port, timeout
-                )
-            except TypeError:
-                # This can happen when target not yet running so just try again
-                time.sleep(1)
-            except paramiko.ssh_exception.AuthenticationException:
-                raise
-            else:
-                return
-        raise RuntimeError("Could not connect to target.")
+        if retry_state is None:
+            retry_state = RetryPolicy(deadline=timeout).start()
+        auth_error = retry_state.call(
+            "connect",
+            lambda remaining: connect_once(
+                self.ssh_client,
+                host,
+                username,
+                password,
+                port,
+                min(timeout, remaining),
+                key_filename,
+            ),
+            retry_on=CONNECT_ERRORS,
+            alive=alive,
+        )
+        if auth_error is not None:
+            raise auth_error
 
     def close(self):
         self.ssh_client.close()
 
-    def _run(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True):
-        return self.ssh_client.run(cmd, timeout, log_stdout)
+    def _run(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True, spool_path=None):
+        return self.ssh_client.run(cmd, timeout, log_stdout, spool_path)
 
-    def run(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True):
-        return self._run(cmd, timeout, log_stdout)
+    def run(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True, spool_path=None):
+        return self._run(cmd, timeout, log_stdout, spool_path)
 
-    def run_sudo(self, cmd, timeout=TIMEOUT_CMD, log_stdout=True):
-        return self._run(self._get_sudo_command(cmd), timeout, log_stdout)
+    def run_sudo(
+        self, cmd, timeout=TIMEOUT_CMD, log_stdout=True, spool_path=None
+    ):
+        return self._run(
+            self._get_sudo_command(cmd), timeout, log_stdout, spool_path
+        )
 
     def put(self, localpath, remotepath):
         self.ssh_client.put(localpath, remotepath)
 
     def get(self, remotepath, localpath):
         self.ssh_client.get(remotepath, localpath)
+
+    def put_dir(self, localpath, remotepath, timeout=TIMEOUT_CMD):
+        self.ssh_client.put_dir(localpath, remotepath, timeout)
+
+    def get_dir(self, remotepath, localpath, timeout=TIMEOUT_CMD):
+        self.ssh_client.get_dir(remotepath, localpath, timeout)
@@ -0,0 +1,99 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+from upgrade_testing.results._artifacts import SystemDetails, ensure_artifact
+from upgrade_testing.results._batchreport import BatchReport
+from upgrade_testing.results._classify import (
+    REAL,
+    TRANSIENT,
+    Classification,
+    classify_failure,
+    failed_phase,
+    read_classification,
+    run_events,
+    write_classification,
+)
+from upgrade_testing.results._dpkglog import (
+    ACTION_KINDS,
+    PackageTimings,
+    format_package_timings,
+    parse_dpkg_log,
+)
+from upgrade_testing.results._events import (
+    EVENTS_FILE_NAME,
+    PhaseTracker,
+    hops_from_events,
+    parse_event_line,
+    phases_from_events,
+    read_events,
+    run_and_track_events,
+)
+from upgrade_testing.results._history import RunHistory
+from upgrade_testing.results._logindex import LogIndex
+from upgrade_testing.results._store import ArtifactStore
+from upgrade_testing.results._upgraderlog import (
+    UPGRADER_PHASES,
+    bottleneck,
+    format_upgrader_profile,
+    parse_main_log,
+    profile_upgrader_logs,
+    throughput,
+)
+from upgrade_testing.results._watchdog import (
+    Watchdog,
+    read_abort_reason,
+    write_abort_reason,
+)
+
+__all__ = [
+    "ACTION_KINDS",
+    "ArtifactStore",
+    "BatchReport",
+    "Classification",
+    "EVENTS_FILE_NAME",
+    "LogIndex",
+    "PackageTimings",
+    "PhaseTracker",
+    "REAL",
+    "RunHistory",
+    "SystemDetails",
+    "TRANSIENT",
+    "UPGRADER_PHASES",
+    "Watchdog",
+    "bottleneck",
+    "classify_failure",
+    "ensure_artifact",
+    "failed_phase",
+    "format_package_timings",
+    "format_upgrader_profile",
+    "hops_from_events",
+    "parse_dpkg_log",
+    "parse_event_line",
+    "parse_main_log",
+    "phases_from_events",
+    "profile_upgrader_logs",
+    "read_abort_reason",
+    "read_classification",
+    "read_events",
+    "run_and_track_events",
+    "run_events",
+    "throughput",
+    "write_abort_reason",
+    "write_classification",
+]
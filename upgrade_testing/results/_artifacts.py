@@ -0,0 +1,278 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import functools
+import gzip
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from collections import namedtuple
+
+from upgrade_testing.provisioning import extract_tar
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_DETAILS_NAME = "system_details"
+ARCHIVE_SUFFIXES = (".tar.zst", ".tar.gz")
+MANIFEST_SUFFIX = ".manifest"
+STATUS_COLLECTED = "collected"
+# Written in a run's output directory once an ArtifactStore took it in.
+STORE_INDEX_NAME = "artifacts.index.json"
+
+ManifestEntry = namedtuple("ManifestEntry", ["status", "size", "path"])
+
+
+class SystemDetails:
+    """Files collected from a testbed by the upgrade script.
+
+    The testbed hands them over as one compressed archive with a manifest.
+    The archive is only unpacked (next to it, once) when a file is asked for.
+
+    :param results_dir: The upgrade_run artifacts directory of a run.
+
+    """
+
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+        self.extract_dir = os.path.join(results_dir, SYSTEM_DETAILS_NAME)
+
+    @property
+    def archive_path(self):
+        """Return the path of the collected archive, or None."""
+        for suffix in ARCHIVE_SUFFIXES:
+            path = os.path.join(self.results_dir, SYSTEM_DETAILS_NAME + suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def manifest(self):
+        """Return a list of ManifestEntry for each candidate file."""
+        manifest_path = os.path.join(
+            self.results_dir, SYSTEM_DETAILS_NAME + MANIFEST_SUFFIX
+        )
+        entries = []
+        try:
+            with open(manifest_path, errors="replace") as f:
+                for line in f:
+                    if line.startswith("#") or not line.strip():
+                        continue
+                    status, size, path = line.rstrip("\n").split("\t", 2)
+                    entries.append(ManifestEntry(status, int(size), path))
+        except FileNotFoundError:
+            logger.debug("No manifest in {}".format(self.results_dir))
+        return entries
+
+    def collected(self):
+        """Return the testbed paths of the files in the archive."""
+        return [
+            entry.path
+            for entry in self.manifest()
+            if entry.status == STATUS_COLLECTED
+        ]
+
+    def path(self, testbed_path):
+        """Return the local path of a collected file, unpacking if needed.
+
+        :param testbed_path: Absolute path of the file on the testbed, e.g.
+          '/var/log/dpkg.log'.
+        :raises FileNotFoundError: if the file wasn't collected.
+
+        """
+        self.extract()
+        local_path = os.path.join(self.extract_dir, testbed_path.lstrip("/"))
+        if not ensure_artifact(local_path):
+            raise FileNotFoundError(
+                "{} was not collected from the testbed".format(testbed_path)
+            )
+        return local_path
+
+    def open(self, testbed_path, mode="r"):
+        """Open a collected file, unpacking the archive if needed."""
+        if "b" in mode:
+            return open(self.path(testbed_path), mode)
+        return open(self.path(testbed_path), mode, errors="replace")
+
+    def extract(self):
+        """Unpack the archive into `extract_dir` unless already done.
+
+        Results from before archives were used have `extract_dir` populated
+        already and are used as they are.
+
+        """
+        if os.path.isdir(self.extract_dir):
+            return self.extract_dir
+        archive_path = self.archive_path
+        if archive_path is None:
+            raise FileNotFoundError(
+                "No system details in {}".format(self.results_dir)
+            )
+        # Unpack beside the final location and rename into place so that a
+        # partial unpack is never mistaken for a complete one.
+        partial_dir = tempfile.mkdtemp(
+            prefix=".{}-".format(SYSTEM_DETAILS_NAME), dir=self.results_dir
+        )
+        try:
+            _extract_archive(archive_path, partial_dir)
+            os.rename(partial_dir, self.extract_dir)
+        except OSError:
+            if not os.path.isdir(self.extract_dir):
+                raise
+        finally:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+        return self.extract_dir
+
+
+def store_object_path(store_root, digest):
+    """Return where an ArtifactStore keeps the file with `digest`."""
+    return os.path.join(store_root, "objects", digest[:2], digest + ".gz")
+
+
+def read_store_index(output_dir):
+    """Return the store index of a run, or None if it wasn't taken in."""
+    index_path = os.path.join(output_dir, STORE_INDEX_NAME)
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return _load_index(index_path, mtime)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_index(index_path, mtime):
+    # Keyed on the mtime too so that a rewritten index is read again.
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def ensure_artifact(path):
+    """Return whether an artifact exists, fetching it from a store if needed.
+
+    Artifacts of runs an ArtifactStore took in are replaced by the run's
+    index, they are written back in place the first time they are needed.
+
+    :param path: The path of a file under a run's artifacts directory.
+
+    """
+    if os.path.lexists(path):
+        return True
+    store_root, entry = _stored_entry(path)
+    if entry is None:
+        return False
+    _restore_entry(store_root, entry, path)
+    return True
+
+
+def open_artifact(path):
+    """Open an artifact for reading in binary mode, wherever it is kept.
+
+    Unlike ensure_artifact, a file in a store is read from there rather than
+    written back.
+
+    :raises FileNotFoundError: if there is no such artifact.
+
+    """
+    if os.path.lexists(path):
+        return open(path, "rb")
+    store_root, entry = _stored_entry(path)
+    if entry is None:
+        raise FileNotFoundError("No artifact {}".format(path))
+    if "sha256" in entry:
+        return gzip.open(store_object_path(store_root, entry["sha256"]))
+    # Links are followed once they are restored.
+    _restore_entry(store_root, entry, path)
+    return open(path, "rb")
+
+
+def _stored_entry(path):
+    """Return the store and index entry of an artifact, or (None, None)."""
+    output_dir, relative_path = _find_indexed_run(os.path.abspath(path))
+    if output_dir is None:
+        return None, None
+    index = read_store_index(output_dir)
+    entry = index["files"].get(relative_path)
+    if entry is None:
+        return None, None
+    return index["store"], entry
+
+
+def _find_indexed_run(path):
+    """Return the output dir with an index above `path` and the path in it."""
+    directory = os.path.dirname(path)
+    while os.path.dirname(directory) != directory:
+        if os.path.exists(os.path.join(directory, STORE_INDEX_NAME)):
+            relative_path = os.path.relpath(
+                path, os.path.join(directory, "artifacts")
+            )
+            if relative_path.startswith(os.pardir):
+                break
+            return directory, relative_path
+        directory = os.path.dirname(directory)
+    return None, None
+
+
+def _restore_entry(store_root, entry, path):
+    logger.debug("Restoring {} from {}".format(path, store_root))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if "link" in entry:
+        os.symlink(entry["link"], path)
+        return
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(path), delete=False
+    ) as f:
+        try:
+            with gzip.open(
+                store_object_path(store_root, entry["sha256"])
+            ) as source:
+                shutil.copyfileobj(source, f)
+            os.chmod(f.name, entry["mode"])
+        except BaseException:
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def _extract_archive(archive_path, dest):
+    """Unpack an archive into `dest`.
+
+    :raises RuntimeError: if the archive can't be unpacked.
+
+    """
+    logger.info("Unpacking {}".format(archive_path))
+    try:
+        _extract_tar_file(archive_path, dest)
+    except tarfile.TarError as e:
+        raise RuntimeError("Unable to unpack {}: {}".format(archive_path, e))
+
+
+def _extract_tar_file(archive_path, dest):
+    if not archive_path.endswith(".zst"):
+        with tarfile.open(archive_path, mode="r|*") as tar:
+            extract_tar(tar, dest)
+        return
+    # The standard library has no zstd support, stream through the tool.
+    with subprocess.Popen(
+        ["zstd", "-dcq", archive_path], stdout=subprocess.PIPE
+    ) as proc:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            extract_tar(tar, dest)
+    if proc.returncode != 0:
+        raise RuntimeError("Failed to decompress {}".format(archive_path))
@@ -0,0 +1,173 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import html
+import logging
+import os
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+JUNIT_NAME = "junit.xml"
+MARKDOWN_NAME = "report.md"
+HTML_NAME = "report.html"
+JUNIT_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n'
+JUNIT_FOOTER = "</testsuites>\n"
+HTML_HEADER = """\
+<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Upgrade test report</title>
+<style>td, th {padding: 0 1em; text-align: left}
+.PASS {color: green} .FAIL, .ABORTED, .NOT-RUN {color: red}</style>
+</head><body><table>
+<tr><th>Suite</th><th>Status</th><th>Duration</th><th>Tests</th>
+<th>Failures</th><th>Results</th></tr>
+"""
+HTML_FOOTER = "</table></body></html>\n"
+MARKDOWN_HEADER = """\
+| Suite | Status | Duration | Tests | Failures | Results |
+| --- | --- | --- | --- | --- | --- |
+"""
+
+SuiteResult = namedtuple(
+    "SuiteResult",
+    ["name", "status", "duration", "tests", "failures", "output_dir"],
+)
+
+
+class BatchReport:
+    """One report for a batch of suites, extended as each suite finishes.
+
+    A combined JUnit file, a Markdown table and an HTML table are written in
+    `report_dir`. Each suite is added to the end of the files, before their
+    closing tags, so they are complete between suites and can be read while
+    the batch is running. Only the totals are kept in memory.
+
+    :param report_dir: The directory to write the report in, created when
+      needed. A report already there is replaced.
+
+    """
+
+    def __init__(self, report_dir):
+        self.report_dir = report_dir
+        self.suites = 0
+        self.failed = 0
+        os.makedirs(report_dir, exist_ok=True)
+        for name, content in (
+            (JUNIT_NAME, JUNIT_HEADER + JUNIT_FOOTER),
+            (HTML_NAME, HTML_HEADER + HTML_FOOTER),
+            (MARKDOWN_NAME, MARKDOWN_HEADER),
+        ):
+            with open(os.path.join(report_dir, name), "w") as f:
+                f.write(content)
+
+    def add_suite(self, name, status, duration, output_dir=None):
+        """Add a finished suite to the report.
+
+        :param status: e.g. 'PASS', 'FAIL', 'ABORTED' or 'NOT-RUN'.
+        :param duration: The seconds the suite took.
+        :param output_dir: The suite's output directory holding its JUnit
+          results, if it ran.
+
+        """
+        suites = _read_junit_suites(output_dir, name)
+        result = SuiteResult(
+            name,
+            status,
+            duration,
+            sum(int(s.get("tests", 0)) for s in suites),
+            sum(int(s.get("failures", 0)) for s in suites),
+            output_dir,
+        )
+        _insert_before_footer(
+            os.path.join(self.report_dir, JUNIT_NAME),
+            JUNIT_FOOTER,
+            "".join(ET.tostring(s, encoding="unicode") for s in suites),
+        )
+        _insert_before_footer(
+            os.path.join(self.report_dir, HTML_NAME),
+            HTML_FOOTER,
+            _html_row(result),
+        )
+        with open(os.path.join(self.report_dir, MARKDOWN_NAME), "a") as f:
+            f.write(_markdown_row(result))
+        self.suites += 1
+        if status != "PASS":
+            self.failed += 1
+        logger.info(
+            "Report updated: {} of {} suites failed ({})".format(
+                self.failed, self.suites, self.report_dir
+            )
+        )
+
+
+def _read_junit_suites(output_dir, name):
+    """Return the suite's JUnit testsuite elements, named after it."""
+    suites = []
+    if output_dir is not None:
+        path = os.path.join(output_dir, "artifacts", "upgrade_run", JUNIT_NAME)
+        try:
+            root = ET.parse(path).getroot()
+        except (OSError, ET.ParseError) as e:
+            logger.warning("No JUnit results for {}: {}".format(name, e))
+        else:
+            suites = [root] if root.tag == "testsuite" else list(root)
+    for suite in suites:
+        suite.set("name", name)
+        suite.tail = "\n"
+    return suites
+
+
+def _insert_before_footer(path, footer, text):
+    with open(path, "r+b") as f:
+        f.seek(-len(footer.encode()), os.SEEK_END)
+        f.write(text.encode() + footer.encode())
+
+
+def _html_row(result):
+    cells = [
+        html.escape(result.name),
+        '<span class="{0}">{0}</span>'.format(html.escape(result.status)),
+        _format_duration(result.duration),
+        str(result.tests),
+        str(result.failures),
+        html.escape(result.output_dir or ""),
+    ]
+    return "<tr>{}</tr>\n".format(
+        "".join("<td>{}</td>".format(cell) for cell in cells)
+    )
+
+
+def _markdown_row(result):
+    cells = [
+        result.name,
+        result.status,
+        _format_duration(result.duration),
+        str(result.tests),
+        str(result.failures),
+        result.output_dir or "",
+    ]
+    return "| {} |\n".format(
+        " | ".join(cell.replace("|", "\\|") for cell in cells)
+    )
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return "{}m{:02d}s".format(minutes, seconds)
@@ -0,0 +1,177 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import logging
+import os
+import re
+from collections import deque, namedtuple
+
+from upgrade_testing.results._events import (
+    EVENTS_FILE_NAME,
+    parse_event_line,
+    read_events,
+)
+from upgrade_testing.results._watchdog import read_abort_reason
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_FILE_NAME = "failure_classification.json"
+TRANSIENT = "transient"
+REAL = "real"
+# Failures of the infrastructure rather than of what is tested, which are
+# worth another attempt.
+TRANSIENT_PATTERNS = (
+    (
+        re.compile(r"Hash ?Sum mismatch|Hashes of expected file"),
+        "mirror hash sum mismatch",
+    ),
+    (
+        re.compile(r"Could not connect to target|connect did not succeed"),
+        "could not connect to the testbed",
+    ),
+    (
+        re.compile(
+            r"wait_for_device did not succeed|Target went away|"
+            r"[Tt]imed out (on )?waiting for (ssh|boot)"
+        ),
+        "testbed did not boot",
+    ),
+    (
+        re.compile(
+            r"Temporary failure resolving|Could not resolve host|"
+            r"503\s+Service Unavailable"
+        ),
+        "network failure",
+    ),
+)
+# The phase of a run that failed before the testbed reported any events.
+TESTBED_START = "testbed-start"
+# autopkgtest's exit status when the testbed, not the test, failed.
+TESTBED_FAILURE = 16
+# Lines from the end of the autopkgtest log looked through.
+LOG_TAIL_LINES = 200
+
+Classification = namedtuple("Classification", ["label", "reason", "phase"])
+
+
+def classify_failure(output_dir, exit_status):
+    """Return the Classification of a failed run, or None if it passed.
+
+    A run is a transient failure when the end of its autopkgtest log or the
+    error that kept it from starting matches TRANSIENT_PATTERNS, or when
+    autopkgtest reports a testbed failure. Runs stopped by the watchdog and
+    every other failure are real.
+
+    :param exit_status: The run's subprocess.CompletedProcess, its stderr
+      holding the error if the run couldn't be started.
+
+    """
+    if exit_status.returncode == 0:
+        return None
+    events, lines = _read_log(output_dir)
+    events = _recorded_events(output_dir) or events
+    # Without any events the upgrade script never got to run.
+    phase = failed_phase(events) if events else TESTBED_START
+    abort_reason = read_abort_reason(output_dir)
+    if abort_reason:
+        return Classification(REAL, abort_reason, phase)
+    if exit_status.stderr:
+        lines.append(str(exit_status.stderr))
+    for pattern, reason in TRANSIENT_PATTERNS:
+        if any(pattern.search(line) for line in lines):
+            return Classification(TRANSIENT, reason, phase)
+    if exit_status.returncode == TESTBED_FAILURE:
+        return Classification(TRANSIENT, "autopkgtest testbed failure", phase)
+    return Classification(
+        REAL, "exit status {}".format(exit_status.returncode), phase
+    )
+
+
+def run_events(output_dir):
+    """Return the events of a run, even one that didn't copy its artifacts.
+
+    The events are read from the run's events file, or failing that from the
+    autopkgtest log they were printed to.
+
+    """
+    return _recorded_events(output_dir) or _read_log(output_dir)[0]
+
+
+def _recorded_events(output_dir):
+    return read_events(
+        os.path.join(output_dir, "artifacts", "upgrade_run", EVENTS_FILE_NAME)
+    )
+
+
+def failed_phase(events):
+    """Return the phase a run stopped in, or None if none failed.
+
+    This is the last phase started and not ended, or else the last one that
+    ended with a failing status.
+
+    """
+    started = []
+    failed = None
+    for event in events:
+        if event["event"] == "phase-start":
+            started.append(event.get("phase"))
+        elif event["event"] == "phase-end" and event.get("phase") in started:
+            started.remove(event["phase"])
+            if str(event.get("status")) != "0":
+                failed = event["phase"]
+    return started[-1] if started else failed
+
+
+def _read_log(output_dir):
+    """Return the events printed to the autopkgtest log and its last lines."""
+    events = []
+    tail = deque(maxlen=LOG_TAIL_LINES)
+    try:
+        with open(os.path.join(output_dir, "log"), errors="replace") as f:
+            for line in f:
+                tail.append(line)
+                event = parse_event_line(line)
+                if event is not None:
+                    events.append(event)
+    except FileNotFoundError:
+        logger.debug("No autopkgtest log in {}".format(output_dir))
+    return events, list(tail)
+
+
+def read_classification(output_dir):
+    """Return the recorded classification and attempt details, or None."""
+    try:
+        with open(os.path.join(output_dir, CLASSIFICATION_FILE_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_classification(output_dir, classification, attempt, retry):
+    """Record how a run's failure was classified.
+
+    :param attempt: The number of the attempt, from 1.
+    :param retry: How the next attempt starts (e.g. 'checkpoint'), or None
+      if there is none.
+
+    """
+    details = dict(classification._asdict(), attempt=attempt, retry=retry)
+    with open(os.path.join(output_dir, CLASSIFICATION_FILE_NAME), "w") as f:
+        json.dump(details, f, indent=1, sort_keys=True)
@@ -0,0 +1,189 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import datetime
+import heapq
+import logging
+import os
+from collections import namedtuple
+
+from upgrade_testing.results._artifacts import SystemDetails
+from upgrade_testing.results._events import (
+    EVENTS_FILE_NAME,
+    hops_from_events,
+    read_events,
+)
+
+logger = logging.getLogger(__name__)
+
+DPKG_LOG = "/var/log/dpkg.log"
+# What the time of each dpkg action is spent on, the maintainer scripts
+# run being preinst (unpack), postinst (configure) and prerm/postrm.
+ACTION_KINDS = {
+    "install": "unpack",
+    "upgrade": "unpack",
+    "configure": "configure",
+    "trigproc": "triggers",
+    "remove": "remove",
+    "purge": "remove",
+}
+
+DpkgOperation = namedtuple(
+    "DpkgOperation", ["kind", "package", "version", "start", "end"]
+)
+PackageTiming = namedtuple(
+    "PackageTiming", ["kind", "package", "count", "total", "longest"]
+)
+
+
+def parse_dpkg_log(lines):
+    """Yield a DpkgOperation for each package action in dpkg.log lines.
+
+    An action lasts from its own line until the last status line before the
+    next action, dpkg acting on one package at a time. dpkg.log has one
+    second resolution so short actions take 0s.
+
+    :param lines: The lines of the log, read as they are needed.
+
+    """
+    current = None
+    for timestamp, word, parts in filter(None, map(_parse_line, lines)):
+        if word in ACTION_KINDS or word == "startup":
+            if current is not None:
+                yield current
+            current = _start_operation(timestamp, word, parts)
+        elif current is not None:
+            # Status and conffile lines are part of the current action.
+            current = current._replace(end=timestamp)
+    if current is not None:
+        yield current
+
+
+def _parse_line(line):
+    """Return the time, first word and rest of a line, or None."""
+    parts = line.split()
+    if len(parts) < 3:
+        return None
+    try:
+        timestamp = (
+            datetime.datetime.strptime(
+                parts[0] + " " + parts[1], "%Y-%m-%d %H:%M:%S"
+            )
+            # Testbeds log in UTC, as the events' wall clock is.
+            .replace(tzinfo=datetime.timezone.utc).timestamp()
+        )
+    except ValueError:
+        return None
+    return timestamp, parts[2], parts[3:]
+
+
+def _start_operation(timestamp, word, parts):
+    # e.g. "upgrade libc6:amd64 2.35-0ubuntu3 2.39-0ubuntu8".
+    if word not in ACTION_KINDS or len(parts) < 2:
+        return None
+    kind = ACTION_KINDS[word]
+    # Unpacking gives the old and new versions, the rest only the one.
+    version = parts[2] if kind == "unpack" and len(parts) > 2 else parts[1]
+    return DpkgOperation(
+        kind, parts[0].split(":")[0], version, timestamp, timestamp
+    )
+
+
+def run_dpkg_operations(results_dir):
+    """Yield (release pair, DpkgOperation) for the upgrades of a run.
+
+    Only the actions taken while upgrading between releases are included,
+    the release pair being the (from, to) of that upgrade.
+
+    :param results_dir: The upgrade_run artifacts directory of a run.
+
+    """
+    hops = hops_from_events(
+        read_events(os.path.join(results_dir, EVENTS_FILE_NAME))
+    )
+    f = _open_dpkg_log(results_dir) if hops else None
+    if f is None:
+        return
+    with f:
+        for operation in parse_dpkg_log(f):
+            for hop in hops:
+                if hop.start <= operation.start <= hop.end:
+                    yield (hop.from_release, hop.to_release), operation
+                    break
+
+
+def _open_dpkg_log(results_dir):
+    try:
+        return SystemDetails(results_dir).open(DPKG_LOG)
+    except FileNotFoundError:
+        logger.debug("No dpkg.log collected in {}".format(results_dir))
+    except RuntimeError as e:
+        logger.warning("Unable to read the dpkg.log: {}".format(e))
+    return None
+
+
+class PackageTimings:
+    """Durations of dpkg actions added up per release pair and package."""
+
+    def __init__(self):
+        self._totals = {}
+
+    def add(self, release_pair, operation):
+        key = (release_pair, operation.kind, operation.package)
+        count, total, longest = self._totals.get(key, (0, 0, 0))
+        duration = operation.end - operation.start
+        self._totals[key] = (
+            count + 1,
+            total + duration,
+            max(longest, duration),
+        )
+
+    def add_run(self, results_dir):
+        for release_pair, operation in run_dpkg_operations(results_dir):
+            self.add(release_pair, operation)
+
+    def release_pairs(self):
+        return sorted({key[0] for key in self._totals}, key=str)
+
+    def slowest(self, release_pair, kind=None, count=10):
+        """Return the PackageTimings taking the longest in total, slowest first.
+
+        :param kind: Only include this kind of action (e.g. 'configure').
+
+        """
+        timings = (
+            PackageTiming(key[1], key[2], *values)
+            for key, values in self._totals.items()
+            if key[0] == release_pair and kind in (None, key[1])
+        )
+        return heapq.nlargest(count, timings, key=lambda t: t.total)
+
+
+def format_package_timings(timings, kind=None, count=10):
+    """Return report lines of the slowest actions per release pair."""
+    output = []
+    for release_pair in timings.release_pairs():
+        output.append("Slowest dpkg actions {} -> {}:".format(*release_pair))
+        output.extend(
+            "\t{}s {} {} ({} times, longest {}s)".format(
+                int(t.total), t.kind, t.package, t.count, int(t.longest)
+            )
+            for t in timings.slowest(release_pair, kind, count)
+        )
+    return output
@@ -0,0 +1,292 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import logging
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from upgrade_testing.provisioning import read_line_batches
+from upgrade_testing.results._watchdog import process_tree_cpu_time
+
+logger = logging.getLogger(__name__)
+
+# Must match EVENT_PREFIX in the upgrade script.
+EVENT_PREFIX = "auto-upgrade-event: "
+EVENTS_FILE_NAME = "events.jsonl"
+# Seconds between the watchdog's checks on a run without output.
+WATCHDOG_INTERVAL = 10
+# Seconds given to a stopped run to clean up before it is killed.
+TERMINATE_TIMEOUT = 120
+
+Phase = namedtuple("Phase", ["name", "status", "duration", "details"])
+Hop = namedtuple("Hop", ["from_release", "to_release", "start", "end"])
+
+
+def parse_event_line(line):
+    """Return the event reported on a line of testbed output, or None.
+
+    :param line: A line of output, either text or bytes. The event may be
+      preceded by other output (e.g. the autopkgtest log prefix).
+
+    """
+    if isinstance(line, bytes):
+        line = line.decode(errors="replace")
+    _, prefix, event = line.partition(EVENT_PREFIX)
+    if not prefix:
+        return None
+    try:
+        event = json.loads(event)
+    except ValueError:
+        logger.debug("Ignoring malformed event: {}".format(line.rstrip()))
+        return None
+    return event if isinstance(event, dict) and "event" in event else None
+
+
+def read_events(path):
+    """Return the events recorded in a JSON-lines events file."""
+    events = []
+    try:
+        with open(path, errors="replace") as f:
+            for line in f:
+                event = parse_event_line(EVENT_PREFIX + line)
+                if event is not None:
+                    events.append(event)
+    except FileNotFoundError:
+        logger.debug("No events recorded in {}".format(path))
+    return events
+
+
+def event_interval(start, end):
+    """Return the seconds between two events.
+
+    The monotonic clock is used when both events come from the same boot,
+    the wall clock otherwise (e.g. across the reboot after an upgrade).
+
+    """
+    if start.get("boot_id") == end.get("boot_id"):
+        try:
+            return float(end["monotonic"]) - float(start["monotonic"])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return float(end.get("time", 0)) - float(start.get("time", 0))
+
+
+class PhaseTracker:
+    """Follow the upgrade phases from the testbed's events.
+
+    Finished phases are logged and kept in `phases` in the order they ended.
+
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.tests = []
+        self._started = {}
+
+    def __call__(self, event):
+        handler = getattr(
+            self, "_on_" + event["event"].replace("-", "_"), None
+        )
+        if handler is not None:
+            handler(event)
+
+    def _on_phase_start(self, event):
+        phase = event.get("phase")
+        self._started[phase] = event
+        logger.info("Testbed started {}".format(phase))
+
+    def _on_phase_end(self, event):
+        phase = event.get("phase")
+        start = self._started.pop(phase, None)
+        if start is None:
+            logger.debug("End of unknown phase {}".format(phase))
+            return
+        self._finish(phase, event.get("status"), start, event)
+
+    def _on_test_result(self, event):
+        self.tests.append(event)
+        logger.info(
+            "Testbed {stage} script {name}: {result} ({duration}s)".format(
+                **event
+            )
+        )
+
+    def _on_run_end(self, event):
+        # Anything left open was cut short, e.g. by a failing upgrade.
+        for phase, start in list(self._started.items()):
+            self._finish(phase, "interrupted", start, event)
+        self._started.clear()
+
+    def _finish(self, phase, status, start, end):
+        details = {
+            key: value
+            for key, value in start.items()
+            if key not in ("event", "time", "monotonic", "boot_id", "phase")
+        }
+        duration = event_interval(start, end)
+        self.phases.append(Phase(phase, status, duration, details))
+        logger.info(
+            "Testbed finished {} in {:.1f}s (status: {})".format(
+                phase, duration, status
+            )
+        )
+
+
+def phases_from_events(events):
+    """Return the Phase list described by a sequence of events."""
+    tracker = PhaseTracker()
+    for event in events:
+        tracker(event)
+    return tracker.phases
+
+
+def hops_from_events(events):
+    """Return a Hop, with its wall clock start and end, per release upgrade.
+
+    A hop that didn't finish ends at the last event.
+
+    """
+    hops = []
+    start = None
+    for event in events:
+        if event.get("phase") != "hop":
+            continue
+        if event["event"] == "phase-start":
+            start = event
+        elif event["event"] == "phase-end" and start is not None:
+            hops.append(_hop(start, event["time"]))
+            start = None
+    if start is not None:
+        hops.append(_hop(start, events[-1]["time"]))
+    return hops
+
+
+def _hop(start, end_time):
+    return Hop(
+        start.get("from"),
+        start.get("to"),
+        float(start["time"]),
+        float(end_time),
+    )
+
+
+def run_and_track_events(command, on_event, watchdog=None, testbed_pid=None):
+    """Run `command`, passing on its output and reporting its events.
+
+    :param command: The command to run, as for subprocess.
+    :param on_event: Called with each event (a dict) as it is output.
+    :param watchdog: Optional Watchdog following the output and CPU use of
+      the run, which is stopped early if it has no chance of passing.
+    :param testbed_pid: Optional pid of a testbed the run connects to
+      rather than starts, whose CPU use counts towards the run's.
+    :returns: subprocess.CompletedProcess
+
+    """
+    batches = queue.Queue()
+    proc = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    # The output may be held open by processes an aborted run leaves behind
+    # for a while, so each stream is read in a thread left to finish on its
+    # own. autopkgtest passes the test's stderr (e.g. apt and dpkg errors)
+    # through on its own stderr, so both are followed.
+    for stream, output in (
+        (proc.stdout, sys.stdout),
+        (proc.stderr, sys.stderr),
+    ):
+        threading.Thread(
+            target=_read_batches, args=(stream, output, batches), daemon=True
+        ).start()
+    try:
+        _follow_output(proc, batches, on_event, watchdog, testbed_pid)
+    finally:
+        proc.wait()
+    return subprocess.CompletedProcess(command, proc.returncode)
+
+
+def _follow_output(proc, batches, on_event, watchdog, testbed_pid):
+    testbed_pids = [] if testbed_pid is None else [testbed_pid]
+    next_check = time.monotonic()
+    open_streams = 2
+    while open_streams:
+        batch = _next_batch(batches)
+        if batch is None:
+            open_streams -= 1
+            continue
+        _handle_lines(*batch, on_event, watchdog)
+        if watchdog is None:
+            continue
+        if time.monotonic() >= next_check:
+            next_check = time.monotonic() + WATCHDOG_INTERVAL
+            watchdog.check_progress(
+                process_tree_cpu_time(proc.pid, *testbed_pids)
+            )
+        if watchdog.abort_reason:
+            logger.error("Aborting run: {}".format(watchdog.abort_reason))
+            _terminate(proc)
+            return
+
+
+def _read_batches(stream, output, batches):
+    for lines in read_line_batches(stream):
+        batches.put((output, lines))
+    batches.put(None)
+
+
+def _next_batch(batches):
+    """Return the next (output, lines), no lines if none came in time.
+
+    None is returned once a stream has ended.
+
+    """
+    try:
+        return batches.get(timeout=WATCHDOG_INTERVAL)
+    except queue.Empty:
+        return None, []
+
+
+def _handle_lines(output, lines, on_event, watchdog):
+    """Pass lines on to `output` (sys.stdout or sys.stderr) and check them."""
+    if lines:
+        output.buffer.write(b"".join(line + b"\n" for line in lines))
+        output.buffer.flush()
+    for line in lines:
+        if watchdog is not None:
+            watchdog.check_line(line)
+        event = parse_event_line(line)
+        if event is not None:
+            try:
+                on_event(event)
+            except Exception:
+                logger.exception("Unable to handle event {}".format(event))
+
+
+def _terminate(proc):
+    """Stop the run, giving autopkgtest the chance to clean up first."""
+    proc.terminate()
+    try:
+        proc.wait(TERMINATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        logger.warning("Run didn't stop, killing it")
+        proc.kill()
+        proc.wait()
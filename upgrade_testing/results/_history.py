@@ -0,0 +1,104 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "auto-upgrade-testing",
+    "history.json",
+)
+# Durations kept per suite or image, the median of them is the estimate.
+HISTORY_LENGTH = 5
+# Estimates for suites and images without a history, in seconds.
+DEFAULT_HOP_DURATION = 1800
+DEFAULT_SETUP_DURATION = 600
+DEFAULT_BUILD_DURATION = 1200
+
+
+class RunHistory:
+    """How long suites took to run and images to build, on this host.
+
+    :param path: The JSON file the history is kept in.
+
+    """
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._history = json.load(f)
+        except FileNotFoundError:
+            self._history = {}
+        except ValueError:
+            logger.warning("Ignoring corrupt run history {}".format(path))
+            self._history = {}
+
+    def estimate_run(self, testsuite):
+        """Return the estimated seconds a suite takes and its basis.
+
+        The basis is 'history', or 'default' for a suite not run before,
+        estimated from how many upgrades it does.
+
+        """
+        durations = self._history.get("runs", {}).get(testsuite.name)
+        if durations:
+            return statistics.median(durations), "history"
+        hops = len(testsuite.provisioning.releases) - 1
+        return DEFAULT_SETUP_DURATION + hops * DEFAULT_HOP_DURATION, "default"
+
+    def estimate_build(self, build_key):
+        """Return the estimated seconds an image build takes and its basis."""
+        durations = self._history.get("builds", {}).get(build_key)
+        if durations:
+            return statistics.median(durations), "history"
+        return DEFAULT_BUILD_DURATION, "default"
+
+    def record_run(self, testsuite, duration):
+        self._record("runs", testsuite.name, duration)
+
+    def record_build(self, build_key, duration):
+        self._record("builds", build_key, duration)
+
+    def _record(self, kind, key, duration):
+        with self._lock:
+            durations = self._history.setdefault(kind, {}).setdefault(key, [])
+            durations.append(round(duration, 1))
+            del durations[:-HISTORY_LENGTH]
+            try:
+                self._write()
+            except OSError as e:
+                logger.warning("Unable to save the run history: {}".format(e))
+
+    def _write(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, delete=False
+        ) as f:
+            json.dump(self._history, f, indent=1, sort_keys=True)
+        os.replace(f.name, self.path)
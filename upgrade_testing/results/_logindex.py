@@ -0,0 +1,216 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import fnmatch
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from upgrade_testing.results._artifacts import open_artifact, read_store_index
+from upgrade_testing.results._events import EVENTS_FILE_NAME, read_events
+
+logger = logging.getLogger(__name__)
+
+# Files of a run that are indexed, relative to its output directory: the
+# autopkgtest log and every log in the artifacts, the collected dist-upgrade
+# and dpkg logs included.
+INDEXED_PATTERNS = ("log", "artifacts/*.log")
+# Longer lines are cut, they are data dumps rather than messages.
+MAX_LINE_LENGTH = 4096
+# Seconds to wait for another run finishing to release the database.
+LOCK_TIMEOUT = 60
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    output_dir TEXT UNIQUE NOT NULL,
+    suite TEXT,
+    releases TEXT,
+    indexed REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    path TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(
+    text, file_id UNINDEXED, lineno UNINDEXED
+);
+"""
+
+Match = namedtuple(
+    "Match", ["output_dir", "suite", "releases", "path", "lineno", "text"]
+)
+
+
+class LogIndex:
+    """A full-text index (SQLite FTS5) of the logs of many runs.
+
+    :param db_path: The database file, created when needed.
+
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=LOCK_TIMEOUT)
+        try:
+            self._db.executescript(SCHEMA)
+        except sqlite3.OperationalError as e:
+            self._db.close()
+            raise RuntimeError(
+                "Unable to create log index {} (is SQLite built with "
+                "FTS5?): {}".format(db_path, e)
+            )
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_run(self, output_dir, suite=None, releases=None):
+        """Index the logs of a finished run unless it is indexed already.
+
+        :param suite: The name of the testsuite, if known.
+        :param releases: The releases the run went through, read from its
+          events when not given.
+        :returns: Whether the run was indexed now.
+
+        """
+        output_dir = os.path.abspath(output_dir)
+        if releases is None:
+            releases = _releases_from_events(output_dir)
+        with self._db:
+            try:
+                run_id = self._db.execute(
+                    "INSERT INTO runs (output_dir, suite, releases, indexed) "
+                    "VALUES (?, ?, ?, ?)",
+                    (output_dir, suite, " ".join(releases), time.time()),
+                ).lastrowid
+            except sqlite3.IntegrityError:
+                logger.debug("{} is indexed already".format(output_dir))
+                return False
+            for relative_path in _indexed_files(output_dir):
+                self._add_file(run_id, output_dir, relative_path)
+        logger.info("Indexed the logs of {}".format(output_dir))
+        return True
+
+    def prune(self):
+        """Forget the runs whose output directory was removed."""
+        gone = [
+            (run_id,)
+            for run_id, output_dir in self._db.execute(
+                "SELECT id, output_dir FROM runs"
+            )
+            if not os.path.isdir(output_dir)
+        ]
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM lines WHERE file_id IN "
+                "(SELECT id FROM files WHERE run_id = ?)",
+                gone,
+            )
+            self._db.executemany("DELETE FROM files WHERE run_id = ?", gone)
+            self._db.executemany("DELETE FROM runs WHERE id = ?", gone)
+        return len(gone)
+
+    def search(self, query, limit=50, phrase=True):
+        """Return the Matches for a query, the most recently indexed first.
+
+        :param query: The text to look for.
+        :param phrase: Look for the words of `query` in that order. Otherwise
+          `query` is an FTS5 query (e.g. 'dpkg AND "not configured"').
+        :raises ValueError: if the query isn't valid FTS5 syntax.
+
+        """
+        if phrase:
+            query = '"{}"'.format(query.replace('"', '""'))
+        try:
+            rows = self._db.execute(
+                "SELECT runs.output_dir, runs.suite, runs.releases, "
+                "files.path, lines.lineno, lines.text FROM lines "
+                "JOIN files ON files.id = lines.file_id "
+                "JOIN runs ON runs.id = files.run_id "
+                "WHERE lines MATCH ? ORDER BY lines.rowid DESC LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError("Invalid query {}: {}".format(query, e))
+        return [Match(*row) for row in rows]
+
+    def _add_file(self, run_id, output_dir, relative_path):
+        file_id = self._db.execute(
+            "INSERT INTO files (run_id, path) VALUES (?, ?)",
+            (run_id, relative_path),
+        ).lastrowid
+        try:
+            with open_artifact(os.path.join(output_dir, relative_path)) as f:
+                self._db.executemany(
+                    "INSERT INTO lines (text, file_id, lineno) "
+                    "VALUES (?, ?, ?)",
+                    _numbered_lines(f, file_id),
+                )
+        except OSError as e:
+            logger.warning("Unable to index {}: {}".format(relative_path, e))
+
+
+def _indexed_files(output_dir):
+    """Return the paths of the logs to index, stored in a store or not."""
+    paths = set()
+    for dirpath, _, filenames in os.walk(output_dir):
+        paths.update(
+            os.path.relpath(os.path.join(dirpath, name), output_dir)
+            for name in filenames
+        )
+    index = read_store_index(output_dir)
+    if index is not None:
+        paths.update(
+            os.path.join("artifacts", path) for path in index["files"]
+        )
+    return sorted(
+        path
+        for path in paths
+        if any(fnmatch.fnmatch(path, p) for p in INDEXED_PATTERNS)
+    )
+
+
+def _numbered_lines(f, file_id):
+    for lineno, line in enumerate(f, 1):
+        text = line[:MAX_LINE_LENGTH].decode(errors="replace").rstrip()
+        if text:
+            yield text, file_id, lineno
+
+
+def _releases_from_events(output_dir):
+    """Return the releases a run went through, as its events tell."""
+    events = read_events(
+        os.path.join(output_dir, "artifacts", "upgrade_run", EVENTS_FILE_NAME)
+    )
+    releases = []
+    for event in events:
+        release = event.get("release") or event.get("to")
+        if event["event"] not in ("run-start", "phase-start"):
+            continue
+        if release and release not in releases:
+            releases.append(release)
+    return releases
@@ -0,0 +1,292 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+from collections import namedtuple
+
+from upgrade_testing.results._artifacts import (
+    STORE_INDEX_NAME,
+    SystemDetails,
+    read_store_index,
+    store_object_path,
+)
+
+logger = logging.getLogger(__name__)
+
+# Small files the tools read directly, left in place in the runs.
+KEEP_IN_PLACE = (
+    "runner_results.yaml",
+    "events.jsonl",
+    "junit.xml",
+    "system_details.manifest",
+)
+# Seconds an unreferenced object is kept, covering runs being taken in.
+GC_GRACE = 3600
+INDEX_VERSION = 1
+
+GcResult = namedtuple(
+    "GcResult", ["removed_runs", "removed_objects", "freed_bytes"]
+)
+
+
+class ArtifactStore:
+    """Keep each distinct artifact once, compressed, across many runs.
+
+    A run taken in has its artifact files replaced by an index in its output
+    directory (STORE_INDEX_NAME) and each file is written back in place the
+    first time it is read (see ensure_artifact), so the results tools work on
+    it as before.
+
+    :param root: The directory holding the store, created when needed.
+
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.runs_dir = os.path.join(self.root, "runs")
+
+    def ingest(self, output_dir):
+        """Move the artifacts of a run into the store.
+
+        The system details archive is unpacked first: archives differ from
+        run to run even when nearly all the files in them are the same.
+
+        :param output_dir: The output directory of the run.
+        :returns: The number of bytes of artifacts taken in.
+
+        """
+        output_dir = os.path.abspath(output_dir)
+        artifacts_dir = os.path.join(output_dir, "artifacts")
+        _unpack_system_details(os.path.join(artifacts_dir, "upgrade_run"))
+        index = self._run_index(output_dir)
+        taken = []
+        for path in _artifact_files(artifacts_dir):
+            relative_path = os.path.relpath(path, artifacts_dir)
+            index["files"][relative_path] = self._add_file(path)
+            taken.append(path)
+        index["ingested"] = time.time()
+        # The index is complete before anything it lists is removed.
+        _write_json(os.path.join(output_dir, STORE_INDEX_NAME), index)
+        self._register(output_dir)
+        size = 0
+        for path in taken:
+            size += os.lstat(path).st_size
+            os.remove(path)
+        logger.info(
+            "Moved {} artifacts ({} bytes) of {} into {}".format(
+                len(taken), size, output_dir, self.root
+            )
+        )
+        return size
+
+    def runs(self):
+        """Return the output directories of the runs in the store."""
+        runs = []
+        try:
+            names = sorted(os.listdir(self.runs_dir))
+        except FileNotFoundError:
+            return runs
+        for name in names:
+            with open(os.path.join(self.runs_dir, name)) as f:
+                output_dir = f.read().strip()
+            if read_store_index(output_dir) is None:
+                # Removed by hand, the objects it used are free.
+                os.remove(os.path.join(self.runs_dir, name))
+            else:
+                runs.append(output_dir)
+        return runs
+
+    def gc(self, keep_days=None, keep_runs=None, grace=GC_GRACE, dry=False):
+        """Apply the retention policy and drop objects no run uses.
+
+        :param keep_days: Remove runs taken in more than this many days ago.
+        :param keep_runs: Keep only this many of the newest runs.
+        :param grace: Seconds an unused object is kept after it was stored.
+        :param dry: Only report what would be removed.
+        :returns: GcResult
+
+        """
+        runs = self.runs()
+        expired = _expired_runs(runs, keep_days, keep_runs, time.time())
+        for output_dir in expired:
+            logger.info("Removing expired run {}".format(output_dir))
+            if not dry:
+                shutil.rmtree(output_dir)
+                os.remove(self._registration_path(output_dir))
+        used = set()
+        for output_dir in runs:
+            if output_dir not in expired:
+                used.update(_index_digests(read_store_index(output_dir)))
+        removed, freed = self._sweep(used, time.time() - grace, dry)
+        return GcResult(expired, removed, freed)
+
+    def _run_index(self, output_dir):
+        index = read_store_index(output_dir)
+        if index is None:
+            return dict(version=INDEX_VERSION, store=self.root, files={})
+        if index["store"] != self.root:
+            raise ValueError(
+                "{} is already in the store at {}".format(
+                    output_dir, index["store"]
+                )
+            )
+        return dict(index, files=dict(index["files"]))
+
+    def _add_file(self, path):
+        """Store a file unless it is there already, returning its entry."""
+        details = os.lstat(path)
+        if stat.S_ISLNK(details.st_mode):
+            return dict(link=os.readlink(path))
+        digest = _sha256(path)
+        object_path = store_object_path(self.root, digest)
+        if os.path.exists(object_path):
+            # Restart its grace period, it may be about to be used.
+            os.utime(object_path)
+        else:
+            _write_object(path, object_path)
+        return dict(
+            sha256=digest,
+            size=details.st_size,
+            mode=stat.S_IMODE(details.st_mode),
+        )
+
+    def _register(self, output_dir):
+        os.makedirs(self.runs_dir, exist_ok=True)
+        with open(self._registration_path(output_dir), "w") as f:
+            f.write(output_dir + "\n")
+
+    def _registration_path(self, output_dir):
+        key = hashlib.sha256(output_dir.encode()).hexdigest()[:16]
+        return os.path.join(self.runs_dir, key)
+
+    def _sweep(self, used, stored_before, dry):
+        removed = 0
+        freed = 0
+        objects_dir = os.path.join(self.root, "objects")
+        for dirpath, _, filenames in os.walk(objects_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                details = os.stat(path)
+                if name.split(".")[0] in used:
+                    continue
+                if details.st_mtime > stored_before:
+                    continue
+                removed += 1
+                freed += details.st_size
+                if not dry:
+                    os.remove(path)
+        logger.info(
+            "Removed {} unused objects ({} bytes) from {}".format(
+                removed, freed, self.root
+            )
+        )
+        return removed, freed
+
+
+def _unpack_system_details(results_dir):
+    details = SystemDetails(results_dir)
+    archive_path = details.archive_path
+    if archive_path is None:
+        return
+    try:
+        details.extract()
+    except RuntimeError as e:
+        # Stored as it is, the files it holds just aren't shared.
+        logger.warning("Keeping {} packed: {}".format(archive_path, e))
+        return
+    os.remove(archive_path)
+
+
+def _artifact_files(artifacts_dir):
+    for dirpath, dirnames, filenames in os.walk(artifacts_dir):
+        # Symlinks to directories are listed with the directories.
+        links = [
+            d for d in dirnames if os.path.islink(os.path.join(dirpath, d))
+        ]
+        for name in sorted(filenames + links):
+            if name not in KEEP_IN_PLACE:
+                yield os.path.join(dirpath, name)
+
+
+def _expired_runs(runs, keep_days, keep_runs, now):
+    """Return the runs the retention policy no longer keeps."""
+    newest_first = sorted(
+        runs, key=lambda r: read_store_index(r)["ingested"], reverse=True
+    )
+    expired = []
+    if keep_runs is not None:
+        expired.extend(newest_first[keep_runs:])
+    if keep_days is not None:
+        oldest = now - keep_days * 86400
+        expired.extend(
+            r
+            for r in newest_first
+            if read_store_index(r)["ingested"] < oldest and r not in expired
+        )
+    return expired
+
+
+def _index_digests(index):
+    return (
+        entry["sha256"]
+        for entry in index["files"].values()
+        if "sha256" in entry
+    )
+
+
+def _write_object(path, object_path):
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    # Written beside the final name and renamed into place so that readers
+    # never see a partial object.
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(object_path), delete=False
+    ) as f:
+        try:
+            with open(path, "rb") as source:
+                with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as target:
+                    shutil.copyfileobj(source, target)
+        except BaseException:
+            os.remove(f.name)
+            raise
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, object_path)
+
+
+def _write_json(path, content):
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(path), delete=False
+    ) as f:
+        json.dump(content, f, indent=1, sort_keys=True)
+    os.replace(f.name, path)
+
+
+def _sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
@@ -0,0 +1,184 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import datetime
+import logging
+import os
+import re
+from collections import namedtuple
+
+from upgrade_testing.results._artifacts import SystemDetails
+
+logger = logging.getLogger(__name__)
+
+UPGRADER_LOG_DIR = "/var/log/dist-upgrade/"
+# The upgrader phases in the order they run, each starting at the first
+# main.log line matching its pattern. A phase whose line is missing (e.g.
+# from an older upgrader) is left out, its time going to the one before.
+UPGRADER_PHASES = (
+    # Starting up and updating the package lists.
+    ("fetch", re.compile(r"release-upgrader version .* started")),
+    ("calculation", re.compile(r"quirks: running PreDistUpgradeCache")),
+    (
+        "download",
+        re.compile(r"quirks: running PostDistUpgradeCache|doDistUpgradeFetch"),
+    ),
+    ("install", re.compile(r"quirks: running StartUpgrade")),
+    ("cleanup", re.compile(r"doPostUpgrade|quirks: running PostUpgrade")),
+)
+# What an upgrade is bound by when each phase takes the longest.
+BOTTLENECKS = {
+    "fetch": "network",
+    "download": "network",
+    "calculation": "solver",
+    "install": "dpkg",
+    "cleanup": "dpkg",
+}
+# e.g. "Fetched 1,234 MB in 2min 3s (10.0 MB/s)" from apt.
+FETCHED_RE = re.compile(r"Fetched ([\d,.]+) ?([kMG]?B) in ((?:\d+[a-z]+ ?)+)")
+SIZE_UNITS = {"B": 1, "kB": 10**3, "MB": 10**6, "GB": 10**9}
+TIME_UNITS = {"d": 86400, "h": 3600, "min": 60, "s": 1}
+
+UpgraderPhase = namedtuple("UpgraderPhase", ["name", "start", "end"])
+UpgraderProfile = namedtuple(
+    "UpgraderProfile", ["log", "phases", "downloaded", "download_time"]
+)
+
+
+def parse_main_log(lines):
+    """Return the UpgraderPhases described by the lines of a main.log."""
+    phases = []
+    remaining = list(UPGRADER_PHASES)
+    last_time = None
+    for line in lines:
+        timestamp = _parse_time(line)
+        if timestamp is None:
+            continue
+        last_time = timestamp
+        for index, (name, pattern) in enumerate(remaining):
+            if pattern.search(line):
+                if phases:
+                    phases[-1] = phases[-1]._replace(end=timestamp)
+                phases.append(UpgraderPhase(name, timestamp, timestamp))
+                # Later phases only, the upgrader doesn't go back.
+                del remaining[: index + 1]
+                break
+    if phases:
+        phases[-1] = phases[-1]._replace(end=last_time)
+    return phases
+
+
+def _parse_time(line):
+    # e.g. "2024-04-25 10:00:00,123 DEBUG openCache()", logged in UTC.
+    try:
+        return (
+            datetime.datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S,%f")
+            .replace(tzinfo=datetime.timezone.utc)
+            .timestamp()
+        )
+    except ValueError:
+        return None
+
+
+def parse_fetched(lines):
+    """Yield (bytes, seconds) for each download apt reports in the lines."""
+    for line in lines:
+        match = FETCHED_RE.search(line)
+        if match is None:
+            continue
+        size, unit, duration = match.groups()
+        seconds = sum(
+            int(value) * TIME_UNITS[unit]
+            for value, unit in re.findall(r"(\d+)([a-z]+)", duration)
+            if unit in TIME_UNITS
+        )
+        yield float(size.replace(",", "")) * SIZE_UNITS[unit], seconds
+
+
+def profile_upgrader_logs(results_dir):
+    """Return an UpgraderProfile for each upgrade a run's logs record.
+
+    The upgrader moves the logs of an earlier upgrade into a subdirectory,
+    so each main.log collected is one upgrade, with the apt-term.log beside
+    it giving what was downloaded.
+
+    :param results_dir: The upgrade_run artifacts directory of a run.
+
+    """
+    details = SystemDetails(results_dir)
+    profiles = []
+    for path in details.collected():
+        if not path.startswith(UPGRADER_LOG_DIR) or not path.endswith(
+            "/main.log"
+        ):
+            continue
+        with details.open(path) as f:
+            phases = parse_main_log(f)
+        if phases:
+            downloaded, download_time = _read_downloads(
+                details, os.path.dirname(path)
+            )
+            profiles.append(
+                UpgraderProfile(path, phases, downloaded, download_time)
+            )
+    return sorted(profiles, key=lambda p: p.phases[0].start)
+
+
+def _read_downloads(details, log_dir):
+    """Return the bytes downloaded and the time taken, from either log."""
+    for name in ("main.log", "apt-term.log"):
+        try:
+            f = details.open(os.path.join(log_dir, name))
+        except FileNotFoundError:
+            continue
+        with f:
+            downloads = list(parse_fetched(f))
+        if downloads:
+            return tuple(map(sum, zip(*downloads)))
+    return 0, 0
+
+
+def throughput(profile):
+    """Return the download rate of an upgrade in bytes/s, or None."""
+    if not profile.download_time:
+        return None
+    return profile.downloaded / profile.download_time
+
+
+def bottleneck(profile):
+    """Return what the upgrade spent the most time on: network, solver..."""
+    longest = max(profile.phases, key=lambda p: p.end - p.start)
+    return BOTTLENECKS[longest.name]
+
+
+def format_upgrader_profile(profile):
+    """Return report lines for an upgrade's phases."""
+    output = [
+        "\tupgrader {}: {:.1f}s".format(phase.name, phase.end - phase.start)
+        for phase in profile.phases
+    ]
+    rate = throughput(profile)
+    if rate is not None:
+        output.append(
+            "\tupgrader downloaded {:.1f}MB at {:.1f}MB/s".format(
+                profile.downloaded / 10**6, rate / 10**6
+            )
+        )
+    output.append("\tupgrader bound by: {}".format(bottleneck(profile)))
+    return output
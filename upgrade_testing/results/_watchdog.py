@@ -0,0 +1,149 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_FILE_NAME = "watchdog_abort.txt"
+
+
+class Watchdog:
+    """Decide when a run can be abandoned before autopkgtest gives up.
+
+    A run is doomed once its output matches a fatal pattern, and stalled
+    once it has gone `stall_timeout` seconds without output while using
+    less than `min_cpu_load` CPU seconds per second (an idle vm still uses
+    a little).
+
+    :param settings: WatchdogSettings from the testsuite.
+    :param clock: Returns the current time in seconds.
+
+    """
+
+    def __init__(self, settings, clock=time.monotonic):
+        self.settings = settings
+        self.clock = clock
+        self.abort_reason = None
+        self._fatal_patterns = [
+            re.compile(pattern) for pattern in settings.fatal_patterns
+        ]
+        self._last_progress = clock()
+        self._last_sample = None
+
+    def check_line(self, line):
+        """Note a line of output, returning the abort reason if any."""
+        if isinstance(line, bytes):
+            line = line.decode(errors="replace")
+        self._last_progress = self.clock()
+        for pattern in self._fatal_patterns:
+            if self.abort_reason is None and pattern.search(line):
+                self.abort_reason = "Fatal output: {}".format(line.strip())
+        return self.abort_reason
+
+    def check_progress(self, cpu_time):
+        """Note the run's CPU time, returning the abort reason if any.
+
+        :param cpu_time: The CPU seconds used so far by the run, or None if
+          it isn't known.
+
+        """
+        now = self.clock()
+        if cpu_time is not None:
+            if self._last_sample is not None and self._is_busy(
+                self._last_sample, (now, cpu_time)
+            ):
+                self._last_progress = now
+            self._last_sample = (now, cpu_time)
+        stalled_for = now - self._last_progress
+        if self.abort_reason is None and stalled_for >= (
+            self.settings.stall_timeout
+        ):
+            self.abort_reason = (
+                "No output or CPU progress for {:.0f} seconds".format(
+                    stalled_for
+                )
+            )
+        return self.abort_reason
+
+    def _is_busy(self, previous, current):
+        elapsed = current[0] - previous[0]
+        if elapsed <= 0:
+            return False
+        load = (current[1] - previous[1]) / elapsed
+        return load >= self.settings.min_cpu_load
+
+
+def process_tree_cpu_time(pid, *testbed_pids):
+    """Return the CPU seconds used by `pid` and its live descendants.
+
+    This includes the qemu process autopkgtest runs the testbed in, so
+    guest activity counts. A testbed launched outside of the run (e.g. the
+    qemu kept for --keep-overlay) is included by passing its pid in
+    `testbed_pids`. Returns None if `pid` has gone.
+
+    """
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            stat = _read_stat(entry)
+            if stat is not None:
+                stats[int(entry)] = stat
+    if pid not in stats:
+        return None
+    ticks = 0
+    seen = set()
+    pending = [pid] + [p for p in testbed_pids if p in stats]
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        ticks += stats[current][1]
+        pending.extend(p for p, (ppid, _) in stats.items() if ppid == current)
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _read_stat(pid):
+    """Return the parent pid and CPU ticks (utime + stime) of a process."""
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may hold spaces or parentheses, skip past it.
+    fields = stat.rpartition(")")[2].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12])
+
+
+def read_abort_reason(output_dir):
+    """Return why the watchdog aborted the run in `output_dir`, or None."""
+    try:
+        with open(os.path.join(output_dir, WATCHDOG_FILE_NAME)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_abort_reason(output_dir, reason):
+    with open(os.path.join(output_dir, WATCHDOG_FILE_NAME), "w") as f:
+        f.write(reason + "\n")
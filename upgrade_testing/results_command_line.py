@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2014, 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+from upgrade_testing.command_line import (
+    index_logs,
+    setup_logging,
+    store_artifacts,
+)
+from upgrade_testing.results import (
+    ACTION_KINDS,
+    UPGRADER_PHASES,
+    ArtifactStore,
+    LogIndex,
+    PackageTimings,
+    bottleneck,
+    format_package_timings,
+    profile_upgrader_logs,
+    throughput,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser("Manage the results of upgrade test runs.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    ingest = subparsers.add_parser(
+        "ingest", help="Move the artifacts of finished runs into a store."
+    )
+    ingest.add_argument("--store", required=True, help="The store directory.")
+    ingest.add_argument(
+        "output_dirs", nargs="+", help="Output directories of the runs."
+    )
+    ingest.set_defaults(func=ingest_runs)
+
+    gc = subparsers.add_parser(
+        "gc",
+        help="Remove the runs the retention policy no longer keeps and the "
+        "stored files no run uses.",
+    )
+    gc.add_argument("--store", required=True, help="The store directory.")
+    gc.add_argument(
+        "--keep-days",
+        type=float,
+        help="Remove runs stored more than this many days ago.",
+    )
+    gc.add_argument(
+        "--keep-runs", type=int, help="Keep only this many of the newest runs."
+    )
+    gc.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report what would be removed without removing it.",
+    )
+    gc.set_defaults(func=collect_garbage)
+
+    index = subparsers.add_parser(
+        "index", help="Add the logs of finished runs to a full-text index."
+    )
+    index.add_argument("--db", required=True, help="The index database.")
+    index.add_argument("--suite", help="The name of the runs' testsuite.")
+    index.add_argument(
+        "output_dirs", nargs="*", help="Output directories of the runs."
+    )
+    index.set_defaults(func=index_runs)
+
+    search = subparsers.add_parser(
+        "search", help="Find the log lines of indexed runs matching a query."
+    )
+    search.add_argument("--db", required=True, help="The index database.")
+    search.add_argument(
+        "--limit", type=int, default=50, help="The most lines to show."
+    )
+    search.add_argument(
+        "--fts",
+        action="store_true",
+        help="Take the query as an SQLite FTS5 query rather than a phrase.",
+    )
+    search.add_argument("query", help="The text to look for.")
+    search.set_defaults(func=search_logs)
+
+    packages = subparsers.add_parser(
+        "packages",
+        help="Report the packages whose dpkg actions took longest to "
+        "upgrade, per release pair, across runs.",
+    )
+    packages.add_argument(
+        "--kind",
+        choices=sorted(set(ACTION_KINDS.values())),
+        help="Only report this kind of action.",
+    )
+    packages.add_argument(
+        "--top", type=int, default=20, help="The most packages to report."
+    )
+    packages.add_argument(
+        "output_dirs", nargs="+", help="Output directories of the runs."
+    )
+    packages.set_defaults(func=report_package_timings)
+
+    upgrader = subparsers.add_parser(
+        "upgrader",
+        help="Compare the time the upgrader spent in each phase across runs.",
+    )
+    upgrader.add_argument(
+        "output_dirs", nargs="+", help="Output directories of the runs."
+    )
+    upgrader.set_defaults(func=compare_upgrader_phases)
+    return parser.parse_args(argv)
+
+
+def ingest_runs(args):
+    stored = [store_artifacts(args.store, d) for d in args.output_dirs]
+    return 0 if all(stored) else 1
+
+
+def index_runs(args):
+    """Index the given runs, dropping the runs removed since from the index.
+
+    Output directories holding many runs (e.g. a --results-dir) can be given
+    too, each run in them is indexed.
+
+    """
+    with LogIndex(args.db) as index:
+        index.prune()
+    indexed = [
+        index_logs(args.db, output_dir, args.suite)
+        for output_dir in _find_runs(args.output_dirs)
+    ]
+    return 0 if all(indexed) else 1
+
+
+def _find_runs(paths):
+    for path in paths:
+        if os.path.exists(os.path.join(path, "artifacts")):
+            yield path
+            continue
+        for name in sorted(os.listdir(path)):
+            if os.path.exists(os.path.join(path, name, "artifacts")):
+                yield os.path.join(path, name)
+
+
+def search_logs(args):
+    with LogIndex(args.db) as index:
+        try:
+            matches = index.search(args.query, args.limit, not args.fts)
+        except ValueError as e:
+            logger.error(e)
+            return 2
+    for match in matches:
+        print(
+            "{} [{} {}] {}:{}: {}".format(
+                match.output_dir,
+                match.suite or "-",
+                match.releases or "-",
+                match.path,
+                match.lineno,
+                match.text,
+            )
+        )
+    runs = {match.output_dir for match in matches}
+    print("{} lines in {} runs".format(len(matches), len(runs)))
+    return 0 if matches else 1
+
+
+def report_package_timings(args):
+    timings = PackageTimings()
+    for output_dir in _find_runs(args.output_dirs):
+        timings.add_run(os.path.join(output_dir, "artifacts", "upgrade_run"))
+    print("\n".join(format_package_timings(timings, args.kind, args.top)))
+    return 0
+
+
+def compare_upgrader_phases(args):
+    """Print a table of each upgrade's phase durations, one row per upgrade."""
+    names = [name for name, _ in UPGRADER_PHASES]
+    print("\t".join(["run", "upgrade"] + names + ["MB/s", "bound by"]))
+    for output_dir in _find_runs(args.output_dirs):
+        results_dir = os.path.join(output_dir, "artifacts", "upgrade_run")
+        try:
+            profiles = profile_upgrader_logs(results_dir)
+        except (OSError, RuntimeError) as e:
+            logger.warning("Skipping {}: {}".format(output_dir, e))
+            continue
+        for number, profile in enumerate(profiles, 1):
+            durations = {p.name: p.end - p.start for p in profile.phases}
+            rate = throughput(profile)
+            row = [output_dir, str(number)]
+            row.extend(
+                "{:.0f}".format(durations[name]) if name in durations else "-"
+                for name in names
+            )
+            row.append(
+                "-" if rate is None else "{:.1f}".format(rate / 10**6)
+            )
+            row.append(bottleneck(profile))
+            print("\t".join(row))
+    return 0
+
+
+def collect_garbage(args):
+    result = ArtifactStore(args.store).gc(
+        keep_days=args.keep_days, keep_runs=args.keep_runs, dry=args.dry_run
+    )
+    print(
+        "{} {} runs and {} stored files ({} bytes)".format(
+            "Would remove" if args.dry_run else "Removed",
+            len(result.removed_runs),
+            result.removed_objects,
+            result.freed_bytes,
+        )
+    )
+    return 0
+
+
+def main():
+    setup_logging()
+    args = parse_args()
+    sys.exit(args.func(args))
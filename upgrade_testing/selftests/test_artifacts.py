@@ -0,0 +1,102 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from upgrade_testing.results import _artifacts as _a
+
+
+class SystemDetailsTestCases(unittest.TestCase):
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.results_dir)
+
+    def _write_results(self, files, manifest, links={}):
+        archive_path = os.path.join(self.results_dir, "system_details.tar.gz")
+        with tarfile.open(archive_path, "w:gz") as tar:
+            for name, target in links.items():
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                tar.addfile(info)
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        manifest_path = os.path.join(
+            self.results_dir, "system_details.manifest"
+        )
+        with open(manifest_path, "w") as f:
+            f.write("# status\tsize\tpath\n")
+            f.write(manifest)
+
+    def test_manifest_lists_collected_and_skipped_files(self):
+        self._write_results(
+            {},
+            "collected\t3\t/var/log/dpkg.log\n"
+            "too-large\t9000\t/var/log/dist-upgrade/apt-term.log\n",
+        )
+        details = _a.SystemDetails(self.results_dir)
+        self.assertEqual(len(details.manifest()), 2)
+        self.assertEqual(details.collected(), ["/var/log/dpkg.log"])
+
+    def test_open_unpacks_archive_on_demand(self):
+        self._write_results(
+            {"var/log/dpkg.log": b"abc"}, "collected\t3\t/var/log/dpkg.log\n"
+        )
+        details = _a.SystemDetails(self.results_dir)
+        self.assertFalse(os.path.exists(details.extract_dir))
+        with details.open("/var/log/dpkg.log") as f:
+            self.assertEqual(f.read(), "abc")
+        self.assertTrue(os.path.isdir(details.extract_dir))
+
+    def test_path_raises_FileNotFoundError_for_uncollected_file(self):
+        self._write_results({}, "")
+        details = _a.SystemDetails(self.results_dir)
+        self.assertRaises(FileNotFoundError, details.path, "/etc/apt/x")
+
+    def test_absolute_symlinks_are_kept_as_links(self):
+        keyring = "etc/apt/trusted.gpg.d/ubuntu-keyring-2018-archive.gpg"
+        self._write_results(
+            {"var/log/dpkg.log": b"abc"},
+            "collected\t3\t/var/log/dpkg.log\n",
+            links={keyring: "/usr/share/keyrings/ubuntu-archive-keyring.gpg"},
+        )
+        details = _a.SystemDetails(self.results_dir)
+        with details.open("/var/log/dpkg.log") as f:
+            self.assertEqual(f.read(), "abc")
+        self.assertEqual(
+            os.readlink(os.path.join(details.extract_dir, keyring)),
+            "/usr/share/keyrings/ubuntu-archive-keyring.gpg",
+        )
+
+    def test_refuses_to_write_through_symlinks(self):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        self._write_results(
+            {"escape/file": b"abc"}, "", links={"escape": outside}
+        )
+        details = _a.SystemDetails(self.results_dir)
+        self.assertRaises(RuntimeError, details.extract)
+        self.assertEqual(os.listdir(outside), [])
@@ -0,0 +1,75 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from upgrade_testing.results import _batchreport as _b
+
+RUN_JUNIT = """\
+<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="Auto Upgrade Testing" tests="2" failures="1">
+<testcase name="upgrade"/><testcase name="post"><failure/></testcase>
+</testsuite></testsuites>
+"""
+
+
+class BatchReportTestCases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.report = _b.BatchReport(os.path.join(self.tmp_dir, "report"))
+
+    def _read(self, name):
+        with open(os.path.join(self.report.report_dir, name)) as f:
+            return f.read()
+
+    def _make_run(self):
+        output_dir = os.path.join(self.tmp_dir, "run")
+        os.makedirs(os.path.join(output_dir, "artifacts", "upgrade_run"))
+        with open(
+            os.path.join(output_dir, "artifacts", "upgrade_run", "junit.xml"),
+            "w",
+        ) as f:
+            f.write(RUN_JUNIT)
+        return output_dir
+
+    def test_report_is_complete_after_each_suite(self):
+        self.report.add_suite("desktop", "FAIL", 125, self._make_run())
+        root = ET.fromstring(self._read(_b.JUNIT_NAME))
+        self.assertEqual([s.get("name") for s in root], ["desktop"])
+        self.assertTrue(self._read(_b.HTML_NAME).endswith(_b.HTML_FOOTER))
+
+        self.report.add_suite("server", "NOT-RUN", 0)
+        root = ET.fromstring(self._read(_b.JUNIT_NAME))
+        self.assertEqual(len(root), 1)
+        self.assertEqual(
+            self._read(_b.MARKDOWN_NAME).splitlines()[2:],
+            [
+                "| desktop | FAIL | 2m05s | 2 | 1 | {} |".format(
+                    os.path.join(self.tmp_dir, "run")
+                ),
+                "| server | NOT-RUN | 0m00s | 0 | 0 |  |",
+            ],
+        )
+        self.assertIn("<td>server</td>", self._read(_b.HTML_NAME))
+        self.assertEqual((self.report.suites, self.report.failed), (2, 2))
@@ -0,0 +1,243 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from upgrade_testing.provisioning import _checkpoint as _c
+from upgrade_testing.provisioning.backends import _qemu
+
+
+class QmpClientTestCases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.socket_path = os.path.join(self.tmp_dir, "qmp.sock")
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(self.server.close)
+        self.server.bind(self.socket_path)
+        self.server.listen(1)
+        self.received = []
+
+    def serve(self, reply):
+        def handle():
+            conn, _ = self.server.accept()
+            with conn, conn.makefile("rw") as stream:
+                stream.write('{"QMP": {"version": {}}}\n')
+                stream.flush()
+                for line in stream:
+                    request = json.loads(line)
+                    self.received.append(request)
+                    if request["execute"] == "qmp_capabilities":
+                        stream.write('{"return": {}}\n')
+                    else:
+                        stream.write('{"event": "STOP"}\n')
+                        stream.write(json.dumps(reply) + "\n")
+                    stream.flush()
+
+        thread = threading.Thread(target=handle, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+
+    def test_execute_returns_result(self):
+        self.serve({"return": {"status": "running"}})
+        result = _c.QmpClient(self.socket_path, timeout=5).execute(
+            "blockdev-snapshot-internal-sync", device="virtio0", name="setup"
+        )
+        self.assertEqual(result, {"status": "running"})
+        self.assertEqual(
+            self.received[1]["arguments"],
+            dict(device="virtio0", name="setup"),
+        )
+
+    def test_execute_raises_RuntimeError_on_error(self):
+        self.serve({"error": {"class": "GenericError", "desc": "no space"}})
+        client = _c.QmpClient(self.socket_path, timeout=5)
+        self.assertRaises(RuntimeError, client.execute, "stop")
+
+
+class CheckpointStoreTestCases(unittest.TestCase):
+    def test_checkpoints_ignored_once_base_image_changes(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        base_image = os.path.join(tmp_dir, "base.img")
+        with open(base_image, "w") as f:
+            f.write("base")
+        store = _c.CheckpointStore(os.path.join(tmp_dir, "ovl"), base_image)
+        store.record("setup", "setup")
+
+        with open(base_image, "w") as f:
+            f.write("rebuilt base")
+
+        self.assertEqual(store.checkpoints(), [])
+        self.assertIsNone(store.latest())
+
+    def test_restore_deletes_later_checkpoints(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        base_image = os.path.join(tmp_dir, "base.img")
+        with open(base_image, "w") as f:
+            f.write("base")
+        store = _SnapshotStore(os.path.join(tmp_dir, "ovl"), base_image)
+        for name, phase in (
+            ("setup", "setup"),
+            ("pre-test", "pre-test"),
+            ("hop-jammy", "hop"),
+        ):
+            store.record(name, phase)
+        store.restore("setup")
+        self.assertEqual(
+            store.commands,
+            [
+                ("snapshot", "-a", "setup", store.overlay_path),
+                ("snapshot", "-d", "pre-test", store.overlay_path),
+                ("snapshot", "-d", "hop-jammy", store.overlay_path),
+            ],
+        )
+        self.assertEqual(store.latest(), "setup")
+
+
+class _SnapshotStore(_c.CheckpointStore):
+    """A store whose overlay holds the snapshots recorded in it."""
+
+    def __init__(self, overlay_path, base_image_path):
+        super().__init__(overlay_path, base_image_path)
+        self.commands = []
+
+    def _qemu_img(self, *args):
+        self.commands.append(args)
+
+    def _snapshot_names(self):
+        with open(self.manifest_path) as f:
+            return {c["name"] for c in json.load(f)["checkpoints"]}
+
+
+class _QmpClient:
+    def __init__(self, snapshots):
+        self.snapshots = set(snapshots)
+        self.commands = []
+
+    def execute(self, command, device, name):
+        self.commands.append(command)
+        if command == "blockdev-snapshot-delete-internal-sync":
+            if name not in self.snapshots:
+                raise RuntimeError("QMP error: snapshot not found")
+            self.snapshots.remove(name)
+        elif name in self.snapshots:
+            raise RuntimeError("QMP error: snapshot already exists")
+        else:
+            self.snapshots.add(name)
+
+
+class TakeInternalSnapshotTestCases(unittest.TestCase):
+    def test_takes_new_snapshot(self):
+        client = _QmpClient([])
+        _c.take_internal_snapshot(client, "virtio0", "setup")
+        self.assertEqual(client.snapshots, {"setup"})
+
+    def test_replaces_snapshot_of_same_name(self):
+        client = _QmpClient(["setup", "hop-jammy"])
+        _c.take_internal_snapshot(client, "virtio0", "hop-jammy")
+        self.assertEqual(
+            client.commands,
+            [
+                "blockdev-snapshot-delete-internal-sync",
+                "blockdev-snapshot-internal-sync",
+            ],
+        )
+        self.assertEqual(client.snapshots, {"setup", "hop-jammy"})
+
+
+class _RecordingQemuBackend(_qemu.QemuBackend):
+    def __init__(self):
+        super().__init__("focal", "amd64", "test.img", [], checkpoints=True)
+        self.commands = []
+        # Running, but without a QMP socket to take snapshots through.
+        self.qemu_runner = object()
+
+    def run_sudo(self, command, timeout=None, log_stdout=True):
+        self.commands.append(command)
+
+
+class CheckpointEventTestCases(unittest.TestCase):
+    def test_failed_snapshot_releases_testbed(self):
+        backend = _RecordingQemuBackend()
+        self.addCleanup(shutil.rmtree, backend.working_dir)
+        backend.overlay_path = os.path.join(backend.working_dir, "ovl")
+        backend.on_testbed_event(
+            dict(event="checkpoint", phase="setup", name="setup")
+        )
+        self.assertEqual(
+            backend.commands,
+            ["touch {}".format(_qemu.TESTBED_CHECKPOINT_FAILED)],
+        )
+        self.assertFalse(
+            os.path.exists(backend.overlay_path + _c.MANIFEST_SUFFIX)
+        )
+
+
+class _SnapshotQemuBackend(_qemu.QemuBackend):
+    def __init__(self, base_image_path):
+        super().__init__("focal", "amd64", "test.img", [], checkpoints=True)
+        self.base_image_path = base_image_path
+
+    def _checkpoint_store(self, overlay_path):
+        return _SnapshotStore(overlay_path, self.base_image_path)
+
+
+class ForkedRunTestCases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        base_image = os.path.join(self.tmp_dir, "base.img")
+        with open(base_image, "w") as f:
+            f.write("base")
+        self.source = _SnapshotQemuBackend(base_image)
+        self.fork = _SnapshotQemuBackend(base_image)
+        for backend in (self.source, self.fork):
+            self.addCleanup(shutil.rmtree, backend.working_dir)
+        self.source.overlay_path = os.path.join(self.tmp_dir, "test.img")
+        with open(self.source.overlay_path, "w") as f:
+            f.write("overlay")
+        store = self.source._checkpoint_store(self.source.overlay_path)
+        for name, phase in (("setup", "setup"), ("hop-jammy", "hop")):
+            store.record(name, phase)
+
+    def test_fork_keeps_checkpoints_up_to_its_start(self):
+        fork_path = self.fork._fork_overlay(self.source, "setup")
+        self.assertEqual(self.fork.resumed_checkpoint, "setup")
+        store = self.fork._checkpoint_store(fork_path)
+        self.assertEqual([c["name"] for c in store.checkpoints()], ["setup"])
+
+    def test_retry_resumes_forked_overlay(self):
+        self.fork.overlay_path = self.fork._fork_overlay(
+            self.source, "hop-jammy"
+        )
+        self.fork._checkpoint_store(self.fork.overlay_path).record(
+            "pre-test", "pre-test"
+        )
+        self.assertEqual(
+            self.fork._restore_checkpoint("latest"), self.fork.overlay_path
+        )
+        self.assertEqual(self.fork.resumed_checkpoint, "pre-test")
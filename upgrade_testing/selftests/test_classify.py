@@ -0,0 +1,140 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from upgrade_testing.results import _classify as _c
+from upgrade_testing.results._events import EVENT_PREFIX
+from upgrade_testing.results._watchdog import write_abort_reason
+
+
+def _event_line(event, **details):
+    return "upgrade: {}{}\n".format(
+        EVENT_PREFIX, json.dumps(dict(details, event=event))
+    )
+
+
+class ClassifyFailureTestCases(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def _write_log(self, *lines):
+        with open(os.path.join(self.output_dir, "log"), "w") as f:
+            f.writelines(lines)
+
+    def _classify(self, returncode, stderr=None):
+        return _c.classify_failure(
+            self.output_dir,
+            subprocess.CompletedProcess([], returncode, stderr=stderr),
+        )
+
+    def test_passing_run_is_not_classified(self):
+        self.assertIsNone(self._classify(0))
+
+    def test_mirror_error_in_phase_is_transient(self):
+        self._write_log(
+            _event_line("phase-start", phase="setup"),
+            _event_line("phase-end", phase="setup", status=0),
+            _event_line("phase-start", phase="hop"),
+            "E: Failed to fetch http://archive/foo.deb  Hash Sum mismatch\n",
+        )
+        self.assertEqual(
+            self._classify(1),
+            _c.Classification(_c.TRANSIENT, "mirror hash sum mismatch", "hop"),
+        )
+
+    def test_error_starting_the_testbed_is_transient(self):
+        classification = self._classify(
+            1, "wait_for_device did not succeed after 12 attempts: refused"
+        )
+        self.assertEqual(classification.label, _c.TRANSIENT)
+        self.assertEqual(classification.phase, _c.TESTBED_START)
+
+    def test_testbed_failure_is_transient(self):
+        self.assertEqual(self._classify(16).label, _c.TRANSIENT)
+
+    def test_failing_upgrade_is_real(self):
+        self._write_log(
+            _event_line("phase-start", phase="post-test"),
+            _event_line("phase-end", phase="post-test", status=1),
+        )
+        self.assertEqual(
+            self._classify(4),
+            _c.Classification(_c.REAL, "exit status 4", "post-test"),
+        )
+
+    def test_watchdog_abort_is_real(self):
+        self._write_log("Temporary failure resolving 'archive'\n")
+        write_abort_reason(self.output_dir, "Kernel panic")
+        self.assertEqual(
+            self._classify(-15),
+            _c.Classification(_c.REAL, "Kernel panic", _c.TESTBED_START),
+        )
+
+    def test_only_end_of_log_is_considered(self):
+        self._write_log(
+            "Could not resolve host: archive\n",
+            *["line\n"] * _c.LOG_TAIL_LINES
+        )
+        self.assertEqual(self._classify(1).label, _c.REAL)
+
+    def test_classification_round_trip(self):
+        self.assertIsNone(_c.read_classification(self.output_dir))
+        _c.write_classification(
+            self.output_dir,
+            _c.Classification(_c.TRANSIENT, "network failure", "hop"),
+            1,
+            "checkpoint",
+        )
+        self.assertEqual(
+            _c.read_classification(self.output_dir),
+            dict(
+                label=_c.TRANSIENT,
+                reason="network failure",
+                phase="hop",
+                attempt=1,
+                retry="checkpoint",
+            ),
+        )
+
+
+class RunEventsTestCases(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        with open(os.path.join(self.output_dir, "log"), "w") as f:
+            f.write(_event_line("checkpoint", phase="setup", name="setup"))
+
+    def test_events_from_log_without_artifacts(self):
+        events = _c.run_events(self.output_dir)
+        self.assertEqual([e["event"] for e in events], ["checkpoint"])
+
+    def test_recorded_events_preferred(self):
+        results_dir = os.path.join(self.output_dir, "artifacts", "upgrade_run")
+        os.makedirs(results_dir)
+        with open(os.path.join(results_dir, "events.jsonl"), "w") as f:
+            f.write(json.dumps(dict(event="run-start")) + "\n")
+        events = _c.run_events(self.output_dir)
+        self.assertEqual([e["event"] for e in events], ["run-start"])
@@ -0,0 +1,177 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from upgrade_testing import command_line
+from upgrade_testing.provisioning import ProvisionSpecification
+from upgrade_testing.provisioning._retry import RetryPolicy
+from upgrade_testing.provisioning.backends._qemu import QemuBackend
+from upgrade_testing.results import TRANSIENT, read_classification
+
+
+class _ExitedRunner:
+    """Stands in for the thread running a vm that exited straight away."""
+
+    def is_alive(self):
+        return False
+
+    def join(self, timeout=None):
+        pass
+
+
+class _UnbootableQemuBackend(QemuBackend):
+    def __init__(self, overlay_dir):
+        super().__init__(
+            "focal",
+            "amd64",
+            "unbootable.img",
+            [],
+            retry_policy=RetryPolicy(deadline=5, initial_delay=0.01),
+        )
+        self.overlay_dir = overlay_dir
+        self.stopped = 0
+        self.launched_from = []
+
+    def get_overlay_dir(self, default=None):
+        return self.overlay_dir
+
+    def launch_qemu(self, *args, **kwargs):
+        self.launched_from.append(self.resumed_checkpoint)
+        return _ExitedRunner()
+
+    def stop_qemu(self):
+        self.stopped += 1
+
+
+class _Provisioning(ProvisionSpecification):
+    releases = ["focal", "jammy"]
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_adt_run_args(self, **kwargs):
+        return self.backend.get_adt_run_args(**kwargs)
+
+
+class _Watchdog:
+    enabled = False
+
+
+class _Testsuite:
+    name = "unbootable"
+    backend_args = []
+    watchdog = _Watchdog()
+
+    def __init__(self, provisioning):
+        self.provisioning = provisioning
+
+
+class _TestrunFiles:
+    adt_cmd = "autopkgtest"
+    unbuilt_dir = scripts = run_config_file = testrun_tmp_dir = "/nonexistent"
+    meta_release_mirror = None
+
+
+class _InterruptedProvisioning(_Provisioning):
+    closed = False
+
+    def get_adt_run_args(self, **kwargs):
+        raise KeyboardInterrupt()
+
+    def close(self):
+        self.closed = True
+
+
+class GetOutputDirTestCases(unittest.TestCase):
+    def test_suites_get_their_own_directory(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        args = argparse.Namespace(results_dir=tmp_dir)
+        first = command_line.get_output_dir(args, "upgrade/focal jammy")
+        second = command_line.get_output_dir(args, "upgrade/focal jammy")
+        self.assertNotEqual(first, second)
+        self.assertEqual(os.path.dirname(first), tmp_dir)
+        self.assertTrue(first.endswith(".upgrade_focal_jammy"))
+        self.assertTrue(os.path.isdir(second))
+
+
+class RunTestsuiteTestCases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.backend = _UnbootableQemuBackend(self.tmp_dir)
+        self.addCleanup(
+            lambda: self.backend.working_dir
+            and shutil.rmtree(self.backend.working_dir)
+        )
+        self.args = argparse.Namespace(
+            results_dir=os.path.join(self.tmp_dir, "results"),
+            retries=1,
+            resume_from=None,
+            keep_overlay=True,
+            adt_args="",
+            log_index=None,
+            artifact_store=None,
+        )
+
+    def test_failed_connect_is_classified_and_retried(self):
+        exit_status = command_line.run_testsuite(
+            _Testsuite(_Provisioning(self.backend)),
+            _TestrunFiles(),
+            self.args,
+        )
+        self.assertEqual(exit_status.returncode, 1)
+        self.assertIn("Target went away", exit_status.stderr)
+        # Each attempt stopped the vm it launched rather than crashing.
+        self.assertEqual(self.backend.stopped, 2)
+        self.assertIsNone(self.backend.qemu_runner)
+        output_dirs = sorted(os.listdir(self.args.results_dir))
+        self.assertEqual(len(output_dirs), 2)
+        first, second = (
+            read_classification(os.path.join(self.args.results_dir, d))
+            for d in output_dirs
+        )
+        self.assertEqual(first["label"], TRANSIENT)
+        self.assertEqual(first["retry"], "fresh")
+        self.assertEqual(second["attempt"], 2)
+        self.assertIsNone(second["retry"])
+
+    def test_fresh_run_after_resumed_one_gets_new_overlay(self):
+        # As left by an earlier run resumed from a checkpoint.
+        self.backend.resumed_checkpoint = "hop-jammy"
+        self.assertRaises(
+            RuntimeError, self.backend.get_adt_run_args, keep_overlay=True
+        )
+        self.assertEqual(self.backend.launched_from, [None])
+
+    def test_interrupted_run_is_closed(self):
+        provisioning = _InterruptedProvisioning(self.backend)
+        self.assertRaises(
+            KeyboardInterrupt,
+            command_line.run_testsuite,
+            _Testsuite(provisioning),
+            _TestrunFiles(),
+            self.args,
+        )
+        self.assertTrue(provisioning.closed)
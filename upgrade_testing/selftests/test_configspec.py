@@ -16,6 +16,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from upgrade_testing.configspec import _config as _c
@@ -27,3 +30,32 @@ class HelperMethodTestCases(unittest.TestCase):
 
     def test_read_yaml_config_raises_on_nonexistant_file(self):
         self.assertRaises(FileNotFoundError, _c._read_yaml_config, "test.txt")
+
+
+class GetScriptStoreTestCases(unittest.TestCase):
+    def setUp(self):
+        self.scripts_dir = tempfile.mkdtemp()
+        for name in ("first", "second"):
+            open(os.path.join(self.scripts_dir, name), "w").close()
+        self.addCleanup(shutil.rmtree, self.scripts_dir)
+
+    def test_accepts_names_and_options(self):
+        store = _c._get_script_store(
+            [
+                "first",
+                dict(name="second", parallel=True, depends=["first"]),
+            ],
+            "file://{}".format(self.scripts_dir),
+        )
+        self.assertEqual(store.executables, ["first", "second"])
+        self.assertEqual(store.options["first"], _c.DEFAULT_SCRIPT_OPTIONS)
+        self.assertTrue(store.options["second"].parallel)
+        self.assertEqual(store.options["second"].depends, ["first"])
+
+    def test_raises_ValueError_on_dependency_declared_later(self):
+        self.assertRaises(
+            ValueError,
+            _c._get_script_store,
+            [dict(name="first", depends=["second"]), "second"],
+            "file://{}".format(self.scripts_dir),
+        )
@@ -0,0 +1,74 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from upgrade_testing.results import _dpkglog as _d
+
+DPKG_LOG = """\
+2024-04-25 10:00:00 startup archives unpack
+2024-04-25 10:00:00 upgrade libc6:amd64 2.35-0ubuntu3 2.39-0ubuntu8
+2024-04-25 10:00:00 status half-configured libc6:amd64 2.35-0ubuntu3
+2024-04-25 10:00:04 status unpacked libc6:amd64 2.39-0ubuntu8
+2024-04-25 10:00:05 startup packages configure
+2024-04-25 10:00:05 configure libc6:amd64 2.39-0ubuntu8 <none>
+2024-04-25 10:00:05 status half-configured libc6:amd64 2.39-0ubuntu8
+2024-04-25 10:00:07 status installed libc6:amd64 2.39-0ubuntu8
+2024-04-25 10:00:07 trigproc man-db:amd64 2.12.0-4 <none>
+2024-04-25 10:00:17 status installed man-db:amd64 2.12.0-4
+"""
+
+
+class ParseDpkgLogTestCases(unittest.TestCase):
+    def test_actions_last_until_their_last_status_line(self):
+        operations = list(_d.parse_dpkg_log(DPKG_LOG.splitlines()))
+        self.assertEqual(
+            [
+                (o.kind, o.package, o.version, o.end - o.start)
+                for o in operations
+            ],
+            [
+                ("unpack", "libc6", "2.39-0ubuntu8", 4),
+                ("configure", "libc6", "2.39-0ubuntu8", 2),
+                ("triggers", "man-db", "2.12.0-4", 10),
+            ],
+        )
+
+    def test_ignores_malformed_lines(self):
+        self.assertEqual(list(_d.parse_dpkg_log(["garbage", "a b c d"])), [])
+
+
+class PackageTimingsTestCases(unittest.TestCase):
+    def test_slowest_adds_up_actions_per_release_pair(self):
+        timings = _d.PackageTimings()
+        for _ in range(2):
+            for operation in _d.parse_dpkg_log(DPKG_LOG.splitlines()):
+                timings.add(("jammy", "noble"), operation)
+        slowest = timings.slowest(("jammy", "noble"), count=2)
+        self.assertEqual(
+            slowest,
+            [
+                _d.PackageTiming("triggers", "man-db", 2, 20, 10),
+                _d.PackageTiming("unpack", "libc6", 2, 8, 4),
+            ],
+        )
+        self.assertEqual(
+            timings.slowest(("jammy", "noble"), "configure")[0].package,
+            "libc6",
+        )
@@ -0,0 +1,102 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import sys
+import unittest
+
+from upgrade_testing.configspec._config import (
+    DEFAULT_FATAL_PATTERNS,
+    WatchdogSettings,
+)
+from upgrade_testing.results import _events as _e
+from upgrade_testing.results._watchdog import Watchdog
+
+
+def _event(event, time, monotonic, boot_id="boot-1", **details):
+    return dict(
+        event=event, time=time, monotonic=monotonic, boot_id=boot_id, **details
+    )
+
+
+class ParseEventLineTestCases(unittest.TestCase):
+    def test_returns_event_after_prefix(self):
+        line = b'upgrade [stdout]: auto-upgrade-event: {"event": "run-end"}\n'
+        self.assertEqual(_e.parse_event_line(line), dict(event="run-end"))
+
+    def test_returns_None_for_other_output(self):
+        self.assertIsNone(_e.parse_event_line("auto-upgrade [10:00]: hi"))
+
+    def test_returns_None_for_malformed_event(self):
+        self.assertIsNone(
+            _e.parse_event_line('auto-upgrade-event: {"event": ')
+        )
+
+
+class PhasesFromEventsTestCases(unittest.TestCase):
+    def test_uses_monotonic_clock_within_a_boot(self):
+        phases = _e.phases_from_events(
+            [
+                _event("phase-start", 1000, 10, phase="setup"),
+                _event("phase-end", 2000, 15, phase="setup", status="0"),
+            ]
+        )
+        self.assertEqual(phases, [_e.Phase("setup", "0", 5, {})])
+
+    def test_uses_wall_clock_across_reboots(self):
+        phases = _e.phases_from_events(
+            [
+                _event("phase-start", 1000, 500, phase="hop", to="noble"),
+                _event("phase-end", 1100, 20, "boot-2", phase="hop"),
+            ]
+        )
+        self.assertEqual(phases[0].duration, 100)
+        self.assertEqual(phases[0].details, dict(to="noble"))
+
+    def test_run_end_closes_open_phases(self):
+        phases = _e.phases_from_events(
+            [
+                _event("phase-start", 1000, 10, phase="upgrade"),
+                _event("run-end", 1030, 40, status="1"),
+            ]
+        )
+        self.assertEqual(phases, [_e.Phase("upgrade", "interrupted", 30, {})])
+
+
+class RunAndTrackEventsTestCases(unittest.TestCase):
+    def test_fatal_output_on_stderr_aborts_run(self):
+        watchdog = Watchdog(
+            WatchdogSettings(
+                enabled=True,
+                fatal_patterns=DEFAULT_FATAL_PATTERNS,
+                stall_timeout=1800,
+                min_cpu_load=0.1,
+            )
+        )
+        script = (
+            "import sys, time\n"
+            "sys.stderr.write("
+            "'E: Sub-process /usr/bin/dpkg returned an error code (1)\\n')\n"
+            "sys.stderr.flush()\n"
+            "time.sleep(60)\n"
+        )
+        exit_status = _e.run_and_track_events(
+            [sys.executable, "-c", script], lambda event: None, watchdog
+        )
+        self.assertNotEqual(exit_status.returncode, 0)
+        self.assertIn("dpkg returned an error code", watchdog.abort_reason)
@@ -0,0 +1,276 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2017 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+import paramiko
+
+from upgrade_testing.provisioning import async_executors as _ae
+from upgrade_testing.provisioning import executors as _e
+from upgrade_testing.provisioning._retry import RetryPolicy
+
+
+class OutputBufferTestCases(unittest.TestCase):
+    def test_keeps_all_output_within_limit(self):
+        output = _e.OutputBuffer(max_size=10)
+        output.append("abc")
+        output.append("def")
+        output.close()
+        self.assertEqual(output.getvalue(), "abcdef")
+        self.assertIsNone(output.spool_path)
+
+    def test_keeps_most_recent_output_over_limit(self):
+        output = _e.OutputBuffer(max_size=4)
+        output.append("abc")
+        output.append("defg")
+        output.close()
+        self.assertEqual(output.getvalue(), "defg")
+
+    def test_spools_complete_output_once_over_limit(self):
+        output = _e.OutputBuffer(max_size=4)
+        for content in ("abc", "defg", "hij"):
+            output.append(content)
+        spool_path = output.spool_path
+        output._spool.flush()
+        with open(spool_path) as f:
+            self.assertEqual(f.read(), "abcdefghij")
+        # Nobody asked for the complete output, so it isn't kept.
+        output.close()
+        self.assertIsNone(output.spool_path)
+        self.assertFalse(os.path.exists(spool_path))
+
+    def test_spools_to_requested_path(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spool_path = os.path.join(tmp_dir, "output.log")
+            output = _e.OutputBuffer(max_size=100, spool_path=spool_path)
+            output.append("abc")
+            output.close()
+            with open(spool_path) as f:
+                self.assertEqual(f.read(), "abc")
+
+
+class _RejectingSSHClient:
+    def __init__(self, error):
+        self.error = error
+        self.attempts = 0
+
+    def connect(self, *args):
+        self.attempts += 1
+        raise self.error
+
+
+class SSHExecutorConnectTestCases(unittest.TestCase):
+    def _connect(self, error):
+        executor = _e.SSHExecutor()
+        executor.ssh_client = _RejectingSSHClient(error)
+        retry_state = RetryPolicy(deadline=0.5, initial_delay=0.01).start()
+        try:
+            executor.connect("ubuntu", "ubuntu", 22, retry_state=retry_state)
+        finally:
+            self.attempts = executor.ssh_client.attempts
+
+    def test_authentication_failure_is_not_retried(self):
+        self.assertRaises(
+            paramiko.AuthenticationException,
+            self._connect,
+            paramiko.AuthenticationException("bad password"),
+        )
+        self.assertEqual(self.attempts, 1)
+
+    def test_refused_connection_is_retried(self):
+        self.assertRaises(
+            TimeoutError, self._connect, ConnectionRefusedError()
+        )
+        self.assertGreater(self.attempts, 1)
+
+
+class _Channel:
+    """Stands in for a channel whose command closed its output at once."""
+
+    def __init__(self):
+        self.eof_received = True
+        self.status_event = threading.Event()
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def exec_command(self, command):
+        pass
+
+    def recv_ready(self):
+        return False
+
+    def exit_status_ready(self):
+        return self.status_event.is_set()
+
+    def recv_exit_status(self):
+        self.status_event.wait()
+        return 3
+
+    def close(self):
+        pass
+
+
+class _Transport:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def open_session(self):
+        return self.channel
+
+
+class _Client:
+    def __init__(self, channel):
+        self.transport = _Transport(channel)
+
+    def get_transport(self):
+        return self.transport
+
+
+class SSHClientRunTestCases(unittest.TestCase):
+    def setUp(self):
+        self.channel = _Channel()
+        self.ssh_client = _e.SSHClient()
+        self.ssh_client.client = _Client(self.channel)
+
+    def test_waits_for_exit_after_output_closed(self):
+        timer = threading.Timer(0.2, self.channel.status_event.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        result = self.ssh_client.run("daemonize", 5, log_stdout=False)
+        self.assertEqual(result.status, 3)
+
+    def test_times_out_when_command_keeps_running(self):
+        self.assertRaises(
+            TimeoutError,
+            self.ssh_client.run,
+            "daemonize",
+            0.3,
+            log_stdout=False,
+        )
+
+
+class _StreamChannel:
+    """Stands in for a channel sending `chunks`, readable through a socket.
+
+    The command exits once its output is read, unless `exits` is False.
+
+    """
+
+    def __init__(self, chunks, status=0, exits=True):
+        self.chunks = list(chunks)
+        self.status = status
+        self.exits = exits
+        self.command = None
+        self.eof_received = False
+        self.status_event = threading.Event()
+        self._reader, self._writer = socket.socketpair()
+        # One byte per chunk, so the socket is readable while output is left.
+        self._writer.send(b"." * len(self.chunks))
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def exec_command(self, command):
+        self.command = command
+
+    def recv_ready(self):
+        return bool(self.chunks)
+
+    def recv(self, size):
+        if not self.chunks:
+            return b""
+        self._reader.recv(1)
+        data = self.chunks.pop(0)
+        if not self.chunks:
+            self.eof_received = True
+            if self.exits:
+                self.status_event.set()
+        return data
+
+    def exit_status_ready(self):
+        return self.status_event.is_set()
+
+    def recv_exit_status(self):
+        self.status_event.wait()
+        return self.status
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+class AsyncSSHExecutorTestCases(unittest.TestCase):
+    def _executor(self, channel):
+        executor = _ae.AsyncSSHExecutor()
+        executor.ssh_client.client = _Client(channel)
+        return executor
+
+    def test_stream_yields_decoded_output(self):
+        # A multi-byte character split across reads.
+        channel = _StreamChannel([b"caf", b"\xc3", b"\xa9"])
+        executor = self._executor(channel)
+
+        async def stream():
+            return [content async for content in executor.stream("cat")]
+
+        self.assertEqual("".join(asyncio.run(stream())), "café")
+        self.assertEqual(executor.last_status, 0)
+
+    def test_run_returns_output_and_status(self):
+        channel = _StreamChannel([b"hello"], status=2)
+        result = asyncio.run(
+            self._executor(channel).run("hello", log_stdout=False)
+        )
+        self.assertEqual(result.output, "hello\n")
+        self.assertEqual(result.status, 2)
+
+    def test_waits_for_exit_after_output_closed(self):
+        channel = _StreamChannel([b"started"], status=3, exits=False)
+        timer = threading.Timer(0.2, channel.status_event.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        result = asyncio.run(
+            self._executor(channel).run("daemonize", 5, log_stdout=False)
+        )
+        self.assertEqual(result.status, 3)
+
+    def test_times_out_when_command_keeps_running(self):
+        channel = _StreamChannel([b"started"], exits=False)
+        self.assertRaises(
+            TimeoutError,
+            asyncio.run,
+            self._executor(channel).run("daemonize", 0.3, log_stdout=False),
+        )
+
+    def test_failed_reboot_raises_PermissionError(self):
+        channel = _StreamChannel([b"sudo: incorrect password"], status=1)
+        executor = self._executor(channel)
+        executor.password = "wrong"
+        self.assertRaises(PermissionError, asyncio.run, executor.reboot())
+        self.assertEqual(
+            channel.command, "echo wrong | sudo -S shutdown -r now"
+        )
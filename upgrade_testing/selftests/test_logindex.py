@@ -0,0 +1,94 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from upgrade_testing.results import _logindex as _li
+from upgrade_testing.results import _store as _s
+
+
+class LogIndexTestCases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.index = _li.LogIndex(os.path.join(self.tmp_dir, "logs.db"))
+        self.addCleanup(self.index.close)
+
+    def _make_run(self, name, files):
+        output_dir = os.path.join(self.tmp_dir, name)
+        for path, content in files.items():
+            path = os.path.join(output_dir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+        return output_dir
+
+    def test_search_returns_lines_with_run_context(self):
+        events = [
+            dict(event="run-start", release="focal"),
+            dict(event="phase-start", phase="hop", to="jammy"),
+        ]
+        output_dir = self._make_run(
+            "run",
+            {
+                "log": "autopkgtest started\n",
+                "artifacts/upgrade_run/events.jsonl": "\n".join(
+                    json.dumps(e) for e in events
+                ),
+                "artifacts/upgrade_run/system_details/var/log/dist-upgrade/"
+                "main.log": "INFO ok\nERROR dpkg: error processing foo\n",
+            },
+        )
+        self.assertTrue(self.index.add_run(output_dir, suite="desktop"))
+        self.assertFalse(self.index.add_run(output_dir, suite="desktop"))
+        [match] = self.index.search("error processing")
+        self.assertEqual(match.suite, "desktop")
+        self.assertEqual(match.releases, "focal jammy")
+        self.assertTrue(match.path.endswith("dist-upgrade/main.log"))
+        self.assertEqual(match.lineno, 2)
+        self.assertEqual(self.index.search("processing error"), [])
+
+    def test_runs_in_an_artifact_store_are_indexed(self):
+        output_dir = self._make_run(
+            "run", {"artifacts/upgrade_run/apt.log": "held packages\n"}
+        )
+        _s.ArtifactStore(os.path.join(self.tmp_dir, "store")).ingest(
+            output_dir
+        )
+        self.index.add_run(output_dir)
+        self.assertEqual(len(self.index.search("held")), 1)
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(output_dir, "artifacts/upgrade_run/apt.log")
+            )
+        )
+
+    def test_prune_forgets_removed_runs(self):
+        output_dir = self._make_run("run", {"log": "boom\n"})
+        self.index.add_run(output_dir)
+        shutil.rmtree(output_dir)
+        self.assertEqual(self.index.prune(), 1)
+        self.assertEqual(self.index.search("boom"), [])
+
+    def test_invalid_query_raises_ValueError(self):
+        self.assertRaises(ValueError, self.index.search, "AND (", phrase=False)
@@ -17,9 +17,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import shutil
 import unittest
 
 from upgrade_testing.provisioning import _provisionconfig as _p
+from upgrade_testing.provisioning.backends import _qemu
 
 
 class ReplacePlaceholdersTestCases(unittest.TestCase):
@@ -128,6 +130,27 @@ class RenderBuildArgsTestCase(unittest.TestCase):
         )
 
 
+class LXCProvisionSpecificationTestCases(unittest.TestCase):
+    def _spec(self, **details):
+        spec = dict(releases=["focal", "jammy"], arch="amd64", **details)
+        return _p.LXCProvisionSpecification(spec, "/test.yaml")
+
+    def test_runs_in_cached_container(self):
+        self.assertEqual(
+            self._spec().get_adt_run_args(),
+            ["lxc", "-s", "autopkgtest-focal-amd64"],
+        )
+
+    def test_snapshot_clones_run_ephemerally_on_cached_container(self):
+        spec = self._spec(snapshot_clones=True)
+        self.assertEqual(
+            spec.get_adt_run_args(),
+            ["lxc", "--ephemeral", "-s", "autopkgtest-focal-amd64"],
+        )
+        # lxc removes the ephemeral clone, there is nothing left to destroy.
+        self.assertIsNone(spec.close())
+
+
 class QemuProvisionSpecificationTestCases(unittest.TestCase):
     def test_stores_passed_specification_details(self):
         """QemuProvisionSpecification must store the passed details regarding
@@ -149,3 +172,29 @@ class QemuProvisionSpecificationTestCases(unittest.TestCase):
         self.assertEqual(qemu_spec.image_name, spec["image_name"])
         self.assertEqual(qemu_spec.build_args, ["/test/path"])
         self.assertEqual(qemu_spec.initial_state, "release 1")
+
+    def _backend(self, **details):
+        spec = dict(
+            releases=["focal", "jammy", "noble"],
+            arch="amd64",
+            image_name="image name",
+            **details
+        )
+        backend = _p.QemuProvisionSpecification(spec, "/test.yaml").backend
+        self.addCleanup(shutil.rmtree, backend.working_dir)
+        return backend
+
+    def test_prefetches_first_upgrade_only(self):
+        backend = self._backend(prefetch_upgrade=True)
+        userdata = backend._get_prefetch_userdata()
+        self.assertIn(_qemu.PREFETCH_SCRIPT_PATH, userdata["prefetch_files"])
+        self.assertEqual(
+            userdata["prefetch_cmds"],
+            " - [{}, jammy]\n".format(_qemu.PREFETCH_SCRIPT_PATH),
+        )
+
+    def test_no_prefetch_unless_requested(self):
+        self.assertEqual(
+            self._backend()._get_prefetch_userdata(),
+            dict(prefetch_files="", prefetch_cmds=""),
+        )
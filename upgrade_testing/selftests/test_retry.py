@@ -0,0 +1,92 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import itertools
+import unittest
+
+from upgrade_testing.provisioning import _retry as _r
+
+
+class RetryPolicyTestCases(unittest.TestCase):
+    def test_delays_back_off_up_to_max_delay(self):
+        policy = _r.RetryPolicy(
+            initial_delay=1, max_delay=5, multiplier=2, jitter=0
+        )
+        self.assertEqual(
+            list(itertools.islice(policy.delays(), 5)), [1, 2, 4, 5, 5]
+        )
+
+    def test_delays_are_jittered_within_bounds(self):
+        policy = _r.RetryPolicy(initial_delay=4, max_delay=4, jitter=0.5)
+        for delay in itertools.islice(policy.delays(), 20):
+            self.assertTrue(2 <= delay <= 6, delay)
+
+    def test_from_config_overrides_phase_budgets(self):
+        policy = _r.RetryPolicy.from_config(
+            dict(deadline=30, phases=dict(connect=10))
+        )
+        self.assertEqual(policy.deadline, 30)
+        self.assertEqual(policy.phase_budgets["connect"], 10)
+        self.assertIn("wait_for_device", policy.phase_budgets)
+
+    def test_from_config_raises_ValueError_on_unknown_setting(self):
+        self.assertRaises(
+            ValueError, _r.RetryPolicy.from_config, dict(attempts=3)
+        )
+
+
+class RetryStateTestCases(unittest.TestCase):
+    def test_call_returns_once_func_succeeds(self):
+        policy = _r.RetryPolicy(initial_delay=0, jitter=0)
+        results = iter([OSError(), OSError(), "done"])
+
+        def func(remaining):
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(policy.start().call("connect", func), "done")
+
+    def test_call_raises_TimeoutError_when_phase_budget_spent(self):
+        now = [0]
+        policy = _r.RetryPolicy(
+            deadline=100, phase_budgets=dict(connect=5), initial_delay=0
+        )
+        state = policy.start(clock=lambda: now[0])
+
+        def func(remaining):
+            now[0] += 3
+            raise OSError("refused")
+
+        self.assertRaises(TimeoutError, state.call, "connect", func)
+        self.assertEqual(now[0], 6)
+
+    def test_call_gives_up_when_target_not_alive(self):
+        policy = _r.RetryPolicy(initial_delay=0)
+
+        def func(remaining):
+            raise OSError("refused")
+
+        self.assertRaises(
+            RuntimeError,
+            policy.start().call,
+            "connect",
+            func,
+            alive=lambda: False,
+        )
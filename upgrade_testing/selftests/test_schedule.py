@@ -0,0 +1,102 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from upgrade_testing.configspec import _schedule as _s
+from upgrade_testing.results import _history as _h
+
+
+class _Provisioning:
+    def __init__(self, build_key, forked_from=None):
+        self.build_key = build_key
+        self.releases = ["focal", "jammy"]
+        self.forked_from = forked_from
+
+
+class _TestSuite:
+    def __init__(self, name, build_key, forked_from=None):
+        self.name = name
+        self.provisioning = _Provisioning(build_key, forked_from)
+
+
+class PlanScheduleTestCases(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.history = _h.RunHistory(os.path.join(tmp_dir, "history.json"))
+
+    def _plan(self, testsuites, cached_keys, build_jobs=1):
+        return _s.plan_schedule(
+            testsuites,
+            self.history,
+            lambda t: t.provisioning.build_key in cached_keys,
+            build_jobs,
+        )
+
+    def test_cached_suites_run_longest_first_while_images_build(self):
+        short = _TestSuite("short", "cached")
+        long = _TestSuite("long", "cached")
+        built = _TestSuite("built", "jammy")
+        self.history.record_run(short, 100)
+        self.history.record_run(long, 500)
+        self.history.record_run(built, 10)
+        self.history.record_build("jammy", 300)
+
+        schedule = self._plan([short, built, long], {"cached"})
+        self.assertEqual(
+            [(r.testsuite.name, r.start, r.build_key) for r in schedule.runs],
+            [("long", 0, None), ("short", 500, None), ("built", 600, "jammy")],
+        )
+        self.assertEqual(schedule.completion, 610)
+
+    def test_builds_run_longest_first_on_the_free_slots(self):
+        for key, duration in (("a", 100), ("b", 300), ("c", 200)):
+            self.history.record_build(key, duration)
+        schedule = self._plan(
+            [_TestSuite(key, key) for key in "abc"], set(), build_jobs=2
+        )
+        self.assertEqual(
+            [(b.build_key, b.start, b.end) for b in schedule.builds],
+            [("b", 0, 300), ("c", 0, 200), ("a", 200, 300)],
+        )
+
+    def test_forked_suites_stay_after_their_source(self):
+        source = _TestSuite("source", "cached")
+        fork = _TestSuite("fork", "cached", forked_from=source.provisioning)
+        other = _TestSuite("other", "cached")
+        self.history.record_run(source, 10)
+        self.history.record_run(fork, 10)
+        self.history.record_run(other, 15)
+        schedule = self._plan([source, fork, other], {"cached"})
+        self.assertEqual(
+            [r.testsuite.name for r in schedule.runs],
+            ["source", "fork", "other"],
+        )
+
+    def test_new_suites_are_estimated_from_their_upgrades(self):
+        schedule = self._plan([_TestSuite("new", "cached")], {"cached"})
+        self.assertEqual(schedule.runs[0].basis, "default")
+        self.assertEqual(
+            schedule.completion,
+            _h.DEFAULT_SETUP_DURATION + _h.DEFAULT_HOP_DURATION,
+        )
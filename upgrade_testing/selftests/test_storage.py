@@ -0,0 +1,129 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import tempfile
+import unittest
+
+from upgrade_testing.provisioning import _storage as _s
+
+
+class ParseSizeTestCases(unittest.TestCase):
+    def test_returns_plain_bytes_unchanged(self):
+        self.assertEqual(_s.parse_size(1024), 1024)
+        self.assertEqual(_s.parse_size("1024"), 1024)
+
+    def test_understands_suffixes(self):
+        self.assertEqual(_s.parse_size("512M"), 512 * 1024 * 1024)
+        self.assertEqual(_s.parse_size("8G"), 8 * 1024 * 1024 * 1024)
+        self.assertEqual(_s.parse_size("2GiB"), 2 * 1024 * 1024 * 1024)
+
+    def test_raises_ValueError_on_unknown_size(self):
+        self.assertRaises(ValueError, _s.parse_size, "lots")
+
+
+class StorageTiersFromConfigTestCases(unittest.TestCase):
+    def test_accepts_paths_and_dicts(self):
+        tiers = _s.storage_tiers_from_config(
+            ["/fast", dict(path="/slow", min_free="1K")]
+        )
+        self.assertEqual(
+            tiers,
+            [
+                _s.StorageTier(path="/fast", min_free=0),
+                _s.StorageTier(path="/slow", min_free=1024),
+            ],
+        )
+
+
+class SelectStorageDirTestCases(unittest.TestCase):
+    def test_returns_default_without_tiers(self):
+        self.assertEqual(_s.select_storage_dir([], 1, "default"), "default")
+
+    def test_skips_tier_without_enough_space(self):
+        with tempfile.TemporaryDirectory() as full:
+            with tempfile.TemporaryDirectory() as roomy:
+                tiers = [
+                    _s.StorageTier(path=full, min_free=1 << 62),
+                    _s.StorageTier(path=roomy, min_free=0),
+                ]
+                self.assertEqual(
+                    _s.select_storage_dir(tiers, 1, "default"), roomy
+                )
+
+
+class StageImageTestCases(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.image_path = os.path.join(tmp_dir.name, "base.img")
+        with open(self.image_path, "w") as f:
+            f.write("image")
+        self.tier = _s.StorageTier(
+            path=os.path.join(tmp_dir.name, "tier"), min_free=0
+        )
+
+    def test_copy_is_staged_complete(self):
+        staged_path = _s.stage_image(self.image_path, [self.tier])
+        self.assertEqual(
+            os.path.dirname(staged_path), self.tier.path + "/images"
+        )
+        with open(staged_path) as f:
+            self.assertEqual(f.read(), "image")
+        self.assertTrue(os.path.basename(staged_path).startswith("base.img."))
+        # Nothing is left behind from the copy.
+        self.assertEqual(
+            os.listdir(os.path.dirname(staged_path)),
+            [os.path.basename(staged_path)],
+        )
+
+    def test_current_copy_reused_on_any_tier(self):
+        staged_path = _s.stage_image(self.image_path, [self.tier])
+        faster = _s.StorageTier(path=self.tier.path + "-fast", min_free=0)
+        self.assertEqual(
+            _s.stage_image(self.image_path, [faster, self.tier]), staged_path
+        )
+
+    def _rebuild_image(self):
+        with open(self.image_path, "w") as f:
+            f.write("rebuilt image")
+        os.utime(self.image_path, (0, 0))
+
+    def test_stale_copies_evicted(self):
+        staged_path = _s.stage_image(self.image_path, [self.tier])
+        gone_path = os.path.join(os.path.dirname(staged_path), "gone.img.1-1")
+        with open(gone_path, "w") as f:
+            f.write("old image")
+        self._rebuild_image()
+        rebuilt_path = _s.stage_image(self.image_path, [self.tier])
+        self.assertFalse(os.path.exists(gone_path))
+        self.assertFalse(os.path.exists(staged_path))
+        with open(rebuilt_path) as f:
+            self.assertEqual(f.read(), "rebuilt image")
+
+    def test_held_copies_not_evicted(self):
+        staged_path = _s.stage_image(self.image_path, [self.tier])
+        hold = _s.hold_image(staged_path)
+        self._rebuild_image()
+        rebuilt_path = _s.stage_image(self.image_path, [self.tier])
+        self.assertNotEqual(rebuilt_path, staged_path)
+        with open(staged_path) as f:
+            self.assertEqual(f.read(), "image")
+        hold.close()
+        _s.stage_image(self.image_path, [self.tier])
+        self.assertFalse(os.path.exists(staged_path))
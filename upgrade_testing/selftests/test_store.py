@@ -0,0 +1,90 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from upgrade_testing.results import _artifacts as _a
+from upgrade_testing.results import _store as _s
+
+
+class ArtifactStoreTestCases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.store = _s.ArtifactStore(os.path.join(self.tmp_dir, "store"))
+
+    def _make_run(self, name, files):
+        output_dir = os.path.join(self.tmp_dir, name)
+        for path, content in files.items():
+            path = os.path.join(output_dir, "artifacts", path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+        return output_dir
+
+    def _objects(self):
+        return [
+            name
+            for _, _, names in os.walk(
+                os.path.join(self.store.root, "objects")
+            )
+            for name in names
+        ]
+
+    def test_identical_files_are_stored_once(self):
+        for name in ("run1", "run2"):
+            self.store.ingest(
+                self._make_run(name, {"upgrade_run/apt/sources.list": "deb"})
+            )
+        self.assertEqual(len(self._objects()), 1)
+        self.assertEqual(len(self.store.runs()), 2)
+
+    def test_artifacts_come_back_when_read(self):
+        output_dir = self._make_run(
+            "run",
+            {
+                "upgrade_run/runner_results.yaml": "{}",
+                "upgrade_run/system_details/var/log/dpkg.log": "abc",
+            },
+        )
+        self.store.ingest(output_dir)
+        results_dir = os.path.join(output_dir, "artifacts", "upgrade_run")
+        details = _a.SystemDetails(results_dir)
+        local_path = os.path.join(details.extract_dir, "var/log/dpkg.log")
+        # Control files stay in place, the rest is fetched on demand.
+        self.assertTrue(
+            os.path.exists(os.path.join(results_dir, "runner_results.yaml"))
+        )
+        self.assertFalse(os.path.exists(local_path))
+        with details.open("/var/log/dpkg.log") as f:
+            self.assertEqual(f.read(), "abc")
+        self.assertRaises(FileNotFoundError, details.path, "/etc/apt/x")
+
+    def test_gc_removes_expired_runs_and_their_objects(self):
+        old = self._make_run("old", {"upgrade_run/a.log": "old"})
+        self.store.ingest(old)
+        self.store.ingest(self._make_run("new", {"upgrade_run/a.log": "new"}))
+        result = self.store.gc(keep_runs=1, grace=0)
+        self.assertEqual(result.removed_runs, [old])
+        self.assertEqual(result.removed_objects, 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual(len(self._objects()), 1)
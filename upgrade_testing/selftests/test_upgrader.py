@@ -0,0 +1,51 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from upgrade_testing.preparation import _upgrader as _u
+
+META_RELEASE = """\
+Dist: jammy
+Name: Jammy Jellyfish
+Version: 22.04.4 LTS
+Supported: 1
+UpgradeTool: http://archive.ubuntu.com/jammy.tar.gz
+UpgradeToolSignature: http://archive.ubuntu.com/jammy.tar.gz.gpg
+
+Dist: noble
+Name: Noble Numbat
+Version: 24.04 LTS
+Description: first line
+ second line
+"""
+
+
+class MetaReleaseTestCases(unittest.TestCase):
+    def test_parse_meta_release_reads_stanzas(self):
+        stanzas = _u.parse_meta_release(META_RELEASE)
+        self.assertEqual([s["Dist"] for s in stanzas], ["jammy", "noble"])
+        self.assertEqual(
+            stanzas[0]["UpgradeTool"], "http://archive.ubuntu.com/jammy.tar.gz"
+        )
+        self.assertEqual(stanzas[1]["Description"], "first line\n second line")
+
+    def test_format_meta_release_round_trips(self):
+        stanzas = _u.parse_meta_release(META_RELEASE)
+        self.assertEqual(_u.format_meta_release(stanzas), META_RELEASE)
@@ -0,0 +1,80 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from upgrade_testing.results import _upgraderlog as _u
+
+MAIN_LOG = """\
+2024-04-25 10:00:00,000 INFO release-upgrader version '24.04.19' started
+2024-04-25 10:00:30,000 DEBUG running doUpdate() (showErrors=True)
+2024-04-25 10:01:00,000 DEBUG quirks: running PreDistUpgradeCache
+a line continuing the previous message
+2024-04-25 10:03:00,000 DEBUG quirks: running PostDistUpgradeCache
+2024-04-25 10:04:00,000 DEBUG quirks: running StartUpgrade
+2024-04-25 10:20:00,000 DEBUG doPostUpgrade
+2024-04-25 10:20:30,000 DEBUG quirks: running PostUpgrade
+2024-04-25 10:21:00,000 INFO cache.commit()
+"""
+
+
+class ParseMainLogTestCases(unittest.TestCase):
+    def test_phases_run_until_the_next_one_starts(self):
+        phases = _u.parse_main_log(MAIN_LOG.splitlines())
+        self.assertEqual(
+            [(p.name, p.end - p.start) for p in phases],
+            [
+                ("fetch", 60),
+                ("calculation", 120),
+                ("download", 60),
+                ("install", 960),
+                ("cleanup", 60),
+            ],
+        )
+
+    def test_missing_phase_is_left_out(self):
+        lines = [
+            line
+            for line in MAIN_LOG.splitlines()
+            if "PostDistUpgradeCache" not in line
+        ]
+        phases = _u.parse_main_log(lines)
+        self.assertEqual(
+            [p.name for p in phases],
+            ["fetch", "calculation", "install", "cleanup"],
+        )
+        profile = _u.UpgraderProfile("main.log", phases, 0, 0)
+        self.assertEqual(_u.bottleneck(profile), "dpkg")
+        self.assertIsNone(_u.throughput(profile))
+
+
+class ParseFetchedTestCases(unittest.TestCase):
+    def test_reads_size_and_duration(self):
+        self.assertEqual(
+            list(
+                _u.parse_fetched(
+                    [
+                        "Fetched 1,234 MB in 2min 3s (10.0 MB/s)",
+                        "Fetched 500 kB in 1s (500 kB/s)",
+                        "Get:1 http://archive.ubuntu.com noble InRelease",
+                    ]
+                )
+            ),
+            [(1234 * 10**6, 123), (500 * 10**3, 1)],
+        )
@@ -0,0 +1,77 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import unittest
+
+from upgrade_testing.configspec import _upgradetree as _u
+from upgrade_testing.configspec._config import ScriptStore
+
+
+class _Provisioning:
+    supports_shared_upgrades = True
+    build_key = "autopkgtest-focal-amd64-cloud.img"
+    do_release_upgrade_prompt = ""
+
+    def __init__(self, releases):
+        self.releases = releases
+        self.checkpoints = False
+        self.forked_from = None
+
+    def fork_upgrade_from(self, source, release):
+        self.forked_from = (source, release)
+
+
+class _TestSuite:
+    def __init__(self, name, releases, pre_scripts=()):
+        self.name = name
+        self.provisioning = _Provisioning(releases)
+        self.pre_upgrade_scripts = ScriptStore(list(pre_scripts), "/", {})
+        self.scripts_data = None
+
+
+class PlanSharedUpgradesTestCases(unittest.TestCase):
+    def test_shorter_paths_fork_from_longer_ones(self):
+        short = _TestSuite("short", ["focal", "jammy"])
+        full = _TestSuite("full", ["focal", "jammy", "noble"])
+
+        self.assertEqual(_u.plan_shared_upgrades([short, full]), [full, short])
+        self.assertTrue(full.provisioning.checkpoints)
+        self.assertEqual(
+            short.provisioning.forked_from, (full.provisioning, "jammy")
+        )
+
+    def test_forks_follow_their_source(self):
+        full = _TestSuite("full", ["focal", "jammy", "noble"])
+        other = _TestSuite("other", ["focal", "kinetic"])
+        short = _TestSuite("short", ["focal", "jammy"])
+
+        self.assertEqual(
+            _u.plan_shared_upgrades([full, other, short]),
+            [full, short, other],
+        )
+        self.assertIsNone(other.provisioning.forked_from)
+
+    def test_suites_with_different_pre_scripts_dont_share(self):
+        first = _TestSuite("first", ["focal", "jammy"], ["setup_a"])
+        second = _TestSuite("second", ["focal", "jammy"], ["setup_b"])
+
+        _u.plan_shared_upgrades([first, second])
+
+        self.assertIsNone(second.provisioning.forked_from)
+        self.assertFalse(first.provisioning.checkpoints)
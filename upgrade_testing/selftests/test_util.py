@@ -0,0 +1,75 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from upgrade_testing.provisioning import _util
+
+
+class ReadLineBatchesTestCases(unittest.TestCase):
+    def _batches(self, *chunks):
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, "rb") as stream:
+            with open(write_fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            tee = io.BytesIO()
+            batches = list(_util.read_line_batches(stream, tee))
+        self.assertEqual(tee.getvalue(), b"".join(chunks))
+        return [line for batch in batches for line in batch]
+
+    def test_progress_redraws_collapse_to_final_state(self):
+        self.assertEqual(
+            self._batches(b"start\n10%\r50%\r", b"100%\r\ndone"),
+            [b"start", b"100%", b"done"],
+        )
+
+    def test_line_split_between_reads_is_kept_whole(self):
+        self.assertEqual(
+            self._batches(b"hel", b"lo\r", b"\nworld\n"), [b"hello", b"world"]
+        )
+
+
+class RunCommandWithLoggedOutputTestCases(unittest.TestCase):
+    def test_logs_prefixed_lines_and_saves_raw_output(self):
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+        self.addCleanup(setattr, _util, "JOB_LOG_DIR", _util.JOB_LOG_DIR)
+        _util.JOB_LOG_DIR = log_dir
+        command = [
+            sys.executable,
+            "-c",
+            "print('a\\rb'); print('c'); raise SystemExit(3)",
+        ]
+        with self.assertLogs(_util.logger, "INFO") as logs:
+            returncode = _util.run_command_with_logged_output(
+                command, job="build"
+            )
+        self.assertEqual(returncode, 3)
+        self.assertEqual(
+            "\n".join(r.getMessage() for r in logs.records),
+            "[build] b\n[build] c",
+        )
+        with open(os.path.join(log_dir, "build.log"), "rb") as f:
+            self.assertEqual(f.read(), b"a\rb\nc\n")
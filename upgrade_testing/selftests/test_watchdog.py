@@ -0,0 +1,90 @@
+#
+# Ubuntu Upgrade Testing
+# Copyright (C) 2015 Canonical
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import subprocess
+import sys
+import time
+import unittest
+
+from upgrade_testing.configspec._config import WatchdogSettings
+from upgrade_testing.results import _watchdog as _w
+
+
+def _watchdog(now, **settings):
+    defaults = dict(
+        enabled=True,
+        fatal_patterns=[r"Kernel panic"],
+        stall_timeout=100,
+        min_cpu_load=0.1,
+    )
+    defaults.update(settings)
+    return _w.Watchdog(WatchdogSettings(**defaults), clock=lambda: now[0])
+
+
+class WatchdogTestCases(unittest.TestCase):
+    def test_aborts_on_fatal_output(self):
+        watchdog = _watchdog([0])
+        self.assertIsNone(watchdog.check_line(b"Unpacking foo ...\n"))
+        self.assertEqual(
+            watchdog.check_line(b"[ 1.0] Kernel panic - not syncing\n"),
+            "Fatal output: [ 1.0] Kernel panic - not syncing",
+        )
+
+    def test_aborts_when_idle_without_output(self):
+        now = [0]
+        watchdog = _watchdog(now)
+        # Busy for 80 seconds, then barely using any CPU.
+        for cpu_time in (0, 10, 20, 20.5):
+            self.assertIsNone(watchdog.check_progress(cpu_time))
+            now[0] += 40
+        now[0] += 40
+        self.assertEqual(
+            watchdog.check_progress(21),
+            "No output or CPU progress for 120 seconds",
+        )
+
+    def test_output_counts_as_progress(self):
+        now = [0]
+        watchdog = _watchdog(now)
+        now[0] = 90
+        watchdog.check_line("Setting up foo ...")
+        now[0] = 150
+        self.assertIsNone(watchdog.check_progress(None))
+
+
+class ProcessTreeCpuTimeTestCases(unittest.TestCase):
+    def _start(self, script):
+        proc = subprocess.Popen([sys.executable, "-c", script])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        return proc
+
+    def test_counts_testbed_outside_of_run(self):
+        run = self._start("import time; time.sleep(60)")
+        testbed = self._start("while True: pass")
+        time.sleep(0.5)
+        run_only = _w.process_tree_cpu_time(run.pid)
+        with_testbed = _w.process_tree_cpu_time(run.pid, testbed.pid)
+        self.assertGreater(with_testbed - run_only, 0.2)
+
+    def test_ignores_testbed_that_has_gone(self):
+        run = self._start("import time; time.sleep(60)")
+        testbed = self._start("pass")
+        testbed.wait()
+        self.assertIsNotNone(_w.process_tree_cpu_time(run.pid, testbed.pid))